@@ -3,31 +3,68 @@ import os
 import sys
 import json
 import argparse
-from compiler import map_to_excel
-
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--data", required=True, help="Path to extracted JSON file (e.g., gpt4o_extracted.json)")
-    parser.add_argument("--template", required=True, help="Excel template file to fill")
-    parser.add_argument("--output", help="Output Excel file (leave blank to overwrite template)")
-    args = parser.parse_args()
+from compiler import map_to_excel, map_to_excel_bulk, map_to_excel_sheets, ENGINES
+from templatespec import load_spec
+import tracing
 
+def load_records(path):
     # Load the extracted data (already in JSON format)
-    with open(args.data) as f:
+    with open(path) as f:
         data = json.load(f)
 
     # Accept both single dict or list of dicts
     if isinstance(data, dict):
-        records = [data]
+        return [data]
     elif isinstance(data, list):
-        records = data
+        return data
     else:
         raise Exception("Extracted JSON is not dict or list.")
 
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", required=True, nargs='+', help="Path(s) to extracted JSON files (e.g., gpt4o_extracted.json)")
+    parser.add_argument("--template", required=True, help="Excel template file to fill")
+    parser.add_argument("--output", help="Output Excel file (leave blank to overwrite template)")
+    parser.add_argument("--output-dir", help="Bulk mode: write one filled copy of the template per JSON file here")
+    parser.add_argument("--sheets", help="Bulk mode: write every deal as a separate sheet of this one workbook (the template sheet is kept)")
+    parser.add_argument("--workers", type=int, default=None, help="Bulk mode: processes used to write workbooks")
+    parser.add_argument("--spec", help="Template spec (JSON) describing the sheets and entities to fill; several --data files become entities named after the files")
+    parser.add_argument("--engine", default="openpyxl", choices=ENGINES, help="openpyxl: load and re-save the workbook; patch: rewrite only the sheet XML in place (faster, keeps charts and macros)")
+    parser.add_argument("--incremental", action="store_true", help="Only write cells that changed since the last fill of the output")
+    parser.add_argument("--trace", help="Write a trace (.jsonl events, or .json Chrome trace)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show debug output")
+    args = parser.parse_args()
+    tracing.setup(args.trace, args.verbose)
+
+    if args.output_dir or args.sheets:
+        deals = [(os.path.splitext(os.path.basename(path))[0], load_records(path)) for path in args.data]
+        if args.sheets:
+            map_to_excel_sheets(deals, args.template, args.sheets)
+            print(f"Done: {len(deals)} deal sheet(s) written to {args.sheets}.")
+        if args.output_dir:
+            outputs = map_to_excel_bulk(deals, args.template, args.output_dir, workers=args.workers)
+            print(f"Done: {len(outputs)} workbook(s) written to {args.output_dir}.")
+        return
+
+    if args.spec:
+        spec = load_spec(args.spec)
+        if len(args.data) > 1:
+            data = {os.path.splitext(os.path.basename(path))[0]: load_records(path) for path in args.data}
+        else:
+            with open(args.data[0]) as f:
+                data = json.load(f)
+        map_to_excel(data, args.template, args.output, spec=spec)
+        print("Done: Excel file updated.")
+        return
+
+    if len(args.data) > 1:
+        sys.exit("Several --data files need --output-dir or --sheets.")
+    records = load_records(args.data[0])
+
     # Map to Excel using your mapping function
-    map_to_excel(records, args.template, args.output)
+    map_to_excel(records, args.template, args.output, incremental=args.incremental, engine=args.engine)
 
     print("Done: Excel file updated.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
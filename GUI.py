@@ -1,18 +1,31 @@
+import time
+# Taken before the Qt import so first paint is measured from (nearly) cold start
+STARTED = time.perf_counter()
 import sys
 import os
-import json
+import logging
+import importlib
+import threading
+import multiprocessing
 import subprocess
 import platform
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QPushButton,
-    QFileDialog, QMessageBox, QLabel, QDialog, QLineEdit, QDialogButtonBox, QDesktopWidget
+    QFileDialog, QMessageBox, QLabel, QDialog, QLineEdit, QDialogButtonBox, QDesktopWidget, QCheckBox
 )
-from PyQt5.QtGui import QPixmap
-from PyQt5.QtCore import Qt
-from compiler import map_to_excel
+from PyQt5.QtGui import QPixmap, QImage
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
+import tracing
+
+log = logging.getLogger(__name__)
 
 API_KEY_FILE = "api_key.txt"
 BUTTON_WIDTH = 340
+LOGO_SIZE = 250
+THUMBNAIL_DIR = os.path.join(os.path.expanduser("~"), ".gonogo")
+# Only needed on Submit; imported in the background once the window is up.
+# openai is imported lazily by apiclient.ModelClient, which Submit builds on the UI thread.
+PRELOAD_MODULES = ("extract", "compiler", "apiclient", "openai")
 
 def resource_path(relative_path):
     if hasattr(sys, '_MEIPASS'):
@@ -21,6 +34,28 @@ def resource_path(relative_path):
 
 LOGO_PATH = resource_path("Logo.png")
 
+def logo_pixmap():
+    """
+    Returns the logo scaled to LOGO_SIZE. The full-size PNG is decoded and
+    smooth-scaled only once per logo version; later starts load the small
+    cached thumbnail from THUMBNAIL_DIR.
+    """
+    st = os.stat(LOGO_PATH)
+    thumb = os.path.join(THUMBNAIL_DIR, f"logo_{LOGO_SIZE}_{st.st_mtime_ns}_{st.st_size}.png")
+    if not os.path.exists(thumb):
+        image = QImage(LOGO_PATH).scaled(LOGO_SIZE, LOGO_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        try:
+            os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+            image.save(thumb)
+        except OSError:
+            return QPixmap.fromImage(image)
+    return QPixmap(thumb)
+
+def preload_modules():
+    with tracing.span("gui.preload", modules=len(PRELOAD_MODULES)):
+        for name in PRELOAD_MODULES:
+            importlib.import_module(name)
+
 class ApiKeyDialog(QDialog):
     def __init__(self, parent=None, current_key=""):
         super().__init__(parent)
@@ -41,6 +76,65 @@ class ApiKeyDialog(QDialog):
     def get_key(self):
         return self.input.text().strip()
 
+class ExtractWorker(QThread):
+    """
+    Runs extraction and template filling off the UI thread.
+    """
+    progress = pyqtSignal(str)
+    failed = pyqtSignal(str, str)
+    done = pyqtSignal(str)
+
+    def __init__(self, extractor, fin_files, tpl_file, parent=None, service_url=None, api_key=None, refresh=False):
+        super().__init__(parent)
+        self.extractor = extractor
+        self.fin_files = list(fin_files)
+        self.tpl_file = tpl_file
+        self.service_url = service_url
+        self.api_key = api_key
+        # Ask the model again instead of reusing cached answers
+        self.refresh = refresh
+        # Values that failed the consistency checks, shown when the job is done
+        self.issues = []
+
+    def run(self):
+        if self.service_url:
+            self.run_remote()
+            return
+        with tracing.span("gui.submit", files=len(self.fin_files)):
+            try:
+                with tracing.span("gui.extract"):
+                    data = self.extractor.extract(self.fin_files, '', progress=self.progress.emit, refresh=self.refresh,
+                                                  on_issue=self.issues.append)
+            except Exception as e:
+                self.failed.emit('Extraction Error', str(e))
+                return
+            import store
+            store.record_extraction(store.deal_name(self.fin_files), data, self.fin_files[0])
+            self.progress.emit('Filling template...')
+            try:
+                from compiler import map_to_excel
+                map_to_excel(data, self.tpl_file, None)
+            except Exception as e:
+                self.failed.emit('Compile Error', str(e))
+                return
+        self.done.emit(self.tpl_file)
+
+    def run_remote(self):
+        """
+        Hands the whole job to the shared service and relays its progress.
+        """
+        import service
+        try:
+            job = service.submit_job(self.service_url, api_key=self.api_key, files=self.fin_files,
+                                     template=self.tpl_file, tenant=os.environ.get('USER'), refresh=self.refresh)
+            self.progress.emit(f"Queued as job {job['id']}...")
+            status = service.wait_for_job(self.service_url, job['id'], progress=self.progress.emit,
+                                          tenant=job['tenant'])
+        except Exception as e:
+            self.failed.emit('Service Error', str(e))
+            return
+        self.done.emit(status["output"])
+
 class FinancialAnalysis(QWidget):
     def __init__(self):
         super().__init__()
@@ -50,6 +144,9 @@ class FinancialAnalysis(QWidget):
         self.fin_files = []
         self.tpl_file = None
         self.api_key = ""
+        self.extractor = None
+        self.worker = None
+        self.painted = False
         if os.path.exists(API_KEY_FILE):
             with open(API_KEY_FILE, 'r') as f:
                 self.api_key = f.read().strip()
@@ -58,8 +155,7 @@ class FinancialAnalysis(QWidget):
         # Logo
         if os.path.exists(LOGO_PATH):
             logo_label = QLabel()
-            pixmap = QPixmap(LOGO_PATH)
-            logo_label.setPixmap(pixmap.scaled(250, 250, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+            logo_label.setPixmap(logo_pixmap())
             logo_label.setAlignment(Qt.AlignCenter)
             main_layout.addWidget(logo_label)
         # Upload financial files
@@ -87,12 +183,29 @@ class FinancialAnalysis(QWidget):
         self.api_status.setAlignment(Qt.AlignCenter)
         main_layout.addWidget(self.api_status)
         # Submit Button
-        submit_btn = QPushButton('Submit')
-        submit_btn.setFixedWidth(BUTTON_WIDTH)
-        submit_btn.clicked.connect(self.submit)
-        main_layout.addWidget(submit_btn)
+        self.submit_btn = QPushButton('Submit')
+        self.submit_btn.setFixedWidth(BUTTON_WIDTH)
+        self.submit_btn.clicked.connect(self.submit)
+        main_layout.addWidget(self.submit_btn)
+        # Re-extract option
+        self.refresh_box = QCheckBox('Re-extract (ignore cached answers)')
+        main_layout.addWidget(self.refresh_box, alignment=Qt.AlignCenter)
+        self.status_label = QLabel('')
+        self.status_label.setAlignment(Qt.AlignCenter)
+        self.status_label.setWordWrap(True)
+        main_layout.addWidget(self.status_label)
         self.setLayout(main_layout)
 
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.painted:
+            self.painted = True
+            elapsed_ms = round((time.perf_counter() - STARTED) * 1000, 1)
+            log.debug(f"First paint after {elapsed_ms} ms")
+            tracing.count("gui.first_paint_ms", elapsed_ms)
+            # Warm up the heavy modules now that the window is visible
+            QTimer.singleShot(0, lambda: threading.Thread(target=preload_modules, daemon=True).start())
+
     def center(self):
         qr = self.frameGeometry()
         cp = QDesktopWidget().availableGeometry().center()
@@ -157,38 +270,45 @@ class FinancialAnalysis(QWidget):
         if not self.tpl_file:
             QMessageBox.warning(self, 'Error', 'Upload an Excel template.')
             return
-        extractor = os.path.join(os.path.dirname(__file__), 'extract.py')
-        json_path = os.path.join(os.getcwd(), 'gpt4o_extracted.json')
-        args = [
-            sys.executable, extractor,
-            '--key', self.api_key,
-            '--prompt', '',  # Prompt left blank for hardcoded
-            *self.fin_files
-        ]
-        try:
-            subprocess.run(args, check=True)
-        except Exception as e:
-            QMessageBox.critical(self, 'Extraction Error', str(e))
-            return
-        if not os.path.isfile(json_path):
-            QMessageBox.critical(self, 'Extraction Error', 'Extraction did not produce output file.')
-            return
-        # Now fill the Excel template
-        try:
-            with open(json_path) as f:
-                data = json.load(f)
-            map_to_excel(data, self.tpl_file, None)
-        except Exception as e:
-            QMessageBox.critical(self, 'Compile Error', str(e))
-            return
+        # With a shared service running (GONOGO_SERVICE), jobs run there instead of in this process
+        import service
+        service_url = service.service_url()
+        # Keep one extractor (and its pooled HTTP client) per API key across submits
+        if not service_url and (self.extractor is None or self.extractor.api_key != self.api_key):
+            from extract import Extractor, ExtractionCache
+            self.extractor = Extractor(self.api_key, cache=ExtractionCache())
+        self.worker = ExtractWorker(self.extractor, self.fin_files, self.tpl_file, self,
+                                    service_url=service_url, api_key=self.api_key,
+                                    refresh=self.refresh_box.isChecked())
+        self.worker.progress.connect(self.status_label.setText)
+        self.worker.failed.connect(self.on_failed)
+        self.worker.done.connect(self.on_done)
+        self.worker.finished.connect(lambda: self.submit_btn.setEnabled(True))
+        self.submit_btn.setEnabled(False)
+        self.status_label.setText('Starting...')
+        self.worker.start()
+
+    def on_failed(self, title, message):
+        self.status_label.setText('')
+        if title in ('Extraction Error', 'Service Error'):
+            # A bad cached answer would fail the same way again; retry against the model
+            self.refresh_box.setChecked(True)
+        QMessageBox.critical(self, title, message)
+
+    def on_done(self, path):
+        self.status_label.setText('')
+        import derive
+        checks = ''.join(f'\n  {derive.describe(issue)}' for issue in self.worker.issues)
         open_reply = QMessageBox.question(
             self,
             'Processing complete',
-            f'Excel file updated: {self.tpl_file}\n\nOpen now?',
+            f'Excel file updated: {path}\n\n'
+            + (f'Please check these values:{checks}\n\n' if checks else '')
+            + 'Open now?',
             QMessageBox.Yes | QMessageBox.No
         )
         if open_reply == QMessageBox.Yes:
-            self.open_file(self.tpl_file)
+            self.open_file(path)
 
     def open_file(self, filepath):
         if platform.system() == 'Darwin':       # macOS
@@ -199,6 +319,11 @@ class FinancialAnalysis(QWidget):
             subprocess.run(['xdg-open', filepath])
 
 if __name__ == '__main__':
+    # Page rendering and OCR use process pools; in the frozen (PyInstaller) build
+    # each worker re-runs this executable and must stop here instead of opening a window
+    multiprocessing.freeze_support()
+    # Tracing and log level come from GONOGO_TRACE / GONOGO_LOG_LEVEL
+    tracing.setup()
     app = QApplication(sys.argv)
     win = FinancialAnalysis()
     win.show()
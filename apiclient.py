@@ -0,0 +1,193 @@
+import time
+import random
+import logging
+import threading
+from io import BytesIO
+
+import tracing
+import imageopt
+
+log = logging.getLogger(__name__)
+
+# Defaults sized for a typical GPT-4o tier; override per account
+DEFAULT_RPM = 500
+DEFAULT_TPM = 300000
+DEFAULT_TIMEOUT = 120.0
+MAX_RETRIES = 5
+# Rough size of one text token, used before the API tells us the real count
+CHARS_PER_TOKEN = 4
+
+class RateLimiter:
+    """
+    Token buckets for requests per minute and tokens per minute. acquire()
+    blocks until both buckets have room. The effective rate is adaptive: a 429
+    halves it, every success recovers it by a few percent up to the configured
+    limits, so throughput settles just under the account's real limit.
+    """
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.scale = 1.0
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._last = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm * self.scale / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm * self.scale / 60)
+
+    def acquire(self, tokens, deadline=None):
+        # A single request larger than the whole bucket would wait forever
+        tokens = min(tokens, self.tpm)
+        with self._cond:
+            while True:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                need_r = max(0.0, 1 - self._requests) / (self.rpm * self.scale / 60)
+                need_t = max(0.0, tokens - self._tokens) / (self.tpm * self.scale / 60)
+                wait = max(need_r, need_t, 0.01)
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    raise TimeoutError("Rate limit wait would exceed the request deadline")
+                tracing.count("ratelimit.wait_s", round(wait, 3))
+                self._cond.wait(wait)
+
+    def on_rate_limited(self, tokens=0):
+        # The rejected request did not use its tokens; give them back, but stop
+        # sending until the request bucket refills at the reduced rate
+        with self._cond:
+            self.scale = max(0.05, self.scale / 2)
+            self._requests = min(self._requests, 0.0)
+            self._tokens = min(self.tpm, self._tokens + min(tokens, self.tpm))
+
+    def on_success(self):
+        with self._cond:
+            self.scale = min(1.0, self.scale * 1.05)
+
+def estimate_text_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def estimate_page_tokens(page, detail=None):
+    """
+    Estimated input tokens for one page: text pages by length, images from
+    their pixel size using the model's tiling rules.
+    """
+    if isinstance(page, str):
+        return estimate_text_tokens(page)
+    try:
+        from PIL import Image
+        with Image.open(BytesIO(page)) as img:
+            width, height = img.size
+    except Exception:
+        return imageopt.BASE_TOKENS + imageopt.TILE_TOKENS * 6
+    return imageopt.estimate_tokens(width, height, detail or 'high')
+
+def estimate_message_tokens(messages):
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += estimate_text_tokens(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                total += estimate_text_tokens(part["text"])
+            else:
+                # Image parts are costed by the caller from the raw page; assume high detail
+                total += imageopt.BASE_TOKENS + imageopt.TILE_TOKENS * 4
+    return total
+
+class ModelClient:
+    """
+    Shared, connection-pooled OpenAI client with per-request timeouts, overall
+    deadlines, exponential backoff with jitter on 429/5xx/timeouts and an
+    adaptive RPM/TPM limiter. One instance per API key is shared by the whole
+    process (see get_client), so concurrent callers share the rate budget.
+    """
+    def __init__(self, api_key, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, timeout=DEFAULT_TIMEOUT, max_retries=MAX_RETRIES):
+        # openai takes most of a second to import; only pay for it once a client is needed
+        import openai
+        self._retryable = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                           openai.InternalServerError)
+        self._rate_limited = openai.RateLimitError
+        # Retries are handled here so they go through the limiter
+        self.client = openai.OpenAI(api_key=api_key, timeout=timeout, max_retries=0)
+        self.limiter = RateLimiter(rpm, tpm)
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+    def configure(self, rpm=None, tpm=None, timeout=None, max_retries=None):
+        if rpm:
+            self.limiter.rpm = rpm
+        if tpm:
+            self.limiter.tpm = tpm
+        if timeout:
+            self.timeout = timeout
+        if max_retries is not None:
+            self.max_retries = max_retries
+
+    def request_budget(self, max_output_tokens=0):
+        """
+        Largest input a single request may carry without exceeding the TPM budget.
+        """
+        return max(1, self.limiter.tpm - max_output_tokens)
+
+    def chat(self, estimated_tokens=None, deadline=None, **request):
+        """
+        Calls chat.completions.create. estimated_tokens (input + max output)
+        is charged against the TPM budget before sending; deadline is an
+        overall time budget in seconds covering waits and retries.
+        """
+        if estimated_tokens is None:
+            estimated_tokens = estimate_message_tokens(request.get("messages", []))
+        estimated_tokens += request.get("max_tokens") or 0
+        end = time.monotonic() + deadline if deadline else None
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(estimated_tokens, end)
+            timeout = self.timeout
+            if end is not None:
+                timeout = max(1.0, min(timeout, end - time.monotonic()))
+            try:
+                resp = self.client.chat.completions.create(timeout=timeout, **request)
+                self.limiter.on_success()
+                return resp
+            except self._retryable as e:
+                if isinstance(e, self._rate_limited):
+                    self.limiter.on_rate_limited(estimated_tokens)
+                if attempt == self.max_retries:
+                    raise
+                delay = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+                retry_after = getattr(getattr(e, 'response', None), 'headers', {}).get('retry-after')
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                if end is not None and time.monotonic() + delay > end:
+                    raise
+                log.warning(f"{type(e).__name__}; retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+                tracing.count("model.retry", error=type(e).__name__)
+                time.sleep(delay)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(api_key, **options):
+    """
+    Returns the process-wide ModelClient for api_key, creating it on first use.
+    Options (rpm, tpm, timeout, max_retries) also update an existing client.
+    """
+    options = {k: v for k, v in options.items() if v is not None}
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = _clients[api_key] = ModelClient(api_key, **options)
+        elif options:
+            client.configure(**options)
+        return client
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+import os
+import sys
+import csv
+import json
+import time
+import queue
+import hashlib
+import logging
+import argparse
+import threading
+
+from extract import Extractor, finish_records, ExtractionCache, DEFAULT_CACHE_PATH, SPREADSHEET_EXTS, IMAGE_EXTS, ENGINES
+from compiler import map_to_excel
+import tracing
+import apiclient
+import dedup
+import store
+
+log = logging.getLogger(__name__)
+
+INPUT_EXTS = ('.pdf',) + SPREADSHEET_EXTS + IMAGE_EXTS
+STAGES = ('render', 'model', 'fill')
+_DONE = object()
+
+def load_manifest(path, template=None, output_dir=None):
+    """
+    Reads the deals to process. Accepts:
+      - a directory: every sub-directory is a deal and its files are the inputs;
+      - a .csv with columns deal, files (';'-separated), template, output;
+      - a .jsonl with one {"deal", "files", "template", "output"} object per line.
+    template / output_dir fill in anything a row leaves blank.
+    """
+    jobs = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            deal_dir = os.path.join(path, name)
+            if not os.path.isdir(deal_dir):
+                continue
+            files = sorted(
+                os.path.join(name, f) for f in os.listdir(deal_dir)
+                if f.lower().endswith(INPUT_EXTS) and not f.startswith('~$')
+            )
+            if files:
+                jobs.append({"deal": name, "files": files})
+    elif path.lower().endswith('.jsonl'):
+        with open(path) as f:
+            jobs = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                row["files"] = [p.strip() for p in row.get("files", "").split(';') if p.strip()]
+                jobs.append(row)
+
+    base = path if os.path.isdir(path) else os.path.dirname(os.path.abspath(path))
+    for job in jobs:
+        job["deal"] = str(job.get("deal") or os.path.splitext(os.path.basename(job["files"][0]))[0])
+        job["files"] = [f if os.path.isabs(f) else os.path.join(base, f) for f in job["files"]]
+        job["template"] = job.get("template") or template
+        if not job["template"]:
+            raise ValueError(f"No template for deal {job['deal']}")
+        if not job.get("output"):
+            job["output"] = os.path.join(output_dir or base, f"{job['deal']}.xlsx")
+    return jobs
+
+class JobState:
+    """
+    Per-deal progress persisted as JSON after every change, so an interrupted
+    batch resumes where it stopped: finished deals are skipped and deals whose
+    extraction completed go straight to filling. The state file holds only
+    status, timings and paths; each deal's extracted records are written once
+    to their own file in the <state>.records directory next to it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.records_dir = os.path.splitext(path)[0] + '.records'
+        self._lock = threading.Lock()
+        self.jobs = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.jobs = json.load(f)
+
+    def get(self, deal):
+        return self.jobs.get(deal, {})
+
+    def update(self, deal, **fields):
+        with self._lock:
+            self.jobs.setdefault(deal, {}).update(fields)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.jobs, f, indent=2)
+            os.replace(tmp, self.path)
+
+    def records_path(self, deal):
+        # Deal names can hold any character; the digest keeps similar names apart
+        safe = ''.join(ch if ch.isalnum() or ch in '-_' else '_' for ch in deal)[:60]
+        digest = hashlib.sha256(deal.encode('utf-8')).hexdigest()[:10]
+        return os.path.join(self.records_dir, f"{safe}-{digest}.json")
+
+    def save_records(self, deal, records):
+        """
+        Writes a deal's extracted records to their file and marks it extracted.
+        """
+        path = self.records_path(deal)
+        os.makedirs(self.records_dir, exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(records, f)
+        os.replace(tmp, path)
+        self.update(deal, status="extracted", records_path=path)
+
+    def load_records(self, deal):
+        entry = self.get(deal)
+        if "records_path" not in entry:
+            # State files written before records moved out keep them inline
+            return entry["records"]
+        with open(entry["records_path"]) as f:
+            return json.load(f)
+
+    def add_timing(self, deal, stage, seconds):
+        with self._lock:
+            timings = dict(self.jobs.get(deal, {}).get("timings", {}))
+        timings[stage] = round(seconds, 3)
+        self.update(deal, timings=timings)
+
+def _run_stage(stage, fn, inq, outq, workers, state):
+    """
+    Starts `workers` threads that take jobs from inq, apply fn and pass the
+    result on to outq. Failures are recorded in the state and the job dropped.
+    """
+    remaining = [workers]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            item = inq.get()
+            if item is _DONE:
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if not last:
+                    # Pass the marker on so every sibling worker sees it
+                    inq.put(_DONE)
+                elif outq is not None:
+                    outq.put(_DONE)
+                return
+            deal = item["job"]["deal"]
+            start = time.perf_counter()
+            try:
+                with tracing.span(f"batch.{stage}", deal=deal):
+                    result = fn(item)
+            except Exception as e:
+                state.update(deal, status="failed", stage=stage, error=f"{type(e).__name__}: {e}")
+                log.error(f"[{deal}] {stage} failed: {e}")
+                continue
+            finally:
+                state.add_timing(deal, stage, time.perf_counter() - start)
+            if outq is not None:
+                outq.put(result)
+
+    threads = [threading.Thread(target=worker, name=f"{stage}-{i}", daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+    return threads
+
+def run_batch(jobs, api_key, prompt='', state_path='batch_state.json', model_workers=4, fill_workers=1,
+              queue_size=4, cache=None, render_options=None, chunk_size=0, concurrency=4,
+              max_pages=None, min_score=0.0, limits=None, engine='model', years=None, store_path=None):
+    """
+    Runs extract → compile for every job as three concurrent stages connected by
+    bounded queues: render (plan + rasterize pages), model (API calls) and fill
+    (write the workbook). Model workers share one rate-limited client, so
+    limits (rpm / tpm / timeout) apply to the whole batch. With store_path, every
+    extracted deal is added to the historical store there. Returns the summary report.
+    """
+    extractor = Extractor(api_key, cache=cache, chunk_size=chunk_size, concurrency=concurrency,
+                          render_options=render_options, max_pages=max_pages, min_score=min_score, limits=limits,
+                          engine=engine, years=years)
+    state = JobState(state_path)
+    render_q = queue.Queue()
+    model_q = queue.Queue(maxsize=queue_size)
+    fill_q = queue.Queue(maxsize=queue_size)
+
+    def render(item):
+        job = item["job"]
+        records, specs, _ = extractor.plan(job["files"])
+        deduper = dedup.PageDeduper() if extractor.dedup else None
+        pages = list(extractor.iter_pages(specs, deduper))
+        if deduper is not None and deduper.duplicates:
+            state.update(job["deal"], duplicates=deduper.duplicates)
+        return {"job": job, "records": records, "pages": pages}
+
+    def model(item):
+        job = item["job"]
+        if item["pages"]:
+            records = extractor.extract_pages(item["pages"], prompt, item["records"])
+        else:
+            records = finish_records(item["records"])
+        state.save_records(job["deal"], records)
+        if store_path:
+            store.record_extraction(job["deal"], records, job["output"], store_path)
+        return {"job": job, "records": records}
+
+    def fill(item):
+        job = item["job"]
+        if os.path.dirname(job["output"]):
+            os.makedirs(os.path.dirname(job["output"]), exist_ok=True)
+        map_to_excel(item["records"], job["template"], job["output"])
+        state.update(job["deal"], status="done", output=job["output"], error=None)
+        log.info(f"[{job['deal']}] done -> {job['output']}")
+
+    skipped = 0
+    resumed = []
+    pending = []
+    for job in jobs:
+        previous = state.get(job["deal"])
+        if previous.get("status") == "done":
+            skipped += 1
+        elif previous.get("status") == "extracted":
+            resumed.append({"job": job, "records": state.load_records(job["deal"])})
+        else:
+            state.update(job["deal"], status="pending", stage=None, error=None)
+            pending.append({"job": job})
+
+    started = time.perf_counter()
+    threads = _run_stage('fill', fill, fill_q, None, fill_workers, state)
+    # Deals whose extraction already finished go straight to filling. They are
+    # queued before the model stage starts so its end-of-input marker comes last.
+    for item in resumed:
+        fill_q.put(item)
+    threads += _run_stage('model', model, model_q, fill_q, model_workers, state)
+    threads += _run_stage('render', render, render_q, model_q, 1, state)
+    for item in pending:
+        render_q.put(item)
+    render_q.put(_DONE)
+    for t in threads:
+        t.join()
+    extractor.close()
+
+    return summarize(jobs, state, time.perf_counter() - started, skipped)
+
+def summarize(jobs, state, wall_time, skipped=0):
+    report = {"wall_time": round(wall_time, 3), "skipped": skipped, "stages": {}, "jobs": {}}
+    for stage in STAGES:
+        times = [state.get(j["deal"]).get("timings", {}).get(stage) for j in jobs]
+        times = [t for t in times if t is not None]
+        report["stages"][stage] = {
+            "count": len(times),
+            "total": round(sum(times), 3),
+            "mean": round(sum(times) / len(times), 3) if times else 0.0,
+            "max": round(max(times), 3) if times else 0.0,
+        }
+    for job in jobs:
+        entry = state.get(job["deal"])
+        report["jobs"][job["deal"]] = {"status": entry.get("status"), "error": entry.get("error")}
+    statuses = [j["status"] for j in report["jobs"].values()]
+    report["done"] = statuses.count("done")
+    report["failed"] = statuses.count("failed")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Run extract → compile for many deals")
+    parser.add_argument('manifest', help='Directory of deal folders, or a .csv/.jsonl manifest')
+    parser.add_argument('--key', help='OpenAI API key (not needed with --engine offline)')
+    parser.add_argument('--prompt', default='', help='User extraction prompt')
+    parser.add_argument('--template', help='Default Excel template for deals that do not name one')
+    parser.add_argument('--output-dir', help='Where filled workbooks go when a deal has no output path')
+    parser.add_argument('--state', default='batch_state.json', help='Per-deal state file used to resume')
+    parser.add_argument('--report', default='batch_report.json', help='Summary report path')
+    parser.add_argument('--model-workers', type=int, default=4, help='Deals sent to the model concurrently')
+    parser.add_argument('--fill-workers', type=int, default=1, help='Workbooks filled concurrently')
+    parser.add_argument('--queue-size', type=int, default=4, help='Deals buffered between stages')
+    parser.add_argument('--workers', type=int, default=None, help='Rendering processes (default: CPU count)')
+    parser.add_argument('--chunk-size', type=int, default=0, help='Pages per request; 0 sends all pages in one request')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent requests per deal in chunked mode')
+    parser.add_argument('--max-pages', type=int, default=None, help='Send only the N most relevant pages')
+    parser.add_argument('--min-score', type=float, default=0.0, help='Drop pages scoring below this relevance (0-1)')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the extraction cache')
+    parser.add_argument('--engine', default='model', choices=ENGINES, help='model: whole pages to GPT; ocr: local OCR, only uncertain cells to GPT; offline: local only')
+    parser.add_argument('--store', default=store.DEFAULT_STORE_PATH, help='Historical store the extracted deals are added to')
+    parser.add_argument('--no-store', action='store_true', help='Do not add the deals to the historical store')
+    parser.add_argument('--years', type=int, nargs='+', default=None, help='Years to extract (default: detected per deal)')
+    parser.add_argument('--rpm', type=int, default=apiclient.DEFAULT_RPM, help='Account requests-per-minute limit')
+    parser.add_argument('--tpm', type=int, default=apiclient.DEFAULT_TPM, help='Account tokens-per-minute limit')
+    parser.add_argument('--timeout', type=float, default=apiclient.DEFAULT_TIMEOUT, help='Seconds before a model request is retried')
+    parser.add_argument('--trace', help='Write a trace (.jsonl events, or .json Chrome trace)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show debug output')
+    args = parser.parse_args()
+    tracing.setup(args.trace, args.verbose)
+    if not args.key and args.engine != 'offline':
+        parser.error('--key is required unless --engine offline')
+
+    jobs = load_manifest(args.manifest, args.template, args.output_dir)
+    cache = None if args.no_cache else ExtractionCache(DEFAULT_CACHE_PATH)
+    print(f"Processing {len(jobs)} deal(s)...")
+    report = run_batch(
+        jobs, args.key, args.prompt, state_path=args.state, model_workers=args.model_workers,
+        fill_workers=args.fill_workers, queue_size=args.queue_size, cache=cache,
+        render_options={"workers": args.workers}, chunk_size=args.chunk_size, concurrency=args.concurrency,
+        max_pages=args.max_pages, min_score=args.min_score,
+        limits={"rpm": args.rpm, "tpm": args.tpm, "timeout": args.timeout}, engine=args.engine,
+        years=args.years, store_path=None if args.no_store else args.store
+    )
+    if cache is not None:
+        report["cache"] = cache.stats()
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    for stage, t in report["stages"].items():
+        print(f"{stage:>6}: {t['count']} job(s), total {t['total']}s, mean {t['mean']}s, max {t['max']}s")
+    print(f"Done: {report['done']}, failed: {report['failed']}, skipped: {report['skipped']} "
+          f"in {report['wall_time']}s. Report saved to {args.report}")
+    sys.exit(1 if report["failed"] else 0)
+
+if __name__ == "__main__":
+    main()
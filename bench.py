@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import argparse
+import platform
+import threading
+import subprocess
+from io import BytesIO
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import openpyxl
+from PIL import Image, ImageDraw
+
+import extract
+import compiler
+
+def make_records(years, seed=0):
+    rng = random.Random(seed)
+    return [
+        {"year": yr, **{field: rng.randint(0, 5000000) for field in extract.SCHEMA_FIELDS}}
+        for yr in years
+    ]
+
+def make_pdf(path, pages, years, seed=0):
+    """
+    Writes a synthetic scanned-style statement: every page is an image of a
+    P&L table, so it exercises the rasterization path like a real scan.
+    """
+    rng = random.Random(seed)
+    images = []
+    for page in range(pages):
+        img = Image.new('RGB', (1700, 2200), 'white')
+        draw = ImageDraw.Draw(img)
+        draw.text((150, 120), f"Synthetic Pty Ltd - Profit and Loss (page {page + 1})", fill='black')
+        draw.text((900, 200), '   '.join(str(y) for y in years), fill='black')
+        for i, field in enumerate(extract.SCHEMA_FIELDS * 3):
+            y = 260 + i * 32
+            if y > 2100:
+                break
+            draw.text((150, y), field, fill='black')
+            draw.text((900, y), '   '.join(f"{rng.randint(0, 5000000):,}" for _ in years), fill='black')
+        images.append(img)
+    images[0].save(path, save_all=True, append_images=images[1:], resolution=200.0)
+    return path
+
+def make_template(path, years, extra_rows=0):
+    """
+    Writes a template shaped like the real one: years in row 3, categories in
+    column B, a total formula per year, plus extra_rows of filler to scale it up.
+    """
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "P&L"
+    ws.cell(row=1, column=2, value="Synthetic deal")
+    for j, yr in enumerate(years):
+        ws.cell(row=3, column=3 + j, value=yr)
+    fields = list(compiler.category_mapping.values())
+    for i, field in enumerate(fields):
+        ws.cell(row=4 + i, column=2, value=field)
+    total_row = 4 + len(fields)
+    ws.cell(row=total_row, column=2, value="Total")
+    for j in range(len(years)):
+        col = openpyxl.utils.get_column_letter(3 + j)
+        ws.cell(row=total_row, column=3 + j, value=f"=SUM({col}4:{col}{total_row - 1})")
+    for r in range(extra_rows):
+        row = total_row + 2 + r
+        ws.cell(row=row, column=2, value=f"Note line {r}")
+        for j in range(len(years)):
+            ws.cell(row=row, column=3 + j, value=r * j)
+    wb.save(path)
+    return path
+
+class MockOpenAI:
+    """
+    Local OpenAI-compatible chat completions endpoint that answers with the
+    given records (or raw text) after a fixed latency. Counts requests and bytes received.
+    """
+    def __init__(self, records, latency=0.0):
+        self.records = records
+        self.latency = latency
+        self.requests = 0
+        self.bytes_received = 0
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                mock.requests += 1
+                mock.bytes_received += len(body)
+                time.sleep(mock.latency)
+                payload = json.dumps({
+                    "id": "mock", "object": "chat.completion", "created": 0, "model": "mock",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": mock.content()}}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                }).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def content(self):
+        # A str is sent as is, e.g. to mimic a refusal
+        return self.records if isinstance(self.records, str) else json.dumps(self.records)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Unix only; peak RSS is not reported on Windows
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return rss / (1024 * 1024) if platform.system() == 'Darwin' else rss / 1024
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return samples, result
+
+def summarize(samples, units=None, unit_name=None):
+    out = {
+        "runs": len(samples),
+        "p50_s": round(percentile(samples, 50), 6),
+        "p95_s": round(percentile(samples, 95), 6),
+        "mean_s": round(sum(samples) / len(samples), 6) if samples else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    if units and samples:
+        out[f"{unit_name}_per_s"] = round(units / out["p50_s"], 2) if out["p50_s"] else None
+    return out
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run(pages=10, years=6, extra_rows=1000, repeat=5, latency=0.2, workers=None, workdir=None):
+    years = list(range(2025 - years + 1, 2026))
+    workdir = workdir or tempfile.mkdtemp(prefix='gonogo-bench-')
+    pdf = make_pdf(os.path.join(workdir, 'statement.pdf'), pages, years)
+    template = make_template(os.path.join(workdir, 'template.xlsx'), years, extra_rows)
+    output = os.path.join(workdir, 'filled.xlsx')
+    records = make_records(years)
+    results = {"params": {"pages": pages, "years": len(years), "extra_rows": extra_rows, "repeat": repeat,
+                          "latency_s": latency, "workers": workers}, "stages": {}}
+    stages = results["stages"]
+
+    # Cold start of each CLI: a fresh interpreter up to parsed arguments
+    here = os.path.dirname(os.path.abspath(__file__))
+    for script in ('extract.py', 'GPT.py', 'batch.py'):
+        samples, _ = timed(lambda: subprocess.run([sys.executable, os.path.join(here, script), '--help'],
+                                                  capture_output=True, check=True), repeat)
+        stages[f"startup.{os.path.splitext(script)[0]}"] = summarize(samples)
+
+    # Rasterization needs poppler; report it as skipped rather than failing the run
+    images = []
+    try:
+        samples, images = timed(lambda: extract.pdfs_to_images([pdf], workers=workers), repeat)
+        stages["pdfs_to_images"] = summarize(samples, pages, "pages")
+    except Exception as e:
+        stages["pdfs_to_images"] = {"skipped": f"{type(e).__name__}: {e}"}
+        buf = BytesIO()
+        Image.new('RGB', (1700, 2200), 'white').save(buf, format='PNG')
+        images = [buf.getvalue()] * pages
+
+    with MockOpenAI(records, latency) as mock:
+        os.environ['OPENAI_BASE_URL'] = mock.base_url
+        # Untimed: the first call pays the lazy openai import and client setup
+        extract.vision_extract('sk-bench', images, '')
+        samples, output_text = timed(lambda: extract.vision_extract('sk-bench', images, ''), repeat)
+        stages["vision_extract"] = summarize(samples, pages, "pages")
+        stages["vision_extract"]["request_bytes"] = mock.bytes_received // max(1, mock.requests)
+        stages["vision_extract"]["mock_latency_s"] = latency
+        os.environ.pop('OPENAI_BASE_URL', None)
+
+    samples, _ = timed(lambda: extract.extract_json_from_output(output_text), repeat * 20)
+    stages["extract_json_from_output"] = summarize(samples, len(records), "records")
+
+    load, index, write, save = [], [], [], []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        wb = openpyxl.load_workbook(template)
+        ws = wb.active
+        t1 = time.perf_counter()
+        layout = compiler.scan_layout(ws)
+        t2 = time.perf_counter()
+        compiler.fill_worksheet(ws, layout, records)
+        t3 = time.perf_counter()
+        wb.save(output)
+        t4 = time.perf_counter()
+        load.append(t1 - t0)
+        index.append(t2 - t1)
+        write.append(t3 - t2)
+        save.append(t4 - t3)
+    stages["map_to_excel.load"] = summarize(load)
+    stages["map_to_excel.index"] = summarize(index)
+    stages["map_to_excel.write"] = summarize(write)
+    stages["map_to_excel.save"] = summarize(save)
+
+    # Whole fill through each engine: openpyxl load/save vs patching the sheet XML in the zip
+    for engine in compiler.ENGINES:
+        samples, _ = timed(lambda: compiler.map_to_excel(records, template, output, engine=engine), repeat)
+        stages[f"map_to_excel[{engine}]"] = summarize(samples)
+
+    results["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    return results
+
+def compare(current, baseline):
+    for stage, now in current["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before or "p50_s" not in now or "p50_s" not in before:
+            continue
+        change = (now["p50_s"] - before["p50_s"]) / before["p50_s"] * 100 if before["p50_s"] else 0.0
+        print(f"{stage:<28} p50 {before['p50_s']:.4f}s -> {now['p50_s']:.4f}s ({change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the extract → compile pipeline on synthetic data")
+    parser.add_argument('--pages', type=int, default=10, help='Pages in the synthetic PDF')
+    parser.add_argument('--years', type=int, default=6, help='Years per record set / template columns')
+    parser.add_argument('--extra-rows', type=int, default=1000, help='Filler rows to make the template larger')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per stage')
+    parser.add_argument('--latency', type=float, default=0.2, help='Mock OpenAI server latency in seconds')
+    parser.add_argument('--workers', type=int, default=None, help='Rendering processes (default: CPU count)')
+    parser.add_argument('--workdir', help='Keep the generated fixtures here')
+    parser.add_argument('-o', '--output', default='bench_results.json', help='Where to save the results')
+    parser.add_argument('--compare', help='Earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    results = run(args.pages, args.years, args.extra_rows, args.repeat, args.latency, args.workers, args.workdir)
+    results["revision"] = git_revision()
+    results["python"] = sys.version.split()[0]
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    for stage, stats in results["stages"].items():
+        if "skipped" in stats:
+            print(f"{stage:<28} skipped: {stats['skipped']}")
+            continue
+        extra = ', '.join(f"{k} {v}" for k, v in stats.items() if k.endswith('_per_s'))
+        print(f"{stage:<28} p50 {stats['p50_s']:.4f}s  p95 {stats['p95_s']:.4f}s  {extra}")
+    print(f"Peak RSS: {results['peak_rss_mb']} MB. Results saved to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
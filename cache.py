@@ -0,0 +1,95 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+
+import tracing
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".gonogo", "extract_cache.sqlite")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+def cache_key(page_digests, prompt, model, temperature):
+    """
+    Content address for one model request: the hashes of the pages sent plus
+    everything else that changes the answer (prompt, model, temperature).
+    """
+    h = hashlib.sha256()
+    h.update(f"{model}\0{temperature}\0".encode('utf-8'))
+    h.update(prompt.encode('utf-8'))
+    for digest in page_digests:
+        h.update(b"\0")
+        h.update(digest.encode('ascii'))
+    return h.hexdigest()
+
+def page_digest(page):
+    if isinstance(page, str):
+        page = page.encode('utf-8')
+    return hashlib.sha256(page).hexdigest()
+
+class ExtractionCache:
+    """
+    Persistent SQLite store of raw model outputs keyed by cache_key.
+    Least recently used entries are evicted once the stored bytes exceed max_bytes.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self._db.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                tracing.count("cache.miss")
+                return None
+            self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+            tracing.count("cache.hit")
+            return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode('utf-8')), now, now)
+            )
+            self._evict()
+            self._db.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
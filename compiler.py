@@ -3,76 +3,129 @@ import os
 import sys
 import json
 import argparse
-import openai
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
-import openpyxl
+from jsonstream import RecordStreamParser
+from mapper import FieldMapper
+import tracing
+import apiclient
+import schema
+import derive
 
-def map_to_excel(json_data, excel_path, output_path=None):
+log = logging.getLogger(__name__)
+
+# Ways map_to_excel can write the workbook
+ENGINES = ('openpyxl', 'patch')
+
+YEAR_ROW_IDX = 3  # Third row: years
+CAT_COL_IDX = 2   # Column B: categories
+
+# Category mapping for spreadsheet: record field -> template label. Totals are
+# derived locally (schema.DERIVED_FIELDS); templates that compute them with formulas keep their formulas
+category_mapping = dict(schema.TEMPLATE_LABELS)
+
+# year -> column, category -> row and the formula cells of a template sheet
+TemplateLayout = namedtuple('TemplateLayout', ['years', 'cats', 'formulas'])
+
+# (template path, key) -> what was derived from that template version
+_template_cache = {}
+_template_lock = threading.Lock()
+
+def load_workbook(path, read_only=False, keep_vba=False):
+    # openpyxl is imported on first use so the CLIs start without it
+    import openpyxl
+    return openpyxl.load_workbook(path, read_only=read_only, keep_vba=keep_vba)
+
+def is_macro_workbook(path):
+    # openpyxl drops the VBA project unless asked to keep it; only an .xlsm can hold it
+    return os.path.splitext(path)[1].lower() == '.xlsm'
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def scan_layout(ws):
     """
-    Updates the existing Excel template (preserving formulas, formatting).
-    If output_path is None, will overwrite excel_path in place.
+    Builds the TemplateLayout of a worksheet in one bulk pass over its values.
     """
-    # Accept single object or list of dicts
-    if isinstance(json_data, dict) and "year" in json_data:
-        data = [json_data]
-    elif isinstance(json_data, list):
-        data = json_data
+    years = {}
+    cats = {}
+    formulas = set()
+    for row_idx, row in enumerate(ws.iter_rows(values_only=True), start=1):
+        for col_idx, val in enumerate(row, start=1):
+            if val is None:
+                continue
+            if isinstance(val, str) and val.startswith('='):
+                formulas.add((row_idx, col_idx))
+            if row_idx == YEAR_ROW_IDX:
+                key_str = str(val).strip()
+                years[key_str] = col_idx
+                try:
+                    key_int = str(int(float(val)))
+                    years[key_int] = col_idx
+                except Exception:
+                    pass
+            if col_idx == CAT_COL_IDX:
+                cats[str(val).strip()] = row_idx
+    return TemplateLayout(years, cats, frozenset(formulas))
+
+def template_cached(excel_path, key, build):
+    """
+    Returns build() for the current version of the template, computed once
+    per version. Entries are keyed on the template path and key and validated
+    by mtime/size, falling back to a content hash when those change, so a
+    batch of fills against one template pays for build only once.
+    """
+    path = os.path.abspath(excel_path)
+    st = os.stat(path)
+    key = (path, key)
+    with _template_lock:
+        entry = _template_cache.get(key)
+    if entry and entry["stat"] == (st.st_mtime_ns, st.st_size):
+        return entry["value"]
+    digest = file_digest(path)
+    if entry and entry["digest"] == digest:
+        value = entry["value"]
     else:
-        raise ValueError("Invalid JSON data format.")
+        value = build()
+    with _template_lock:
+        _template_cache[key] = {"stat": (st.st_mtime_ns, st.st_size), "digest": digest, "value": value}
+    return value
 
-    wb = openpyxl.load_workbook(excel_path)
-    ws = wb.active
+def template_layout(excel_path, ws):
+    """
+    Returns the layout of ws (the template's active sheet), parsed once per
+    template version (see template_cached).
+    """
+    return template_cached(excel_path, ("layout", ws.title), lambda: scan_layout(ws))
 
-    year_row_idx = 3  # Third row: years
-    cat_col_idx = 2   # Column B: categories
+def normalize_records(json_data):
+    # Accept single object or list of dicts
+    if isinstance(json_data, dict) and "year" in json_data:
+        return [json_data]
+    elif isinstance(json_data, list):
+        return json_data
+    raise ValueError("Invalid JSON data format.")
 
-    # Map years to column numbers
-    years = {}
-    for col in range(1, ws.max_column + 1):
-        val = ws.cell(row=year_row_idx, column=col).value
-        if val is not None:
-            key_str = str(val).strip()
-            years[key_str] = col
-            try:
-                key_int = str(int(float(val)))
-                years[key_int] = col
-            except Exception:
-                pass
-
-    # Map categories to row numbers
-    cats = {}
-    for row in range(1, ws.max_row + 1):
-        val = ws.cell(row=row, column=cat_col_idx).value
-        if val is not None:
-            key_str = str(val).strip()
-            cats[key_str] = row
-
-    print("Year columns found:", years)
-    print("Categories found in template:", list(cats.keys()))
-
-    # Category mapping for spreadsheet
-    category_mapping = {
-        "Revenue": "Revenue",
-        "Cost of Goods Sold (COGS)": "Cost of Goods Sold (COGS)",
-        "Less Operating Expenses": "Less Operating Expenses",
-        "Other Income": "Other Income",
-        "Taxes": "Taxes",
-        "Plus Depreciation & Amortization": "Plus Depreciation & Amortization",
-        "Plus Interest": "Plus Interest",
-        "Plus Taxes": "Plus Taxes",
-        "Plus Owner Salary+Super etc": "Plus Owner Salary+Super etc",
-        "Plus Owner Benefits": "Plus Owner Benefits",
-        "Manager Salary": "Manager Salary",
-        "Investor Salary": "Investor Salary",
-        "One off Revenue Adjustments": "One off Revenue Adjustments",
-        "One off Expenses Adjustments": "One off Expenses Adjustments",
-        "Other Adjustments 1": "Other Adjustments 1",
-        "Other Adjustments 2": "Other Adjustments 2",
-    }
+def worksheet_writes(layout, data):
+    """
+    Resolves the year records against a layout: {(row, col): value} for every
+    non-None value whose target cell exists and does not hold a formula.
+    """
+    years = layout.years
+    cats = layout.cats
+    writes = {}
     for entry in data:
         yr = str(entry["year"]).strip()
         if yr not in years:
-            print(f"Year {yr} not found, skipping.")
+            log.debug(f"Year {yr} not found, skipping.")
             continue
 
         for category, value in entry.items():
@@ -80,91 +133,345 @@ def map_to_excel(json_data, excel_path, output_path=None):
                 continue
             excel_cat = category_mapping.get(category)
             if not excel_cat:
-                print(f"Category '{category}' not in mapping, skipping.")
+                log.debug(f"Category '{category}' not in mapping, skipping.")
                 continue
             row = cats.get(excel_cat)
             col = years.get(yr)
             if not row or not col:
-                print(f"Category '{category}' (mapped to '{excel_cat}') or year {yr} not found, skipping.")
+                log.debug(f"Category '{category}' (mapped to '{excel_cat}') or year {yr} not found, skipping.")
                 continue
 
-            cell = ws.cell(row=row, column=col)
-            if value is None:
+            if (row, col) in layout.formulas:
+                log.debug(f"Cell for '{excel_cat}' in {yr} holds a formula, skipping.")
                 continue
-            if value == 0 and cell.value not in (None, ""):
+            if value is None or (value == 0 and writes.get((row, col))):
                 continue
-            cell.value = value
+            writes[(row, col)] = value
+    return writes
+
+def fill_worksheet(ws, layout, data):
+    """
+    Writes the year records into ws using its layout.
+    Returns {(row, col): previous value} for every cell that was written.
+    """
+    previous = {}
+    for (row, col), value in worksheet_writes(layout, data).items():
+        cell = ws.cell(row=row, column=col)
+        if value == 0 and cell.value not in (None, ""):
+            continue
+        previous.setdefault((row, col), cell.value)
+        cell.value = value
+    return previous
+
+def fill_manifest_path(save_path):
+    return save_path + '.fill.json'
+
+def record_values(data):
+    """
+    Flattens year records to {(year, field): value} for the mapped fields.
+    """
+    values = {}
+    for entry in data:
+        yr = str(entry["year"]).strip()
+        for field, value in entry.items():
+            if field != "year" and value is not None and field in category_mapping:
+                values[(yr, field)] = value
+    return values
+
+def record_cells(layout, values):
+    """
+    {(year, field): (row, col)} for the keys of values that have a cell in the layout.
+    """
+    cells = {}
+    for yr, field in values:
+        row = layout.cats.get(category_mapping[field])
+        col = layout.years.get(yr)
+        if row is not None and col is not None:
+            cells[(yr, field)] = (row, col)
+    return cells
+
+def _nest(values):
+    nested = {}
+    for (yr, field), value in values.items():
+        nested.setdefault(yr, {})[field] = value
+    return nested
+
+def _flatten(nested):
+    return {(yr, field): v for yr, fields in nested.items() for field, v in fields.items()}
 
+def load_fill_manifest(save_path, template_digest=None):
+    """
+    The manifest of the last incremental fill of save_path, or None if there
+    is none or it can no longer be trusted: the workbook was edited since, or
+    (when filling a separate output) the template it was filled from changed.
+    """
+    path = fill_manifest_path(save_path)
+    if not os.path.exists(path) or not os.path.exists(save_path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    # Someone edited or replaced the workbook since our last write: don't trust the manifest
+    if manifest.get("mtime_ns") != os.stat(save_path).st_mtime_ns:
+        return None
+    if manifest.get("template_digest") != template_digest:
+        log.info(f"Template changed since the last fill of {save_path}; filling from scratch.")
+        return None
+    return manifest
+
+def save_fill_manifest(save_path, sheet, requested, written, template_digest=None):
+    """
+    requested: every (year, field) value asked for, used to detect changes;
+    written: the values that actually reached their cells.
+    """
+    manifest = {"sheet": sheet, "mtime_ns": os.stat(save_path).st_mtime_ns, "template_digest": template_digest,
+                "requested": _nest(requested), "cells": _nest(written)}
+    with open(fill_manifest_path(save_path), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+def _fill_log(layout, values, previous, report=True):
+    """
+    Returns the part of values that actually reached its cells, logging each
+    change when report is set. previous is {(row, col): old value} of the
+    cells that were written.
+    """
+    cells = record_cells(layout, values)
+    written = {}
+    for key, value in sorted(values.items()):
+        cell = cells.get(key)
+        if cell in previous:
+            written[key] = value
+        if not report:
+            continue
+        if cell in previous:
+            log.info(f"{key[0]} {key[1]}: {previous[cell]} -> {value}")
+        else:
+            log.info(f"{key[0]} {key[1]}: {value} not written (no cell, a formula, or 0 over an existing value)")
+    return written
+
+def map_to_excel(json_data, excel_path, output_path=None, incremental=False, spec=None, engine='openpyxl'):
+    """
+    Updates the existing Excel template (preserving formulas, formatting).
+    If output_path is None, will overwrite excel_path in place.
+    With a template spec (see templatespec.load_spec) any number of sheets and
+    entities are filled through a precompiled write plan instead of the active
+    sheet's fixed layout; json_data may then be {entity: records}.
+    With incremental=True the values asked for and those actually written
+    are remembered in a sidecar manifest (<output>.fill.json), along with the
+    template's digest when the output is a separate file; later runs only
+    touch cells whose value changed, skip loading and saving entirely when
+    nothing did (and the template is unchanged), and print a change log.
+    """
+    if spec is not None:
+        if incremental:
+            raise ValueError("Incremental fills are not supported with a template spec.")
+        import templatespec
+        templatespec.fill_workbook(json_data, excel_path, spec, output_path)
+        return
+    data = normalize_records(json_data)
     save_path = output_path if output_path else excel_path
-    wb.save(save_path)
-    print(f"Saved to {save_path}")
-
-def extract_with_gpt(extracted_data: dict, user_prompt: str, api_key: str) -> dict:
-    client = openai.OpenAI(api_key=api_key)
-
-    # Categories must match the spreadsheet template labels exactly:
-    fixed_categories_example = category_mapping = {
-    "Revenue": "Revenue",
-    "Cost of Goods Sold (COGS)": "Cost of Goods Sold (COGS)",
-    "Operating Expenses": "Less Operating Expenses",
-    "Other Income": "Other Income",
-    "Owner Salary+Super": "Plus Owner Salary+Super etc",
-    "Plus Owner Salary+Super etc": "Plus Owner Salary+Super etc",
-    "Owner Benefits": "Plus Owner Benefits",
-    "Plus Owner Benefits": "Plus Owner Benefits",
-    "Total add backs": "Total add backs"
-}
 
+    values = record_values(data)
+    # A separate output is only as current as the template it was filled from
+    template_digest = None
+    if incremental and os.path.abspath(save_path) != os.path.abspath(excel_path):
+        template_digest = file_digest(excel_path)
+    manifest = load_fill_manifest(save_path, template_digest) if incremental else None
+    source_path = excel_path
+    changed = values
+    written_before = {}
+    if manifest is not None:
+        requested = _flatten(manifest.get("requested", {}))
+        written_before = _flatten(manifest["cells"])
+        changed = {k: v for k, v in values.items() if requested.get(k) != v}
+        if not changed:
+            log.info(f"No changes since last fill of {save_path}, skipping.")
+            return
+        # Apply only the delta on top of the previously filled workbook
+        data = [{"year": yr, **{f: v for (y, f), v in changed.items() if y == yr}}
+                for yr in sorted({yr for yr, _ in changed})]
+        source_path = save_path
+        values = {**requested, **values}
+
+    if engine == 'patch':
+        import xlsxpatch
+        with tracing.span("excel.index", path=source_path):
+            # A read-only load streams the sheet without building the styled object model
+            wb = load_workbook(source_path, read_only=True)
+            ws = wb.active
+            title = ws.title
+            layout = template_layout(source_path, ws)
+            wb.close()
+        written = xlsxpatch.patch_workbook(source_path, save_path, worksheet_writes(layout, data), title)
+        log.info(f"Patched {len(written)} cell(s) into {save_path}")
+        if incremental:
+            # The patch copies sharedStrings.xml unchanged, so the output's table is the source's
+            strings = xlsxpatch.shared_strings(save_path)
+            previous = {cell: xlsxpatch.cell_value(old, strings) for cell, old in written.items()}
+            written = _fill_log(layout, changed, previous, manifest is not None)
+            save_fill_manifest(save_path, title, values, {**written_before, **written}, template_digest)
+        return
+
+    with tracing.span("excel.load", path=source_path):
+        wb = load_workbook(source_path, keep_vba=is_macro_workbook(save_path))
+        ws = wb.active
+
+    with tracing.span("excel.index", path=source_path):
+        layout = template_layout(source_path, ws)
+
+    log.debug(f"Year columns found: {layout.years}")
+    log.debug(f"Categories found in template: {list(layout.cats.keys())}")
+
+    with tracing.span("excel.write") as sp:
+        written = fill_worksheet(ws, layout, data)
+        sp.set(cells=len(written))
+
+    with tracing.span("excel.save", path=save_path):
+        wb.save(save_path)
+    log.info(f"Saved to {save_path}")
+    if incremental:
+        written = _fill_log(layout, changed, written, manifest is not None)
+        save_fill_manifest(save_path, ws.title, values, {**written_before, **written}, template_digest)
+
+# Template loaded once per bulk worker process
+_bulk_template = {}
+
+def _bulk_init(excel_path):
+    wb = load_workbook(excel_path, keep_vba=is_macro_workbook(excel_path))
+    _bulk_template.update(wb=wb, ws=wb.active, layout=template_layout(excel_path, wb.active))
+
+def _bulk_fill(json_data, output_path):
+    wb, ws = _bulk_template["wb"], _bulk_template["ws"]
+    previous = fill_worksheet(ws, _bulk_template["layout"], normalize_records(json_data))
+    try:
+        wb.save(output_path)
+    finally:
+        # Put the template back the way it was for the next deal
+        for (row, col), value in previous.items():
+            ws.cell(row=row, column=col).value = value
+    return output_path
+
+def map_to_excel_bulk(deals, excel_path, output_dir, workers=None):
+    """
+    Fills one copy of the template per deal. deals is a list of (name, records);
+    each output is written to output_dir/<name>.xlsx (or .xlsm for macro templates).
+    Every worker process loads the template once and reuses it for all its deals,
+    restoring the written cells after each save. Returns the output paths.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    ext = os.path.splitext(excel_path)[1] or '.xlsx'
+    outputs = [os.path.join(output_dir, f"{name}{ext}") for name, _ in deals]
+    workers = min(workers or os.cpu_count() or 1, max(1, len(deals)))
+    if workers == 1:
+        _bulk_init(excel_path)
+        return [_bulk_fill(records, out) for (_, records), out in zip(deals, outputs)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_bulk_init, initargs=(excel_path,)) as pool:
+        return list(pool.map(_bulk_fill, [records for _, records in deals], outputs))
+
+def sheet_title(name, taken):
+    """
+    A valid sheet title for name that is not in taken (lower-cased titles, as Excel
+    compares them case-insensitively). Titles are limited to 31 characters and
+    cannot contain []:*?/\\; clashes get a " (2)", " (3)"... suffix within the limit.
+    """
+    base = ''.join('_' if ch in '[]:*?/\\' else ch for ch in name)[:31] or 'Sheet'
+    title, n = base, 1
+    while title.lower() in taken:
+        n += 1
+        suffix = f" ({n})"
+        title = base[:31 - len(suffix)] + suffix
+    taken.add(title.lower())
+    return title
+
+def map_to_excel_sheets(deals, excel_path, output_path):
+    """
+    Writes every deal as its own copy of the template sheet in one workbook.
+    The template sheet is kept, unfilled, so formulas on other sheets that refer
+    to it by name stay valid; they keep reading the template, not the deal sheets.
+    """
+    wb = load_workbook(excel_path, keep_vba=is_macro_workbook(output_path))
+    template_ws = wb.active
+    layout = template_layout(excel_path, template_ws)
+    taken = {title.lower() for title in wb.sheetnames}
+    for name, records in deals:
+        ws = wb.copy_worksheet(template_ws)
+        ws.title = sheet_title(name, taken)
+        fill_worksheet(ws, layout, normalize_records(records))
+    if deals:
+        # Open on the first deal rather than the empty template
+        wb.active = len(wb.sheetnames) - len(deals)
+    wb.save(output_path)
+    return output_path
+
+# Categories must match the spreadsheet template labels exactly
+FIXED_CATEGORIES = list(category_mapping.values())
+
+def extract_with_gpt(extracted_data: dict, user_prompt: str, api_key: str, local_only: bool = False) -> list:
+    """
+    Maps extracted labels onto FIXED_CATEGORIES. Labels are resolved locally
+    (exact, synonym and fuzzy matching with unit/sign normalization); only the
+    labels that cannot be resolved confidently are sent to GPT, which is asked
+    to name their category. With local_only, unresolved labels are just reported.
+    """
+    mapper = FieldMapper(FIXED_CATEGORIES)
+    values, unresolved = mapper.map_records(extracted_data)
+    if not unresolved:
+        log.info(f"Mapped {len(values)} record(s) locally.")
+        return derive.check_records(values, FIXED_CATEGORIES)[0]
+    log.info(f"Labels not resolved locally: {unresolved}")
+    if local_only:
+        return derive.check_records(values, FIXED_CATEGORIES)[0]
+
+    client = apiclient.get_client(api_key)
     system_content = (
         "You are a financial data extractor. "
-        "Given raw financial data in various forms, map all values into the following fixed categories exactly as named: \n"
-        + json.dumps(fixed_categories_example, indent=2) + "\n"
-        "Return ONLY a JSON object or list of objects containing these categories and their numeric values. "
-        "Include the year as the 'year' key. "
-        "Do not include any percentages or fields not listed. "
-        "If a category is missing in the input, set its value to 0."
+        "Map each source label you are given to one of the following fixed categories exactly as named: \n"
+        + json.dumps(FIXED_CATEGORIES, indent=2) + "\n"
+        "Return ONLY a JSON object whose keys are the source labels and whose values are the category names. "
+        "Use null for labels that fit no category, such as percentages or subtotals not listed."
     )
 
-    print("\n--- INPUT SCHEMA TO GPT (extracted_data) ---")
-    print(json.dumps(extracted_data, indent=2))
-    print("\n--- SYSTEM PROMPT (Categories) ---")
-    print(json.dumps(fixed_categories_example, indent=2))
-    print("\n--- USER PROMPT ---")
-    print(user_prompt)
-    print("\n--- SENDING TO GPT... ---\n")
+    log.debug("--- UNRESOLVED LABELS TO GPT ---\n" + json.dumps(unresolved, indent=2))
+    log.debug("--- USER PROMPT ---\n" + user_prompt)
 
     messages = [
         {"role": "system", "content": system_content},
-        {"role": "user", "content": json.dumps(extracted_data)},
-        {"role": "user", "content": user_prompt}
+        {"role": "user", "content": json.dumps(unresolved)},
     ]
+    if user_prompt.strip():
+        messages.append({"role": "user", "content": user_prompt})
 
-    resp = client.chat.completions.create(
-        model="gpt-4",
-        messages=messages,
-        temperature=0
-    )
+    with tracing.span("model.map_labels", labels=len(unresolved)) as sp:
+        resp = client.chat(
+            model="gpt-4",
+            messages=messages,
+            temperature=0
+        )
+        if resp.usage is not None:
+            sp.set(prompt_tokens=resp.usage.prompt_tokens, completion_tokens=resp.usage.completion_tokens)
     body = resp.choices[0].message.content.strip()
-    print("--- RAW GPT RESPONSE ---")
-    print(body)
-    # Robust JSON handling
-    try:
-        values = json.loads(body)
-    except Exception as e:
-        print(f"Error parsing GPT output as JSON: {e}")
-        print("GPT output was:")
-        print(body)
-        sys.exit(1)
-    return values
+    log.debug("--- RAW GPT RESPONSE ---\n" + body)
+    # Robust JSON handling: take the first complete object even if wrapped or cut off
+    parsed = RecordStreamParser().feed(body)
+    if not parsed:
+        raise RuntimeError(f"Error parsing GPT output as JSON.\nGPT output was:\n{body}")
+    mapper.learn({label: target or None for label, target in parsed[0].items()})
+    values, still_unresolved = mapper.map_records(extracted_data)
+    if still_unresolved:
+        log.warning(f"Labels left unmapped: {still_unresolved}")
+    return derive.check_records(values, FIXED_CATEGORIES)[0]
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--data", required=True, help="Path to raw-extracted JSON file or '-' for stdin")
     parser.add_argument("--prompt", required=True, help="User's GPT prompt")
-    parser.add_argument("--key", required=True, help="OpenAI API key")
+    parser.add_argument("--key", help="OpenAI API key (only needed for labels that cannot be mapped locally)")
+    parser.add_argument("--trace", help="Write a trace (.jsonl events, or .json Chrome trace)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show debug output")
+    parser.add_argument("--local-only", action="store_true", help="Never call GPT; report labels that cannot be mapped locally")
     parser.add_argument("--template", help="Excel template file (to auto-fill with GPT output)")
     parser.add_argument("--output", help="Output Excel file (leave blank to overwrite)")
     args = parser.parse_args()
+    tracing.setup(args.trace, args.verbose)
 
     # Support reading input from stdin if --data is '-'
     if args.data == "-":
@@ -173,7 +480,11 @@ if __name__ == "__main__":
         with open(args.data) as f:
             extracted = json.load(f)
 
-    structured_data = extract_with_gpt(extracted, args.prompt, args.key)
+    try:
+        structured_data = extract_with_gpt(extracted, args.prompt, args.key, local_only=args.local_only or not args.key)
+    except RuntimeError as e:
+        print(str(e))
+        sys.exit(1)
     print("\n--- FINAL STRUCTURED OUTPUT ---")
     print(json.dumps(structured_data, indent=2))
 
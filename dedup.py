@@ -0,0 +1,121 @@
+import re
+import hashlib
+import logging
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from cache import page_digest
+import tracing
+
+log = logging.getLogger(__name__)
+
+# dHash grid: HASH_SIZE x HASH_SIZE bits
+HASH_SIZE = 16
+# Hashes at most this many bits apart are compared pixel by pixel
+MAX_DISTANCE = 12
+# Pixel comparison: pages are kept as COMPARE_WIDTH grayscale thumbnails and
+# match if no BLOCK x BLOCK block differs by more than BLOCK_TOLERANCE on
+# average. A changed digit moves a block well past it; recompression noise
+# averages out.
+COMPARE_WIDTH = 512
+BLOCK = 4
+BLOCK_TOLERANCE = 16
+
+def dhash(gray, size=HASH_SIZE):
+    """
+    Difference hash of a grayscale image: one bit per horizontally adjacent
+    pixel pair of a size x (size + 1) thumbnail. Returns an int.
+    """
+    pixels = np.asarray(gray.resize((size + 1, size), Image.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int(''.join('1' if b else '0' for b in bits), 2)
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+def text_hash(text):
+    """
+    Hash of a text page's content: the "[Text of ..., page N]" header is
+    skipped and whitespace and case are normalized, so the same page in two
+    files hashes alike.
+    """
+    body = text.split('\n', 1)[1] if text.startswith('[') and '\n' in text else text
+    return hashlib.sha256(re.sub(r'\s+', ' ', body).strip().lower().encode('utf-8')).hexdigest()
+
+def _gray(img):
+    with Image.open(BytesIO(img)) as im:
+        return im.convert('L')
+
+def thumbnail(gray, width=COMPARE_WIDTH):
+    """
+    The uint8 array same_image compares: gray scaled to width, aspect kept.
+    """
+    size = (width, max(BLOCK, round(gray.height * width / gray.width)))
+    return np.asarray(gray.resize(size, Image.BILINEAR), dtype=np.uint8)
+
+def same_image(a, b):
+    """
+    True if two page thumbnails show the same content at reading resolution.
+    """
+    if a.shape[1] != b.shape[1] or abs(a.shape[0] - b.shape[0]) > a.shape[0] * 0.01:
+        return False
+    height = min(a.shape[0], b.shape[0])
+    diff = np.abs(a[:height].astype(np.int16) - b[:height].astype(np.int16))
+    rows, cols = diff.shape[0] // BLOCK, diff.shape[1] // BLOCK
+    blocks = diff[:rows * BLOCK, :cols * BLOCK].reshape(rows, BLOCK, cols, BLOCK).mean(axis=(1, 3))
+    return blocks.max() <= BLOCK_TOLERANCE
+
+class PageDeduper:
+    """
+    Drops pages that repeat an earlier page of the same run, e.g. the FY23
+    accounts uploaded alongside a FY22-FY24 pack that contains them. Text
+    pages match on their normalized text; image pages on identical bytes, or
+    on a close dHash confirmed by a pixel comparison, so pages that merely
+    share a layout are kept. Only a small grayscale thumbnail of each kept
+    image is held, not its encoded bytes. sources[i] lists the labels of every input page
+    the i-th kept page stands for.
+    """
+    def __init__(self, max_distance=MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.sources = []
+        self.duplicates = []
+        self.bytes_saved = 0
+        self._exact = {}
+        self._images = []
+
+    def _match(self, page):
+        key = text_hash(page) if isinstance(page, str) else page_digest(page)
+        if key in self._exact:
+            return self._exact[key], key, None
+        if isinstance(page, str):
+            return None, key, None
+        gray = _gray(page)
+        h, thumb = dhash(gray), thumbnail(gray)
+        for kept, kept_h, kept_thumb in self._images:
+            if hamming(h, kept_h) <= self.max_distance and same_image(kept_thumb, thumb):
+                return kept, key, None
+        return None, key, (h, thumb)
+
+    def filter(self, pages, labels=None):
+        """
+        Yields the pages that are not duplicates, in order. labels name the
+        input pages (default: their position) for sources and duplicates.
+        """
+        for i, page in enumerate(pages):
+            label = labels[i] if labels is not None else str(i + 1)
+            kept, key, image = self._match(page)
+            if kept is not None:
+                self.sources[kept].append(label)
+                self.duplicates.append((label, self.sources[kept][0]))
+                self.bytes_saved += len(page)
+                log.info(f"Skipped {label}: duplicate of {self.sources[kept][0]}")
+                continue
+            self._exact[key] = len(self.sources)
+            if image is not None:
+                self._images.append((len(self.sources), *image))
+            self.sources.append([label])
+            yield page
+        tracing.count("dedup.dropped", len(self.duplicates))
+        tracing.count("dedup.bytes_saved", self.bytes_saved)
@@ -0,0 +1,119 @@
+import logging
+import warnings
+
+import numpy as np
+
+import tracing
+from schema import DERIVED_FIELDS, RECURRING_FIELDS
+
+log = logging.getLogger(__name__)
+
+# A reported total may differ from the sum of its parts by rounding only
+TOLERANCE = 1.0
+# A recurring line this many times larger or smaller than its median over all years is suspect
+OUTLIER_FACTOR = 5.0
+# Non-zero years a field needs before its median means anything
+MIN_OUTLIER_YEARS = 3
+
+def year_of(record):
+    try:
+        return int(float(record.get("year")))
+    except (TypeError, ValueError):
+        return None
+
+def to_columns(records, fields):
+    """
+    Lays the year records out as arrays: years (n,) and values (n, len(fields)),
+    with NaN for fields a record does not have.
+    """
+    years = np.array([year_of(r) for r in records], dtype=np.int64)
+    values = np.full((len(records), len(fields)), np.nan)
+    for i, record in enumerate(records):
+        for j, field in enumerate(fields):
+            value = record.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                values[i, j] = value
+    return years, values
+
+def _weights(fields):
+    """
+    (len(fields), len(DERIVED_FIELDS)) 0/1 matrix: values @ weights gives every total at once.
+    """
+    index = {field: j for j, field in enumerate(fields)}
+    weights = np.zeros((len(fields), len(DERIVED_FIELDS)))
+    for k, parts in enumerate(DERIVED_FIELDS.values()):
+        for part in parts:
+            if part in index:
+                weights[index[part], k] = 1.0
+    return weights
+
+def outliers(years, values, fields, factor=OUTLIER_FACTOR):
+    """
+    Flags values of the recurring lines (schema.RECURRING_FIELDS) at least
+    factor times larger or smaller in magnitude than the median of the same
+    field over all years, the typical signature of a dropped or extra digit.
+    Zeros are ignored, and fields with fewer than MIN_OUTLIER_YEARS non-zero
+    years are not checked.
+    """
+    magnitude = np.abs(values)
+    magnitude[magnitude == 0] = np.nan
+    checked = np.array([field in RECURRING_FIELDS for field in fields], dtype=bool)
+    checked &= np.count_nonzero(~np.isnan(magnitude), axis=0) >= MIN_OUTLIER_YEARS
+    magnitude[:, ~checked] = np.nan
+    issues = []
+    if not checked.any():
+        return issues
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        # Fields that are zero in every year have no median
+        warnings.simplefilter('ignore', RuntimeWarning)
+        median = np.nanmedian(magnitude, axis=0)
+        ratio = magnitude / median
+    rows, cols = np.nonzero((ratio >= factor) | (ratio <= 1 / factor))
+    for i, j in zip(rows, cols):
+        issues.append({"year": int(years[i]), "field": fields[j], "kind": "outlier",
+                       "detail": f"{values[i, j]:g} vs median {median[j]:g}"})
+    return issues
+
+def check_records(records, fields):
+    """
+    Derives the totals of every record and checks them. Reported totals that
+    disagree with the sum of their parts and year-over-year outliers are
+    returned as issues. Returns (records with totals filled in, issues).
+    Records without a numeric year are passed through unchanged.
+    """
+    if not any(year_of(r) is not None for r in records):
+        return records, []
+    dated = [r for r in records if year_of(r) is not None]
+    if len(dated) < len(records):
+        checked, issues = check_records(dated, fields)
+        checked = iter(checked)
+        return [next(checked) if year_of(r) is not None else r for r in records], issues
+    with tracing.span("derive.check", years=len(records)) as sp:
+        base = [f for f in fields if f not in DERIVED_FIELDS]
+        years, values = to_columns(records, base)
+        totals = np.nan_to_num(values) @ _weights(base)
+        _, reported = to_columns(records, list(DERIVED_FIELDS))
+        issues = []
+        mismatch = ~np.isnan(reported) & (reported != 0) & (np.abs(reported - totals) > TOLERANCE)
+        for i, k in zip(*np.nonzero(mismatch)):
+            issues.append({"year": int(years[i]), "field": list(DERIVED_FIELDS)[k], "kind": "identity",
+                           "detail": f"reported {reported[i, k]:g}, parts sum to {totals[i, k]:g}"})
+        issues += outliers(years, values, base)
+        out = []
+        for i, record in enumerate(records):
+            record = dict(record)
+            for k, field in enumerate(DERIVED_FIELDS):
+                if field in fields:
+                    total = totals[i, k]
+                    record[field] = int(total) if float(total).is_integer() else float(total)
+            out.append(record)
+        sp.set(issues=len(issues))
+    for issue in issues:
+        log.warning(describe(issue))
+    return out, issues
+
+def describe(issue):
+    return f"{issue['year']} {issue['field']}: {issue['kind']} ({issue['detail']})"
+
+def issue_years(issues):
+    return sorted({issue["year"] for issue in issues})
@@ -2,207 +2,797 @@ import sys
 import os
 import json
 import argparse
-import openai
-from pdf2image import convert_from_path
+import logging
+import threading
+from pdf2image import convert_from_path, pdfinfo_from_path
 from io import BytesIO
 import base64
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+import textlayer
+import pagefilter
+import imageopt
+from jsonstream import RecordStreamParser, validate_record
+import tracing
+import apiclient
+import derive
+import schema
+import dedup
+from cache import ExtractionCache, DEFAULT_CACHE_PATH, DEFAULT_MAX_BYTES, cache_key, page_digest
 
-HARDCODED_PROMPT = """
-Read the financial data below. For each year, copy the numbers into this exact schema—one record per year.
-If a number is missing, use 0.
-Return only valid JSON—no extra text.
-[
-{
-    "year": 2020,
-    "Revenue": ...,
-    "Cost of Goods Sold (COGS)": ...,
-    "Less Operating Expenses": ...,
-    "Other Income": ...,
-    "Taxes": ...,
-    "Plus Depreciation & Amortization": ...,
-    "Plus Interest": ...,
-    "Plus Taxes": ...,
-    "Plus Owner Salary+Super etc": ...,
-    "Plus Owner Benefits": ...,
-    "Manager Salary": ...,
-    "Investor Salary": ...,
-    "One off Revenue Adjustments": ...,
-    "One off Expenses Adjustments": ...,
-    "Other Adjustments 1": ...,
-    "Other Adjustments 2": ...,
-    "Total add backs": ...,
-    "Total SDE Adjustments": ...,
-    "Total Adjustments": ...
-  },
-{
-    "year": 2021,
-    "Revenue": ...,
-    "Cost of Goods Sold (COGS)": ...,
-    "Less Operating Expenses": ...,
-    "Other Income": ...,
-    "Taxes": ...,
-    "Plus Depreciation & Amortization": ...,
-    "Plus Interest": ...,
-    "Plus Taxes": ...,
-    "Plus Owner Salary+Super etc": ...,
-    "Plus Owner Benefits": ...,
-    "Manager Salary": ...,
-    "Investor Salary": ...,
-    "One off Revenue Adjustments": ...,
-    "One off Expenses Adjustments": ...,
-    "Other Adjustments 1": ...,
-    "Other Adjustments 2": ...,
-    "Total add backs": ...,
-    "Total SDE Adjustments": ...,
-    "Total Adjustments": ...
-  },
-  {
-    "year": 2022,
-    "Revenue": ...,
-    "Cost of Goods Sold (COGS)": ...,
-    "Less Operating Expenses": ...,
-    "Other Income": ...,
-    "Taxes": ...,
-    "Plus Depreciation & Amortization": ...,
-    "Plus Interest": ...,
-    "Plus Taxes": ...,
-    "Plus Owner Salary+Super etc": ...,
-    "Plus Owner Benefits": ...,
-    "Manager Salary": ...,
-    "Investor Salary": ...,
-    "One off Revenue Adjustments": ...,
-    "One off Expenses Adjustments": ...,
-    "Other Adjustments 1": ...,
-    "Other Adjustments 2": ...,
-  },
-  {
-    "year": 2023,
-    "Revenue": ...,
-    "Cost of Goods Sold (COGS)": ...,
-    "Less Operating Expenses": ...,
-    "Other Income": ...,
-    "Taxes": ...,
-    "Plus Depreciation & Amortization": ...,
-    "Plus Interest": ...,
-    "Plus Taxes": ...,
-    "Plus Owner Salary+Super etc": ...,
-    "Plus Owner Benefits": ...,
-    "Manager Salary": ...,
-    "Investor Salary": ...,
-    "One off Revenue Adjustments": ...,
-    "One off Expenses Adjustments": ...,
-    "Other Adjustments 1": ...,
-    "Other Adjustments 2": ...,
-  },
-  {
-    "year": 2024,
-    "Revenue": ...,
-    "Cost of Goods Sold (COGS)": ...,
-    "Less Operating Expenses": ...,
-    "Other Income": ...,
-    "Taxes": ...,
-    "Plus Depreciation & Amortization": ...,
-    "Plus Interest": ...,
-    "Plus Taxes": ...,
-    "Plus Owner Salary+Super etc": ...,
-    "Plus Owner Benefits": ...,
-    "Manager Salary": ...,
-    "Investor Salary": ...,
-    "One off Revenue Adjustments": ...,
-    "One off Expenses Adjustments": ...,
-    "Other Adjustments 1": ...,
-    "Other Adjustments 2": ...,
-  },
-  {
-    "year": 2025,
-    "Revenue": ...,
-    "Cost of Goods Sold (COGS)": ...,
-    "Less Operating Expenses": ...,
-    "Other Income": ...,
-    "Taxes": ...,
-    "Plus Depreciation & Amortization": ...,
-    "Plus Interest": ...,
-    "Plus Taxes": ...,
-    "Plus Owner Salary+Super etc": ...,
-    "Plus Owner Benefits": ...,
-    "Manager Salary": ...,
-    "Investor Salary": ...,
-    "One off Revenue Adjustments": ...,
-    "One off Expenses Adjustments": ...,
-    "Other Adjustments 1": ...,
-    "Other Adjustments 2": ...,
-  }
-]
-Do not add or remove fields. Do not estimate or infer values. Only copy numbers as written.
-If a field is missing for a year, use 0.
-Return only the JSON array—no commentary, no formatting, no markdown.
-"""
-
-def pdfs_to_images(pdf_paths):
-    images = []
-    for pdf_path in pdf_paths:
-        imgs = convert_from_path(pdf_path)
-        for img in imgs:
-            buf = BytesIO()
-            img.save(buf, format='PNG')
-            buf.seek(0)
-            images.append(buf.read())
-    return images
-
-def vision_extract(api_key, images, user_prompt):
-    client = openai.OpenAI(api_key=api_key)
-    # Combine user prompt and hardcoded prompt
-    combined_prompt = (user_prompt.strip() + "\n\n" + HARDCODED_PROMPT.strip()).strip()
+log = logging.getLogger(__name__)
+
+MODEL = "gpt-4o"
+TEMPERATURE = 0
+# Request the schema.response_format JSON schema (structured outputs)
+STRUCTURED_OUTPUT = True
+MAX_FOLLOW_UPS = 2
+# Targeted re-queries for years that fail derive.check_records
+MAX_RECHECKS = 1
+MAX_OUTPUT_TOKENS = 4096
+# gpt-4o's 128k context less the reply and some headroom; larger jobs are split
+MAX_REQUEST_TOKENS = 100000
+DEFAULT_DPI = 200
+IMAGE_FORMATS = ('PNG', 'JPEG')
+ENGINES = ('model', 'ocr', 'offline')
+
+def pdf_page_count(pdf_path):
+    # Read the page count from the PDF metadata without rendering anything
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+def image_mime(img):
+    if img[:3] == b'\xff\xd8\xff':
+        return "image/jpeg"
+    if img[:4] == b'RIFF' and img[8:12] == b'WEBP':
+        return "image/webp"
+    return "image/png"
+
+def render_page(pdf_path, page_no, dpi=DEFAULT_DPI, grayscale=False, fmt='PNG', quality=85):
+    """
+    Renders a single page (1-based) and returns the encoded image bytes.
+    Runs inside the worker processes of iter_pdf_pages.
+    """
+    imgs = convert_from_path(pdf_path, dpi=dpi, first_page=page_no, last_page=page_no, grayscale=grayscale)
+    img = imgs[0]
+    buf = BytesIO()
+    if fmt == 'JPEG':
+        img.convert('L' if grayscale else 'RGB').save(buf, format='JPEG', quality=quality, optimize=True)
+    else:
+        img.save(buf, format='PNG')
+    img.close()
+    return buf.getvalue()
+
+def render_and_optimize(pdf_path, page_no, dpi, grayscale, fmt, quality, optimize):
+    page = render_page(pdf_path, page_no, dpi, grayscale, fmt, quality)
+    if optimize is None:
+        return page, None
+    return imageopt.optimize_page(page, **optimize)
+
+def iter_pdf_pages(pdf_paths, dpi=DEFAULT_DPI, grayscale=False, fmt='PNG', quality=85, workers=None, queue_size=None,
+                   optimize=None, stats=None):
+    """
+    Yields encoded page images in document order, rendering pages across a process pool.
+    At most queue_size pages are rendered ahead of the consumer, so memory stays flat
+    regardless of how many pages the PDFs have.
+    optimize, a dict of imageopt.optimize_page options, shrinks each page in the
+    worker before upload; before/after sizes are added to stats (a PayloadStats).
+    """
+    jobs = ((path, page_no) for path in pdf_paths for page_no in range(1, pdf_page_count(path) + 1))
+    return iter_page_images(jobs, dpi, grayscale, fmt, quality, workers, queue_size, optimize, stats)
+
+def iter_page_images(jobs, dpi=DEFAULT_DPI, grayscale=False, fmt='PNG', quality=85, workers=None, queue_size=None,
+                     optimize=None, stats=None, pool=None):
+    """
+    Renders (pdf_path, page_no) jobs in order; see iter_pdf_pages. With pool
+    (a ProcessPoolExecutor the caller keeps, see Extractor.render_pool) no
+    pool of its own is started.
+    """
+    fmt = fmt.upper()
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format: {fmt}")
+
+    def emit(result):
+        page, page_stats = result
+        if stats is not None and page_stats is not None:
+            stats.add(page_stats)
+        tracing.count("render.bytes", len(page))
+        return page
+
+    def wait(future):
+        # Time the consumer spends blocked on the rendering pool
+        with tracing.span("render.wait"):
+            return future.result()
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 and pool is None:
+        for path, page_no in jobs:
+            yield emit(render_and_optimize(path, page_no, dpi, grayscale, fmt, quality, optimize))
+        return
+    queue_size = queue_size or workers * 2
+    with (ProcessPoolExecutor(max_workers=workers) if pool is None else nullcontext(pool)) as pool:
+        pending = deque()
+        for path, page_no in jobs:
+            pending.append(pool.submit(render_and_optimize, path, page_no, dpi, grayscale, fmt, quality, optimize))
+            if len(pending) >= queue_size:
+                yield emit(wait(pending.popleft()))
+        while pending:
+            yield emit(wait(pending.popleft()))
+
+SCHEMA_FIELDS = schema.FIELD_NAMES
+SPREADSHEET_EXTS = ('.xlsx', '.xlsm')
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png')
+
+def plan_inputs(files, text_layer=True):
+    """
+    Decides per input how it reaches the model, cheapest first:
+      - spreadsheets laid out like the template are mapped to records directly;
+      - other spreadsheets and PDF pages with a usable text layer are sent as text;
+      - scanned PDF pages are rendered, image files are sent as-is.
+    Returns (records, specs) where specs is an ordered list of
+    ('text', str), ('render', (pdf_path, page_no)) or ('image', path).
+    """
+    with tracing.span("plan", files=len(files)) as sp:
+        records, specs = _plan_inputs(files, text_layer)
+        sp.set(pages=len(specs), records=len(records))
+    return records, specs
+
+def _plan_inputs(files, text_layer):
+    records = []
+    specs = []
+    for path in files:
+        ext = os.path.splitext(path)[1].lower()
+        name = os.path.basename(path)
+        if ext in SPREADSHEET_EXTS:
+            recs = textlayer.spreadsheet_records(path, SCHEMA_FIELDS)
+            if recs:
+                records.extend(recs)
+            else:
+                specs.append(('text', f"[Spreadsheet {name}]\n" + textlayer.spreadsheet_text(path)))
+        elif ext in IMAGE_EXTS:
+            specs.append(('image', path))
+        else:
+            texts = textlayer.pdf_page_texts(path) if text_layer else []
+            for page_no in range(1, pdf_page_count(path) + 1):
+                text = texts[page_no - 1] if page_no <= len(texts) else ''
+                if textlayer.has_text_layer(text):
+                    specs.append(('text', textlayer.format_page_text(name, page_no, text)))
+                else:
+                    specs.append(('render', (path, page_no)))
+    return records, specs
+
+THUMBNAIL_DPI = 36
+
+def score_rendered(job):
+    # Runs in the render pool: a low-DPI thumbnail is all pagefilter needs
+    path, page_no = job
+    return pagefilter.score_image(render_page(path, page_no, dpi=THUMBNAIL_DPI, grayscale=True))
+
+def spec_label(spec):
+    kind, payload = spec
+    if kind == 'text':
+        return payload.splitlines()[0].strip('[]')
+    if kind == 'render':
+        return f"{os.path.basename(payload[0])}, page {payload[1]}"
+    return os.path.basename(payload)
+
+def filter_specs(specs, max_pages=None, min_score=0.0, pool=None):
+    """
+    Scores every planned page locally and keeps the top max_pages and/or those
+    scoring at least min_score. Scanned pages are judged on a low-DPI thumbnail,
+    rendered and scored in pool (a ProcessPoolExecutor) when given.
+    Returns (kept specs, dropped as [(label, score, reason)]).
+    """
+    if max_pages is None and min_score <= 0:
+        return specs, []
+    jobs = [payload for kind, payload in specs if kind == 'render']
+    rendered = iter(pool.map(score_rendered, jobs) if pool is not None and len(jobs) > 1 else map(score_rendered, jobs))
+    scores = []
+    for kind, payload in specs:
+        if kind == 'text':
+            # Skip the "[Text of ..., page N]" header line
+            scores.append(pagefilter.score_text(payload.split('\n', 1)[-1]))
+        elif kind == 'render':
+            scores.append(next(rendered))
+        else:
+            with open(payload, 'rb') as f:
+                scores.append(pagefilter.score_image(f.read()))
+    kept, dropped = pagefilter.select_pages(scores, max_pages=max_pages, min_score=min_score)
+    return [specs[i] for i in kept], [(spec_label(specs[i]), score, reason) for i, score, reason in dropped]
+
+def iter_planned_pages(specs, **render_options):
+    """
+    Yields the payload for every spec in order: text as str, images as bytes.
+    Only 'render' specs go through the rasterization pool.
+    """
+    rendered = iter_page_images([payload for kind, payload in specs if kind == 'render'], **render_options)
+    for kind, payload in specs:
+        if kind == 'text':
+            yield payload
+        elif kind == 'render':
+            yield next(rendered)
+        else:
+            with open(payload, 'rb') as f:
+                data = f.read()
+            optimize = render_options.get('optimize')
+            if optimize is not None:
+                data, page_stats = imageopt.optimize_page(data, **optimize)
+                if render_options.get('stats') is not None:
+                    render_options['stats'].add(page_stats)
+            yield data
+
+def pdfs_to_images(pdf_paths, **options):
+    return list(iter_pdf_pages(pdf_paths, **options))
+
+def unwrap_records(output):
+    """
+    Rewrites a structured-output {"records": [...]} response as the plain array
+    of records the rest of the pipeline parses; other output is returned as is.
+    If the response was cut off, an unclosed object is left at the end so
+    RecordStreamParser still reports it as truncated.
+    """
+    start, array = output.find('{'), output.find('[')
+    if start < 0 or 0 <= array < start:
+        return output
+    parser = RecordStreamParser(nested=True)
+    records = parser.feed(output)
+    if not records:
+        return output
+    text = json.dumps(records)
+    return text[:-1] + ', {' if parser.truncated else text
+
+def usable_output(output):
+    """
+    True if a model answer is worth caching: complete, and holding at least
+    one valid record or an explicit empty list. Refusals, truncated and
+    unparseable answers are asked again next time instead.
+    """
+    parser = RecordStreamParser()
+    records = parser.feed(output)
+    if parser.truncated:
+        return False
+    # Cut off between records: the array was opened but never closed
+    array = output.find('[')
+    if 0 <= array < output.find('{') and output.rfind(']') < output.rfind('}'):
+        return False
+    if validate_records(records):
+        return True
+    try:
+        return json.loads(output) in ([], {"records": []})
+    except ValueError:
+        return False
+
+def vision_extract(api_key, images, user_prompt, cache=None, refresh=False, client=None, on_record=None, detail=None,
+                   years=None, structured=STRUCTURED_OUTPUT):
+    """
+    Sends the pages to the vision model and returns its raw text output.
+    Pages are image bytes, or str for pages whose text was extracted locally.
+    With a cache, identical requests (same pages, prompt, model and temperature)
+    are answered from disk; refresh=True ignores stored answers but still updates
+    them. Only answers passing usable_output are stored.
+    With on_record, the response is streamed and on_record is called with each
+    year record as soon as it is complete. detail sets the vision detail level.
+    years are the years asked for (None: every year shown); with structured,
+    the reply is constrained to schema.response_format.
+    """
+    # Combine user prompt and the schema prompt
+    combined_prompt = (user_prompt.strip() + "\n\n" + schema.build_prompt(years)).strip()
     # Prepare message for GPT-4o vision
     contents = [{"type": "text", "text": combined_prompt}]
+    digests = []
+    upload_bytes = 0
+    estimated_tokens = apiclient.estimate_text_tokens(combined_prompt)
     for img in images:
+        digests.append(page_digest(img))
+        estimated_tokens += apiclient.estimate_page_tokens(img, detail)
+        if isinstance(img, str):
+            contents.append({"type": "text", "text": img})
+            upload_bytes += len(img)
+            continue
         b64_img = base64.b64encode(img).decode('utf-8')
+        upload_bytes += len(b64_img)
+        image_url = {"url": f"data:{image_mime(img)};base64,{b64_img}"}
+        if detail:
+            image_url["detail"] = detail
         contents.append({
             "type": "image_url",
-            "image_url": {
-                "url": f"data:image/png;base64,{b64_img}"
-            }
+            "image_url": image_url
         })
+    model_tag = ":".join([MODEL] + ([detail] if detail else []) + (["json_schema"] if structured else []))
+    key = cache_key(digests, combined_prompt, model_tag, TEMPERATURE)
+    if cache is not None and not refresh:
+        cached = cache.get(key)
+        if cached is not None and not usable_output(cached):
+            # Stored before answers were checked; ask again
+            cache.delete(key)
+            cached = None
+        if cached is not None:
+            if on_record is not None:
+                for record in RecordStreamParser().feed(cached):
+                    on_record(record)
+            return cached
+    if client is None:
+        client = apiclient.get_client(api_key)
     messages = [
         {"role": "user", "content": contents}
     ]
-    resp = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        max_tokens=4096,
-        temperature=0
-    )
-    return resp.choices[0].message.content.strip()
+    with tracing.span("model.request", model=MODEL, pages=len(digests), bytes_uploaded=upload_bytes,
+                      stream=on_record is not None, estimated_tokens=estimated_tokens) as sp:
+        request = dict(model=MODEL, messages=messages, max_tokens=MAX_OUTPUT_TOKENS, temperature=TEMPERATURE)
+        if structured:
+            request["response_format"] = schema.response_format()
+        if on_record is not None:
+            request.update(stream=True, stream_options={"include_usage": True})
+        resp = client.chat(estimated_tokens=estimated_tokens, **request)
+        usage = None
+        if on_record is None:
+            output = resp.choices[0].message.content.strip()
+            usage = resp.usage
+        else:
+            parser = RecordStreamParser(nested=structured)
+            parts = []
+            for event in resp:
+                if getattr(event, 'usage', None) is not None:
+                    usage = event.usage
+                if not event.choices:
+                    continue
+                delta = event.choices[0].delta.content or ''
+                parts.append(delta)
+                for record in parser.feed(delta):
+                    on_record(record)
+            output = ''.join(parts).strip()
+            if structured and not parser.records:
+                # Answered with a plain array despite the response format
+                for record in RecordStreamParser().feed(output):
+                    on_record(record)
+        if usage is not None:
+            sp.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+    if structured:
+        output = unwrap_records(output)
+    if cache is not None and usable_output(output):
+        cache.put(key, output)
+    return output
 
 def extract_json_from_output(output):
-    # Try to find the first JSON array in the output
-    try:
-        start = output.index('[')
-        end = output.rindex(']') + 1
-        json_str = output[start:end]
-        return json.loads(json_str)
-    except Exception as e:
+    # Recover every complete record, even from truncated or slightly malformed output
+    parser = RecordStreamParser()
+    records = parser.feed(output)
+    if not records:
         raise RuntimeError(f"Could not parse JSON from GPT output.\nGPT output was:\n{output}")
+    return records
+
+def validate_records(records, fields=None):
+    """
+    Validates and cleans year records against the schema, printing any problems.
+    """
+    clean = []
+    for record in records:
+        rec, problems = validate_record(record, fields or SCHEMA_FIELDS)
+        for problem in problems:
+            log.debug(f"Schema: {problem}")
+        if rec is not None:
+            clean.append(rec)
+    return clean
+
+def finish_records(records, on_issue=None):
+    """
+    Validates records and derives their totals; every path that returns
+    records ends here, so totals are never left at 0. on_issue, if given, is
+    called with every derive.check_records issue.
+    """
+    records, issues = derive.check_records(validate_records(records), SCHEMA_FIELDS)
+    for issue in issues if on_issue is not None else ():
+        on_issue(issue)
+    return records
+
+def model_issues(issues, records, model_records):
+    """
+    The issues a re-query can fix: those involving a value the merge took
+    from model_records rather than records (which take precedence). Totals
+    are not asked of the model, so a total that disagrees with its parts
+    counts only if one of the parts came from the model.
+    """
+    def values(recs):
+        return {(year_key(r.get("year")), f) for r in recs for f, v in r.items() if f != "year" and v not in (None, 0)}
+    from_model = values(model_records) - values(records)
+    fixable = []
+    for issue in issues:
+        fields = schema.DERIVED_FIELDS.get(issue["field"], ()) if issue["kind"] == "identity" else [issue["field"]]
+        if any((str(issue["year"]), field) in from_model for field in fields):
+            fixable.append(issue)
+    return fixable
+
+def missing_years(records, expected):
+    got = {year_key(r.get("year")) for r in records}
+    return [y for y in (expected or ()) if str(y) not in got]
+
+def year_key(value):
+    try:
+        return str(int(float(value)))
+    except (TypeError, ValueError):
+        return str(value).strip()
+
+def merge_year_records(chunk_records):
+    """
+    Merges per-chunk extraction results into one record per year.
+    Chunks are given in page order. For every (year, field):
+      - 0 / None / missing means "not reported on these pages";
+      - the first chunk reporting a non-zero value wins;
+      - a later chunk reporting a different non-zero value is recorded as a conflict.
+    Returns (records sorted by year, conflicts).
+    """
+    merged = {}
+    conflicts = []
+    for chunk_no, records in enumerate(chunk_records):
+        if isinstance(records, dict):
+            records = [records]
+        for record in records:
+            if not isinstance(record, dict) or "year" not in record:
+                continue
+            yr = year_key(record["year"])
+            target = merged.setdefault(yr, {"year": record["year"]})
+            for field, value in record.items():
+                if field == "year":
+                    continue
+                current = target.get(field)
+                if current in (None, 0):
+                    target[field] = 0 if value is None else value
+                elif value not in (None, 0) and value != current:
+                    conflicts.append({"year": yr, "field": field, "kept": current, "dropped": value, "chunk": chunk_no})
+    records = sorted(merged.values(), key=lambda r: year_key(r["year"]))
+    return records, conflicts
+
+def request_budget(client):
+    return min(MAX_REQUEST_TOKENS, client.request_budget(MAX_OUTPUT_TOKENS))
+
+def vision_extract_chunked(api_key, images, user_prompt, chunk_size=8, concurrency=4, cache=None, refresh=False, client=None,
+                           detail=None, years=None, structured=STRUCTURED_OUTPUT):
+    """
+    Splits the pages into batches of at most chunk_size pages and at most the
+    request token budget, extracts each batch concurrently over one shared
+    client and merges the results with merge_year_records.
+    """
+    if client is None:
+        client = apiclient.get_client(api_key)
+    budget = request_budget(client) - apiclient.estimate_text_tokens(user_prompt + schema.build_prompt(years))
+
+    def run(chunk):
+        # A chunk may legitimately hold no financials, so an empty result is not an error
+        return RecordStreamParser().feed(vision_extract(api_key, chunk, user_prompt, cache=cache, refresh=refresh,
+                                                  client=client, detail=detail, years=years,
+                                                  structured=structured))
+
+    def chunks():
+        batch = []
+        tokens = 0
+        for img in images:
+            page_tokens = apiclient.estimate_page_tokens(img, detail)
+            if batch and tokens + page_tokens > budget:
+                yield batch
+                batch = []
+                tokens = 0
+            batch.append(img)
+            tokens += page_tokens
+            if len(batch) == chunk_size:
+                yield batch
+                batch = []
+                tokens = 0
+        if batch:
+            yield batch
+
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = deque()
+        for chunk in chunks():
+            pending.append(pool.submit(run, chunk))
+            # Keep rendering only slightly ahead of the requests in flight
+            if len(pending) >= concurrency * 2:
+                results.append(pending.popleft().result())
+        while pending:
+            results.append(pending.popleft().result())
+    records, conflicts = merge_year_records(results)
+    for c in conflicts:
+        log.warning(f"Conflict for {c['field']} in {c['year']}: kept {c['kept']}, chunk {c['chunk']} reported {c['dropped']}")
+    return records
+
+def extract_records(api_key, pages, user_prompt, records=(), chunk_size=0, concurrency=4, cache=None, refresh=False,
+                    client=None, on_record=None, detail=None, years=None, structured=STRUCTURED_OUTPUT, on_issue=None):
+    """
+    Runs the model over the prepared pages and merges its year records with any
+    records already read directly from spreadsheets (those take precedence).
+    In single-request mode, on_record receives records while the response streams;
+    if the output was cut off, only the missing years are requested again.
+    years are the years to extract; in single-request mode they default to the
+    year headers of the pages when every page is text (schema.detect_years).
+    Consistency issues in values read from the model are re-asked once; those
+    left, and any in the records given, are passed to on_issue.
+    """
+    records = list(records)
+    if chunk_size <= 0:
+        pages = list(pages)
+        if years is None:
+            years = schema.detect_years(pages)
+        if client is None:
+            client = apiclient.get_client(api_key)
+        estimated = sum(apiclient.estimate_page_tokens(page, detail) for page in pages)
+        if estimated > request_budget(client):
+            log.info(f"About {estimated} input tokens is more than one request allows; splitting into chunks...")
+            chunk_size = len(pages)
+    options = dict(cache=cache, refresh=refresh, client=client, detail=detail, structured=structured)
+    if chunk_size > 0:
+        model_records = vision_extract_chunked(api_key, pages, user_prompt, chunk_size=chunk_size, concurrency=concurrency,
+                                               years=years, **options)
+    else:
+        output = vision_extract(api_key, pages, user_prompt, on_record=on_record, years=years, **options)
+        parser = RecordStreamParser()
+        parser.feed(output)
+        model_records = parser.records
+        for _ in range(MAX_FOLLOW_UPS):
+            missing = missing_years(model_records, years)
+            if not parser.truncated or (years and not missing):
+                break
+            if missing:
+                log.info(f"Output was truncated; requesting missing year(s) {', '.join(map(str, missing))}...")
+                output = vision_extract(api_key, pages, user_prompt, on_record=on_record, years=missing, **options)
+                wanted = {str(y) for y in missing}
+                keep = lambda r: year_key(r.get("year")) in wanted
+            else:
+                # The years are not known up front; ask for everything not yet returned
+                got = sorted({year_key(r.get("year")) for r in model_records})
+                log.info(f"Output was truncated; requesting years other than {', '.join(got)}...")
+                follow_up = (user_prompt.strip() + "\n\nOnly return the records for years other than: "
+                             + ", ".join(got) + ".").strip()
+                output = vision_extract(api_key, pages, follow_up, on_record=on_record, **options)
+                keep = lambda r: year_key(r.get("year")) not in got
+            parser = RecordStreamParser()
+            model_records += [r for r in parser.feed(output) if keep(r)]
+        if not model_records:
+            raise RuntimeError(f"Could not parse JSON from GPT output.\nGPT output was:\n{output}")
+    model_records = validate_records(model_records)
+    merged, issues = derive.check_records(merge_year_records([records, model_records])[0], SCHEMA_FIELDS)
+    # Chunked pages are rendered lazily and gone by now; only single requests can be re-asked
+    for _ in range(MAX_RECHECKS if chunk_size <= 0 else 0):
+        # Asking again cannot change values that came from the records given
+        fixable = model_issues(issues, records, model_records)
+        if not fixable:
+            break
+        recheck_years = derive.issue_years(fixable)
+        log.info(f"Re-checking inconsistent year(s) {', '.join(map(str, recheck_years))}...")
+        checks = "; ".join(f"{i['field']} in {i['year']} ({i['detail']})" for i in fixable)
+        recheck = (user_prompt.strip() + "\n\nRe-read these values carefully from the pages: " + checks + ".").strip()
+        output = vision_extract(api_key, pages, recheck, years=recheck_years, **options)
+        wanted = {str(y) for y in recheck_years}
+        rechecked = validate_records([r for r in RecordStreamParser().feed(output) if year_key(r.get("year")) in wanted])
+        got = {year_key(r["year"]) for r in rechecked}
+        model_records = [r for r in model_records if year_key(r["year"]) not in got] + rechecked
+        merged, issues = derive.check_records(merge_year_records([records, model_records])[0], SCHEMA_FIELDS)
+    for issue in issues if on_issue is not None else ():
+        on_issue(issue)
+    return merged
+
+class Extractor:
+    """
+    Reusable in-process extraction pipeline. Holds the shared rate-limited
+    model client (see apiclient) and the extraction settings, so repeated
+    runs (GUI submits, batch jobs) skip interpreter start-up and client
+    construction, and get records back in memory instead of through a JSON file.
+    engine is one of ENGINES: "model" sends whole pages to the model, "ocr"
+    reads tables locally and only sends uncertain cells (and pages without a
+    readable table), "offline" never calls the model. years fixes the years
+    to extract instead of detecting them; structured=False drops the
+    structured-output request for models that do not support it. With
+    dedup, pages repeated across the input files are sent only once.
+    """
+    def __init__(self, api_key, cache=None, chunk_size=0, concurrency=4, render_options=None,
+                 text_layer=True, max_pages=None, min_score=0.0, optimize=None, limits=None, engine='model',
+                 years=None, structured=STRUCTURED_OUTPUT, dedup=True):
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of {ENGINES}, not {engine!r}")
+        self.api_key = api_key
+        self.engine = engine
+        # limits: rpm / tpm / timeout for the shared client
+        self.client = None if engine == 'offline' else apiclient.get_client(api_key, **(limits or {}))
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.render_options = dict(render_options or {})
+        # optimize: imageopt.optimize_page options applied to every image page
+        self.payload_stats = imageopt.PayloadStats()
+        self.detail = None
+        if optimize is not None:
+            self.render_options.update(optimize=optimize, stats=self.payload_stats)
+            self.detail = optimize.get('detail')
+        self.text_layer = text_layer
+        self.max_pages = max_pages
+        self.min_score = min_score
+        self.years = years
+        self.structured = structured
+        self.dedup = dedup
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def render_pool(self, specs):
+        """
+        The process pool that scores and renders scanned pages, started the
+        first time specs include one and kept for later runs. None when there
+        is nothing to render or rendering runs in this process (workers=1).
+        """
+        if (self.render_options.get('workers') or os.cpu_count() or 1) == 1:
+            return None
+        if not any(kind == 'render' for kind, _ in specs):
+            return None
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.render_options.get('workers') or os.cpu_count())
+            return self._pool
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def plan(self, files):
+        """
+        Returns (records read directly, page specs to send, dropped pages).
+        """
+        records, specs = plan_inputs(files, text_layer=self.text_layer)
+        specs, dropped = filter_specs(specs, max_pages=self.max_pages, min_score=self.min_score,
+                                      pool=self.render_pool(specs))
+        return records, specs, dropped
+
+    def iter_pages(self, specs, deduper=None):
+        """
+        Yields the payload of every spec. With a dedup.PageDeduper, repeated
+        pages are left out and recorded on it under their spec_label.
+        """
+        pages = iter_planned_pages(specs, pool=self.render_pool(specs), **self.render_options)
+        if deduper is None:
+            return pages
+        return deduper.filter(pages, [spec_label(spec) for spec in specs])
+
+    def extract_pages(self, pages, user_prompt='', records=(), refresh=False, on_record=None, on_issue=None):
+        if self.engine != 'model':
+            import ocr
+            pages = list(pages)
+            ocr_records, no_table = ocr.extract_pages(pages, SCHEMA_FIELDS, client=self.client, cache=self.cache,
+                                                      workers=self.render_options.get('workers'))
+            # Records read straight from spreadsheets still take precedence
+            records, _ = merge_year_records([list(records), ocr_records])
+            if self.engine == 'offline' or not no_table:
+                if no_table:
+                    log.warning(f"{len(no_table)} page(s) had no readable table and were skipped offline.")
+                return finish_records(records, on_issue)
+            log.info(f"Sending {len(no_table)} page(s) without a readable table to the model...")
+            pages = [pages[i] for i in no_table]
+        return extract_records(self.api_key, pages, user_prompt, records, chunk_size=self.chunk_size,
+                               concurrency=self.concurrency, cache=self.cache, refresh=refresh, client=self.client,
+                               on_record=on_record, detail=self.detail, years=self.years, structured=self.structured,
+                               on_issue=on_issue)
+
+    def extract(self, files, user_prompt='', progress=None, refresh=False, on_record=None, on_issue=None):
+        """
+        Runs the whole extraction for files and returns the year records.
+        progress, if given, is called with a short status message per stage;
+        on_record with each raw year record as soon as the model completes it;
+        on_issue with each value that failed derive.check_records (by default
+        they are reported through progress).
+        """
+        progress = progress or (lambda message: None)
+        on_issue = on_issue or (lambda issue: progress(f"Check {derive.describe(issue)}"))
+        progress(f"Reading {len(files)} file(s)...")
+        records, specs, dropped = self.plan(files)
+        for label, score, reason in dropped:
+            progress(f"Dropped {label}: {reason}")
+        if not specs:
+            return finish_records(records, on_issue)
+        progress(f"Sending {len(specs)} page(s) to the model..." if self.engine == 'model'
+                 else f"Reading {len(specs)} page(s) locally...")
+        deduper = dedup.PageDeduper() if self.dedup else None
+        pages = self.iter_pages(specs, deduper)
+        extracted = self.extract_pages(pages, user_prompt, records, refresh=refresh, on_record=on_record,
+                                       on_issue=on_issue)
+        if deduper is not None and deduper.duplicates:
+            progress(f"Skipped {len(deduper.duplicates)} duplicate page(s)")
+        return extracted
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--key', required=True, help='OpenAI API key')
+    parser.add_argument('--key', help='OpenAI API key (not needed with --engine offline)')
     parser.add_argument('--prompt', required=True, help='User extraction prompt')
-    parser.add_argument('files', nargs='+', help='List of PDF files')
+    parser.add_argument('files', nargs='+', help='List of PDF, Excel or image files')
     parser.add_argument('-o', '--output', default='gpt4o_extracted.json')
+    parser.add_argument('--dpi', type=int, default=DEFAULT_DPI, help='Rasterization resolution')
+    parser.add_argument('--grayscale', action='store_true', help='Render pages in grayscale')
+    parser.add_argument('--format', default='PNG', type=str.upper, choices=IMAGE_FORMATS, help='Page image encoding')
+    parser.add_argument('--workers', type=int, default=None, help='Rendering processes (default: CPU count)')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the extraction cache')
+    parser.add_argument('--refresh', action='store_true', help='Ignore cached answers and overwrite them')
+    parser.add_argument('--cache-path', default=DEFAULT_CACHE_PATH, help='Extraction cache database')
+    parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), help='Evict least recently used entries above this size')
+    parser.add_argument('--chunk-size', type=int, default=0, help='Pages per request; 0 sends all pages in one request')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent requests in chunked mode')
+    parser.add_argument('--no-text-layer', action='store_true', help='Rasterize every PDF page even if it has a text layer')
+    parser.add_argument('--max-pages', type=int, default=None, help='Send only the N most relevant pages')
+    parser.add_argument('--min-score', type=float, default=0.0, help='Drop pages scoring below this relevance (0-1)')
+    parser.add_argument('--optimize', action='store_true', help='Trim, deskew, downscale and recompress page images before upload')
+    parser.add_argument('--image-format', default='JPEG', type=str.upper, choices=imageopt.OUTPUT_FORMATS, help='Upload encoding with --optimize')
+    parser.add_argument('--image-quality', type=int, default=80, help='JPEG/WebP quality with --optimize')
+    parser.add_argument('--detail', default='high', choices=('high', 'low'), help='Vision detail level with --optimize')
+    parser.add_argument('--color', action='store_true', help='Keep colour with --optimize (default converts to grayscale)')
+    parser.add_argument('--no-deskew', action='store_true', help='Skip deskewing with --optimize')
+    parser.add_argument('--years', type=int, nargs='+', default=None, help='Years to extract (default: detected from the documents)')
+    parser.add_argument('--deal', help='Deal name in the historical store (default: first file name plus content digest)')
+    parser.add_argument('--no-store', action='store_true', help='Do not add the records to the historical store')
+    parser.add_argument('--no-dedup', action='store_true', help='Send pages repeated across the input files every time')
+    parser.add_argument('--no-structured', action='store_true', help='Do not request JSON-schema structured output')
+    parser.add_argument('--engine', default='model', choices=ENGINES, help='model: whole pages to GPT; ocr: local Tesseract OCR, only uncertain cells to GPT; offline: local only')
+    parser.add_argument('--service', default=os.environ.get('GONOGO_SERVICE'), help='Submit to a running service.py at this URL instead of extracting here (default: $GONOGO_SERVICE)')
+    parser.add_argument('--rpm', type=int, default=apiclient.DEFAULT_RPM, help='Account requests-per-minute limit')
+    parser.add_argument('--tpm', type=int, default=apiclient.DEFAULT_TPM, help='Account tokens-per-minute limit')
+    parser.add_argument('--timeout', type=float, default=apiclient.DEFAULT_TIMEOUT, help='Seconds before a model request is retried')
+    parser.add_argument('--trace', help='Write a trace (.jsonl events, or .json Chrome trace)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show debug output')
     args = parser.parse_args()
+    tracing.setup(args.trace, args.verbose)
+    if not args.key and args.engine != 'offline':
+        parser.error('--key is required unless --engine offline')
+    if args.service:
+        import service
+        job = service.submit_job(args.service, api_key=args.key, files=args.files, prompt=args.prompt,
+                                 engine=args.engine, tenant=os.environ.get('USER'), deal=args.deal)
+        print(f"Submitted job {job['id']} to {args.service}")
+        try:
+            extracted = service.wait_for_job(args.service, job['id'], progress=print, tenant=job['tenant'])["records"]
+        except RuntimeError as e:
+            print(str(e))
+            sys.exit(1)
+        with open(args.output, 'w') as f:
+            json.dump(extracted, f, indent=2)
+        print(f"Extracted data saved to {args.output}")
+        return
 
-    print(f"Extracting {sum(convert_from_path(f).__len__() for f in args.files)} page(s) from {len(args.files)} file(s)...")
-    images = pdfs_to_images(args.files)
-    gpt_output = vision_extract(args.key, images, args.prompt)
-    try:
-        extracted = extract_json_from_output(gpt_output)
-    except Exception as e:
-        print(str(e))
-        sys.exit(1)
+    optimize = None
+    if args.optimize:
+        optimize = {"grayscale": not args.color, "straighten": not args.no_deskew, "detail": args.detail,
+                    "fmt": args.image_format, "quality": args.image_quality}
+    cache = None if args.no_cache else ExtractionCache(args.cache_path, args.cache_max_mb * 1024 * 1024)
+    extractor = Extractor(
+        args.key, cache=cache, chunk_size=args.chunk_size, concurrency=args.concurrency,
+        render_options={"dpi": args.dpi, "grayscale": args.grayscale, "fmt": args.format, "workers": args.workers},
+        text_layer=not args.no_text_layer, max_pages=args.max_pages, min_score=args.min_score, optimize=optimize,
+        limits={"rpm": args.rpm, "tpm": args.tpm, "timeout": args.timeout}, engine=args.engine,
+        years=args.years, structured=not args.no_structured, dedup=not args.no_dedup
+    )
+    records, specs, dropped = extractor.plan(args.files)
+    for label, score, reason in dropped:
+        print(f"Dropped {label}: {reason}")
+    n_text = sum(1 for kind, _ in specs if kind == 'text')
+    print(f"Extracting {len(specs)} page(s) from {len(args.files)} file(s) "
+          f"({n_text} as text, {len(specs) - n_text} as images, {len(records)} year record(s) read directly)...")
+    extracted = finish_records(records)
+    deduper = dedup.PageDeduper() if extractor.dedup else None
+    if specs:
+        images = extractor.iter_pages(specs, deduper)
+        try:
+            extracted = extractor.extract_pages(images, args.prompt, records, refresh=args.refresh)
+        except Exception as e:
+            print(str(e))
+            sys.exit(1)
+    if deduper is not None and deduper.duplicates:
+        print(f"Skipped {len(deduper.duplicates)} duplicate page(s), {deduper.bytes_saved} bytes:")
+        for label, original in deduper.duplicates:
+            print(f"  {label} (same as {original})")
+    if extractor.payload_stats.pages:
+        print(f"Payload: {extractor.payload_stats.summary()}")
+    if cache is not None:
+        print(f"Cache: {cache.hits} hit(s), {cache.misses} miss(es)")
     with open(args.output, 'w') as f:
         json.dump(extracted, f, indent=2)
     print(f"Extracted data saved to {args.output}")
+    if not args.no_store:
+        import store
+        store.record_extraction(args.deal or store.deal_name(args.files), extracted, os.path.abspath(args.output))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
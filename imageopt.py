@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import math
+import argparse
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# OpenAI vision sizing: images are fitted into 2048x2048, then the short side is
+# scaled to 768 and billed per 512px tile on top of a base cost.
+MAX_SIDE = 2048
+SHORT_SIDE = 768
+TILE = 512
+BASE_TOKENS = 85
+TILE_TOKENS = 170
+OUTPUT_FORMATS = ('JPEG', 'WEBP', 'PNG')
+
+def estimate_tokens(width, height, detail='high'):
+    if detail == 'low':
+        return BASE_TOKENS
+    width, height = model_size(width, height)
+    return BASE_TOKENS + TILE_TOKENS * math.ceil(width / TILE) * math.ceil(height / TILE)
+
+def model_size(width, height):
+    """
+    Size the model actually looks at after its own downscaling; uploading
+    anything larger only costs bytes.
+    """
+    scale = min(1.0, MAX_SIDE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def trim_margins(img, threshold=245, pad=16):
+    # Crop to the bounding box of everything darker than the paper
+    gray = img.convert('L')
+    bbox = gray.point(lambda p: 255 if p < threshold else 0).getbbox()
+    if not bbox:
+        return img
+    left, top, right, bottom = bbox
+    return img.crop((max(0, left - pad), max(0, top - pad), min(img.width, right + pad), min(img.height, bottom + pad)))
+
+def estimate_skew(img, max_angle=3.0, step=0.25):
+    """
+    Finds the rotation that makes text lines horizontal by maximising the
+    sharpness of the row ink profile on a small binarised copy.
+    """
+    small = img.convert('L')
+    small.thumbnail((800, 800))
+    ink = small.point(lambda p: 255 if p < 160 else 0)
+    best_angle, best_score = 0.0, -1.0
+    steps = int(max_angle / step)
+    for i in range(-steps, steps + 1):
+        angle = i * step
+        rotated = ink.rotate(angle, resample=Image.NEAREST, fillcolor=0)
+        profile = list(rotated.resize((1, rotated.height), Image.BOX).getdata())
+        score = sum((a - b) ** 2 for a, b in zip(profile, profile[1:]))
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+def deskew(img, max_angle=3.0):
+    angle = estimate_skew(img, max_angle)
+    if not angle:
+        return img
+    fill = 255 if img.mode == 'L' else (255,) * len(img.getbands())
+    return img.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=fill)
+
+def optimize_image(img, grayscale=True, trim=True, straighten=True, detail='high'):
+    img = ImageOps.exif_transpose(img)
+    img = img.convert('L' if grayscale else 'RGB')
+    if straighten:
+        img = deskew(img)
+    if trim:
+        img = trim_margins(img)
+    if detail == 'low':
+        img.thumbnail((TILE, TILE), Image.LANCZOS)
+    else:
+        size = model_size(img.width, img.height)
+        if size != img.size:
+            img = img.resize(size, Image.LANCZOS)
+    return img
+
+def encode_image(img, fmt='JPEG', quality=80):
+    buf = BytesIO()
+    if fmt == 'PNG':
+        img.save(buf, format='PNG', optimize=True)
+    elif fmt == 'WEBP':
+        img.save(buf, format='WEBP', quality=quality, method=4)
+    else:
+        img.save(buf, format='JPEG', quality=quality, optimize=True)
+    return buf.getvalue()
+
+def optimize_page(data, grayscale=True, trim=True, straighten=True, detail='high', fmt='JPEG', quality=80):
+    """
+    Shrinks one encoded page image for upload. Returns (bytes, stats) where stats
+    holds bytes and estimated vision tokens before and after.
+    """
+    with Image.open(BytesIO(data)) as img:
+        before_tokens = estimate_tokens(img.width, img.height, 'high')
+        out = optimize_image(img, grayscale, trim, straighten, detail)
+    encoded = encode_image(out, fmt.upper(), quality)
+    stats = {
+        "bytes_before": len(data),
+        "bytes_after": len(encoded),
+        "tokens_before": before_tokens,
+        "tokens_after": estimate_tokens(out.width, out.height, detail),
+    }
+    return encoded, stats
+
+class PayloadStats:
+    """
+    Running totals of payload size and estimated tokens over many pages.
+    """
+    def __init__(self):
+        self.pages = 0
+        self.totals = {"bytes_before": 0, "bytes_after": 0, "tokens_before": 0, "tokens_after": 0}
+
+    def add(self, stats):
+        self.pages += 1
+        for k in self.totals:
+            self.totals[k] += stats[k]
+
+    def summary(self):
+        t = self.totals
+        return (f"{self.pages} page(s): {t['bytes_before'] / 1e6:.2f} MB -> {t['bytes_after'] / 1e6:.2f} MB, "
+                f"~{t['tokens_before']} -> ~{t['tokens_after']} image tokens")
+
+def compare_records(records, golden):
+    """
+    Compares extracted year records with stored golden ones.
+    Returns (fields compared, [(year, field, expected, got)] mismatches).
+    """
+    by_year = {str(r.get("year")): r for r in records}
+    compared = 0
+    mismatches = []
+    for expected in golden:
+        yr = str(expected.get("year"))
+        got = by_year.get(yr, {})
+        for field, value in expected.items():
+            if field == "year":
+                continue
+            compared += 1
+            if got.get(field) != value:
+                mismatches.append((yr, field, value, got.get(field)))
+    return compared, mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune page image optimization offline")
+    sub = parser.add_subparsers(dest='command', required=True)
+    rep = sub.add_parser('report', help='Show payload size and tokens before/after for page images')
+    rep.add_argument('images', nargs='+')
+    rep.add_argument('--format', default='JPEG', type=str.upper, choices=OUTPUT_FORMATS)
+    rep.add_argument('--quality', type=int, default=80)
+    rep.add_argument('--detail', default='high', choices=('high', 'low'))
+    rep.add_argument('--color', action='store_true', help='Keep colour instead of converting to grayscale')
+    rep.add_argument('--save-dir', help='Write the optimized images here for inspection')
+    cmp_ = sub.add_parser('compare', help='Check extracted JSON against a stored golden output')
+    cmp_.add_argument('output')
+    cmp_.add_argument('golden')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.output) as f:
+            records = json.load(f)
+        with open(args.golden) as f:
+            golden = json.load(f)
+        compared, mismatches = compare_records(records, golden)
+        for yr, field, expected, got in mismatches:
+            print(f"{yr} {field}: expected {expected}, got {got}")
+        print(f"{compared - len(mismatches)}/{compared} field(s) match")
+        sys.exit(1 if mismatches else 0)
+
+    totals = PayloadStats()
+    for path in args.images:
+        with open(path, 'rb') as f:
+            data, stats = optimize_page(f.read(), grayscale=not args.color, detail=args.detail,
+                                        fmt=args.format, quality=args.quality)
+        totals.add(stats)
+        print(f"{path}: {stats['bytes_before']} -> {stats['bytes_after']} bytes, "
+              f"~{stats['tokens_before']} -> ~{stats['tokens_after']} tokens")
+        if args.save_dir:
+            os.makedirs(args.save_dir, exist_ok=True)
+            name = os.path.splitext(os.path.basename(path))[0] + '.' + args.format.lower().replace('jpeg', 'jpg')
+            with open(os.path.join(args.save_dir, name), 'wb') as f:
+                f.write(data)
+    print(totals.summary())
+
+if __name__ == "__main__":
+    main()
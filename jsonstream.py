@@ -0,0 +1,124 @@
+import re
+import json
+
+TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+NUMBER_RE = re.compile(r'^\(?-?[$€£]?-?[\d,]*\.?\d+\)?$')
+YEAR_RANGE = (1990, 2100)
+
+class RecordStreamParser:
+    """
+    Incremental parser for model output shaped like a JSON array of objects.
+    Feed it text as it arrives; every top-level object is returned as soon as
+    its closing brace is seen, so complete records survive truncated output.
+    Tolerates markdown fences, commentary around the array and trailing commas.
+    With nested=True the records are the objects one level down, as in the
+    {"records": [...]} wrapper of a structured-output response.
+    """
+    def __init__(self, nested=False):
+        self._base = 1 if nested else 0
+        self._buf = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.records = []
+        self.errors = []
+
+    def feed(self, chunk):
+        completed = []
+        for ch in chunk:
+            if self._depth > self._base:
+                self._buf.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"' and self._depth:
+                self._in_string = True
+            elif ch == '{':
+                if self._depth == self._base:
+                    self._buf = ['{']
+                self._depth += 1
+            elif ch == '}' and self._depth:
+                self._depth -= 1
+                if self._depth == self._base:
+                    record = self._decode(''.join(self._buf))
+                    self._buf = []
+                    if record is not None:
+                        completed.append(record)
+        self.records.extend(completed)
+        return completed
+
+    @property
+    def truncated(self):
+        # Output stopped in the middle of an object
+        return self._depth > 0
+
+    def _decode(self, text):
+        for candidate in (text, TRAILING_COMMA_RE.sub(r'\1', text)):
+            try:
+                value = json.loads(candidate)
+            except ValueError:
+                continue
+            if isinstance(value, dict):
+                return value
+        self.errors.append(text)
+        return None
+
+def parse_number(value):
+    """
+    Coerces a model-reported amount to a number: handles thousands separators,
+    currency symbols and accounting negatives such as (1,234). Returns None if
+    the value is not numeric.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if not isinstance(value, str):
+        return None
+    s = value.strip().replace(' ', '')
+    if not s or not NUMBER_RE.match(s):
+        return None
+    negative = s.startswith('(') and s.endswith(')') or '-' in s
+    s = s.strip('()').replace(',', '').lstrip('-$€£').lstrip('-')
+    try:
+        num = float(s)
+    except ValueError:
+        return None
+    if num.is_integer():
+        num = int(num)
+    return -num if negative else num
+
+def validate_record(record, fields, year_range=YEAR_RANGE):
+    """
+    Checks one year record against the schema: a year within year_range, only
+    known fields, numeric values. Returns (cleaned record or None, problems).
+    Missing or non-numeric fields become 0; unknown fields are dropped.
+    """
+    problems = []
+    try:
+        year = int(float(record.get("year")))
+    except (TypeError, ValueError):
+        return None, [f"record without a valid year: {record.get('year')!r}"]
+    if not year_range[0] <= year <= year_range[1]:
+        return None, [f"year {year} outside {year_range[0]}-{year_range[1]}"]
+    clean = {"year": year}
+    for field in fields:
+        if field not in record:
+            problems.append(f"{year}: missing '{field}'")
+            clean[field] = 0
+            continue
+        value = record[field]
+        num = 0 if value is None else parse_number(value)
+        if num is None:
+            problems.append(f"{year}: non-numeric '{field}' = {value!r}")
+            num = 0
+        clean[field] = num
+    for field in record:
+        if field != "year" and field not in fields:
+            problems.append(f"{year}: unknown field '{field}'")
+    return clean, problems
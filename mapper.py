@@ -0,0 +1,168 @@
+import re
+from difflib import get_close_matches
+
+from jsonstream import parse_number
+from schema import DERIVED_FIELDS
+
+# Source labels seen in statements, per template category (matched after normalize_label)
+SYNONYMS = {
+    "Revenue": ["sales", "total sales", "turnover", "total revenue", "revenue from operations", "trading income",
+                "sales revenue", "gross sales", "income from sales"],
+    "Cost of Goods Sold (COGS)": ["cogs", "cost of sales", "cost of goods sold", "cost of revenue", "direct costs",
+                                  "purchases", "total cost of sales"],
+    # Not "expenses" / "total expenses": those totals usually include COGS
+    "Less Operating Expenses": ["operating expenses", "total operating expenses", "opex", "overheads",
+                                "operating costs"],
+    "Other Income": ["other revenue", "sundry income", "non operating income", "other operating income",
+                     "miscellaneous income"],
+    "Taxes": ["income tax", "income tax expense", "tax expense", "tax"],
+    "Plus Depreciation & Amortization": ["depreciation", "amortization", "depreciation and amortization",
+                                         "d and a", "depreciation expense"],
+    "Plus Interest": ["interest", "interest expense", "interest paid", "finance costs", "borrowing costs"],
+    "Plus Taxes": ["add back taxes", "taxes added back"],
+    "Plus Owner Salary+Super etc": ["owner salary super", "owner salary", "owners salary", "owner wages",
+                                    "directors fees", "director salary", "owner salary and super"],
+    "Plus Owner Benefits": ["owner benefits", "owners benefits", "owner perks", "personal expenses"],
+    "Manager Salary": ["manager wages", "managers salary", "management salary"],
+    "Investor Salary": ["investor wages", "investors salary"],
+    "One off Revenue Adjustments": ["one off revenue", "non recurring revenue", "one off income adjustments"],
+    "One off Expenses Adjustments": ["one off expenses", "non recurring expenses", "one off costs"],
+    "Total add backs": ["add backs", "total addbacks", "addbacks"],
+}
+
+# Unit words in a label, e.g. "Revenue ($000)" or "Sales (in millions)"
+UNIT_PATTERNS = [
+    (re.compile(r"\(\s*\$?\s*'?000s?\s*\)|\bin thousands\b|\$k\b|\(\s*k\s*\)", re.IGNORECASE), 1000),
+    (re.compile(r"\(\s*\$?\s*m\s*\)|\bin millions\b|\$m\b|\bmillions\b", re.IGNORECASE), 1000000),
+]
+UNIT_WORDS = {"thousands": 1000, "000": 1000, "k": 1000, "millions": 1000000, "m": 1000000}
+FUZZY_CUTOFF = 0.88
+# Decisions passed to learn() outrank synonyms and fuzzy matches
+MATCH_LEVELS = {'exact': 0, 'learned': 1, 'synonym': 2, 'fuzzy': 3}
+
+def normalize_label(label):
+    s = str(label).lower()
+    for pattern, _ in UNIT_PATTERNS:
+        s = pattern.sub(' ', s)
+    s = s.replace('&', ' and ').replace('amortisation', 'amortization').replace("'", '')
+    s = re.sub(r'[^a-z0-9]+', ' ', s)
+    return ' '.join(s.split())
+
+def is_total(label):
+    return normalize_label(label).startswith('total ')
+
+def label_multiplier(label):
+    for pattern, factor in UNIT_PATTERNS:
+        if pattern.search(str(label)):
+            return factor
+    return 1
+
+class FieldMapper:
+    """
+    Maps extracted labels onto the template categories without a model call.
+    Labels are matched exactly, then through SYNONYMS, then fuzzily against the
+    precomputed index of normalized names. Labels that cannot be resolved
+    confidently are reported so only those need a model round trip.
+    """
+    def __init__(self, targets, synonyms=SYNONYMS, cutoff=FUZZY_CUTOFF):
+        self.targets = list(dict.fromkeys(targets))
+        self.cutoff = cutoff
+        self.exact = {normalize_label(t): t for t in self.targets}
+        self.index = dict(self.exact)
+        for target, aliases in synonyms.items():
+            if target not in self.exact.values():
+                continue
+            for alias in aliases:
+                self.index.setdefault(normalize_label(alias), target)
+        # Also index the category names without their "plus"/"less" prefixes
+        for key, target in list(self.exact.items()):
+            stripped = re.sub(r'^(plus|less|total) ', '', key)
+            self.index.setdefault(stripped, target)
+        self.learned = {}
+        self._resolved = {}
+
+    def learn(self, mapping):
+        """
+        Adds label -> target decisions (e.g. from the model). A None target
+        marks a label that fits no category, so it is skipped from then on.
+        """
+        for label, target in mapping.items():
+            if target is None or target in self.targets:
+                self.learned[normalize_label(label)] = target
+                self._resolved.pop(label, None)
+
+    def resolve(self, label):
+        """
+        Returns (target or None, how it was matched).
+        """
+        if label in self._resolved:
+            return self._resolved[label]
+        key = normalize_label(label)
+        if key in self.exact:
+            result = (self.exact[key], 'exact')
+        elif key in self.learned:
+            result = (self.learned[key], 'learned') if self.learned[key] else (None, 'ignored')
+        elif key in self.index:
+            result = (self.index[key], 'synonym')
+        else:
+            result = (None, 'unresolved')
+            match = get_close_matches(key, self.index.keys(), n=1, cutoff=self.cutoff)
+            if match:
+                result = (self.index[match[0]], 'fuzzy')
+        self._resolved[label] = result
+        return result
+
+    def map_records(self, data):
+        """
+        Maps year records onto the targets. Returns (records, unresolved labels).
+        Values are normalized to plain numbers: accounting negatives, separators
+        and units given in the label or a record-level "units" key are applied.
+        When several source labels land on one category, the one matched at the
+        best level (exact, learned, synonym, then fuzzy) wins. Labels matched at
+        the same level are never summed, since they are usually a line and its
+        subtotal: a "total ..." label is preferred over the others, and any
+        other tie keeps the first value and reports the labels as unresolved
+        so the model can decide. Derived totals (schema.DERIVED_FIELDS) are
+        left out rather than defaulted to 0; derive.check_records fills them in.
+        """
+        if isinstance(data, dict):
+            data = [data] if "year" in data else [dict(v, year=k) for k, v in data.items() if isinstance(v, dict)]
+        records = []
+        unresolved = []
+        for entry in data:
+            if not isinstance(entry, dict) or "year" not in entry:
+                continue
+            units = UNIT_WORDS.get(str(entry.get("units", "")).strip().lower().lstrip("'"), 1)
+            out = {"year": entry["year"]}
+            # Best match level and the label it came from, per target; lower is better
+            levels = {}
+            chosen = {}
+            for label, value in entry.items():
+                if label in ("year", "units"):
+                    continue
+                target, how = self.resolve(label)
+                if how == 'ignored':
+                    continue
+                if target is None:
+                    if label not in unresolved:
+                        unresolved.append(label)
+                    continue
+                num = parse_number(value)
+                if num is None:
+                    continue
+                num = num * label_multiplier(label) * units
+                level = MATCH_LEVELS[how]
+                if level < levels.get(target, len(MATCH_LEVELS)) or (
+                        level == levels[target] and is_total(label) and not is_total(chosen[target])):
+                    out[target] = num
+                    levels[target] = level
+                    chosen[target] = label
+                elif level == levels[target] and is_total(label) == is_total(chosen[target]):
+                    for ambiguous in (chosen[target], label):
+                        if ambiguous not in unresolved:
+                            unresolved.append(ambiguous)
+            for target in self.targets:
+                if target not in DERIVED_FIELDS:
+                    out.setdefault(target, 0)
+            records.append(out)
+        return records, unresolved
@@ -0,0 +1,264 @@
+import re
+import base64
+import logging
+from io import BytesIO
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from jsonstream import RecordStreamParser, parse_number
+from mapper import FieldMapper, label_multiplier
+from cache import cache_key, page_digest
+import tracing
+
+log = logging.getLogger(__name__)
+
+# Cells below this confidence (0-100) are confirmed by the model, or kept with a warning offline
+MIN_CONFIDENCE = 80
+# Confidence given to a cell whose label was only matched fuzzily
+FUZZY_CONFIDENCE = 70
+TEXT_CONFIDENCE = 100
+CROP_PADDING = 8
+VERIFY_MODEL = "gpt-4o"
+YEAR_RE = re.compile(r'^(?:FY\s?)?((?:19|20)\d{2})$', re.IGNORECASE)
+CURRENCY_TOKENS = {'$', '€', '£', '-', '—'}
+
+# One recognized token; left/top/width/height in page pixels (ordinal positions for text pages)
+Word = namedtuple('Word', ['text', 'conf', 'left', 'top', 'width', 'height'])
+# One value read off a page
+Cell = namedtuple('Cell', ['year', 'field', 'value', 'conf', 'page', 'box', 'label'])
+
+def available():
+    """
+    True if pytesseract and the tesseract binary are installed.
+    """
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+    except Exception:
+        return False
+    return True
+
+def ocr_words(img, lang='eng'):
+    """
+    Runs Tesseract on one page image and returns its words with confidences.
+    """
+    import pytesseract
+    with Image.open(BytesIO(img)) as im:
+        data = pytesseract.image_to_data(im.convert('L'), lang=lang, config='--psm 6',
+                                         output_type=pytesseract.Output.DICT)
+    words = []
+    for i, text in enumerate(data['text']):
+        conf = float(data['conf'][i])
+        if conf < 0 or not text.strip():
+            continue
+        words.append(Word(text.strip(), conf, data['left'][i], data['top'][i], data['width'][i], data['height'][i]))
+    return words
+
+def text_words(text):
+    """
+    Splits a text-layer page into words laid out on a grid: cells separated
+    by two or more spaces get consecutive x positions, lines consecutive y.
+    Text is exact, so every word has full confidence.
+    """
+    words = []
+    # The first line is the "[Text of ..., page N]" header added by format_page_text
+    for y, line in enumerate(text.splitlines()[1:]):
+        for x, cell in enumerate(c for c in re.split(r'\s{2,}', line.strip()) if c):
+            words.append(Word(cell, TEXT_CONFIDENCE, x, y, 1, 1))
+    return words
+
+def group_lines(words):
+    """
+    Clusters words into visual lines by vertical centre, each sorted left to right.
+    """
+    lines = []
+    for word in sorted(words, key=lambda w: w.top + w.height / 2):
+        centre = word.top + word.height / 2
+        if lines:
+            last = lines[-1]
+            last_centre = sum(w.top + w.height / 2 for w in last) / len(last)
+            if abs(centre - last_centre) <= max(1, word.height) / 2:
+                last.append(word)
+                continue
+        lines.append([word])
+    return [sorted(line, key=lambda w: w.left) for line in lines]
+
+def _year(text):
+    m = YEAR_RE.match(text.strip())
+    return m.group(1) if m else None
+
+def parse_table(words, mapper, page=0, aligned=True):
+    """
+    Reads year columns and labelled rows from a page's words. The latest line
+    holding two or more years is the header; every later line with a label
+    and numbers gives cells, each number going to the nearest year column.
+    With aligned=False (text pages, whose x positions are only ordinals) the
+    numbers are matched to the rightmost years instead, and rows with more
+    numbers than years are marked uncertain.
+    Returns (cells, found_header).
+    """
+    cells = []
+    header = None
+    for line in group_lines(words):
+        years = [(w, _year(w.text)) for w in line if _year(w.text)]
+        if len(years) >= 2:
+            header = [(yr, w.left + w.width / 2) for w, yr in years]
+            continue
+        if header is None:
+            continue
+        label_words = []
+        numbers = []
+        for w in line:
+            if w.text in CURRENCY_TOKENS and not numbers:
+                continue
+            value = parse_number(w.text)
+            if value is None:
+                if not numbers:
+                    label_words.append(w)
+                continue
+            numbers.append((w, value))
+        if not label_words or not numbers:
+            continue
+        label = ' '.join(w.text for w in label_words)
+        field, how = mapper.resolve(label)
+        if field is None:
+            continue
+        label_conf = min(w.conf for w in label_words)
+        if how == 'fuzzy':
+            label_conf = min(label_conf, FUZZY_CONFIDENCE)
+        if aligned:
+            spacing = min((b[1] - a[1] for a, b in zip(header, header[1:])), default=0) or 1
+            placed = []
+            for w, value in numbers:
+                centre = w.left + w.width / 2
+                yr, x = min(header, key=lambda h: abs(h[1] - centre))
+                conf = min(w.conf, label_conf)
+                if abs(x - centre) > abs(spacing) / 2:
+                    conf = min(conf, MIN_CONFIDENCE - 1)
+                placed.append((w, yr, value, conf))
+        else:
+            ordered = header[-len(numbers):] if len(numbers) <= len(header) else header
+            uncertain = len(numbers) > len(header)
+            placed = [(w, yr, value, MIN_CONFIDENCE - 1 if uncertain else min(w.conf, label_conf))
+                      for (w, value), (yr, _) in zip(numbers[-len(ordered):], ordered)]
+        first = label_words[0]
+        for w, yr, value, conf in placed:
+            box = (first.left, min(first.top, w.top), w.left + w.width, max(first.top + first.height, w.top + w.height))
+            cells.append(Cell(yr, field, value * label_multiplier(label), conf, page, box, label))
+    return cells, header is not None
+
+def _ocr_page(args):
+    page, img, lang = args
+    return page, ocr_words(img, lang)
+
+def read_pages(pages, fields, workers=None, lang='eng'):
+    """
+    Reads cells from every page: text pages are parsed directly, image pages
+    are OCR'd in a process pool. Returns (cells, indexes of pages without a table).
+    """
+    mapper = FieldMapper(fields)
+    cells = []
+    no_table = []
+    images = [(i, page, lang) for i, page in enumerate(pages) if not isinstance(page, str)]
+    words = {}
+    if images:
+        with tracing.span("ocr.pages", pages=len(images)):
+            if len(images) == 1 or workers == 1:
+                words.update(map(_ocr_page, images))
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    words.update(pool.map(_ocr_page, images))
+    for i, page in enumerate(pages):
+        if isinstance(page, str):
+            page_cells, found = parse_table(text_words(page), mapper, i, aligned=False)
+        else:
+            page_cells, found = parse_table(words[i], mapper, i)
+        if not found or not page_cells:
+            no_table.append(i)
+        cells.extend(page_cells)
+    return cells, no_table
+
+def crop(img, box, padding=CROP_PADDING):
+    with Image.open(BytesIO(img)) as im:
+        left, top, right, bottom = box
+        region = im.crop((max(0, left - padding), max(0, top - padding),
+                          min(im.width, right + padding), min(im.height, bottom + padding)))
+        buf = BytesIO()
+        region.convert('L').save(buf, format='PNG')
+    return buf.getvalue()
+
+def verify_cells(client, cells, pages, cache=None):
+    """
+    Asks the model to read the amount in a crop around each uncertain cell.
+    All crops go in one low-detail request. Returns {index in cells: value}.
+    """
+    prompt = ("Each image below is a crop of one row of a financial statement. For each numbered crop, "
+              "read the amount at the right-hand end of the row. Accounting negatives are in parentheses. "
+              'Return only a JSON array like [{"id": 0, "value": 1234}]; use null if unreadable.')
+    contents = [{"type": "text", "text": prompt}]
+    digests = []
+    for i, cell in enumerate(cells):
+        data = crop(pages[cell.page], cell.box)
+        digests.append(page_digest(data))
+        contents.append({"type": "text", "text": f"Crop {i}: {cell.label}, {cell.year}"})
+        contents.append({"type": "image_url", "image_url": {
+            "url": "data:image/png;base64," + base64.b64encode(data).decode('utf-8'), "detail": "low"}})
+    key = cache_key(digests, prompt, f"{VERIFY_MODEL}:verify", 0)
+    output = cache.get(key) if cache is not None else None
+    if output is None:
+        with tracing.span("model.verify", crops=len(cells)):
+            resp = client.chat(model=VERIFY_MODEL, messages=[{"role": "user", "content": contents}],
+                               max_tokens=30 * len(cells) + 50, temperature=0)
+        output = resp.choices[0].message.content.strip()
+        if cache is not None:
+            cache.put(key, output)
+    values = {}
+    for item in RecordStreamParser().feed(output):
+        value = parse_number(item.get("value"))
+        if isinstance(item.get("id"), int) and 0 <= item["id"] < len(cells) and value is not None:
+            values[item["id"]] = value
+    return values
+
+def cells_to_records(cells):
+    """
+    One record per year. Where a page repeats a (year, field), the most
+    confident reading wins, earlier pages first on ties.
+    """
+    best = {}
+    for cell in cells:
+        key = (cell.year, cell.field)
+        if key not in best or cell.conf > best[key].conf:
+            best[key] = cell
+    records = {}
+    for (yr, field), cell in best.items():
+        records.setdefault(yr, {"year": int(yr)})[field] = cell.value
+    return [records[yr] for yr in sorted(records)]
+
+def extract_pages(pages, fields, client=None, cache=None, workers=None, min_confidence=MIN_CONFIDENCE, lang='eng'):
+    """
+    Hybrid extraction: reads tables locally and sends only uncertain cells,
+    cropped, to the model. Without a client (offline) uncertain cells are kept
+    as read. Returns (records, pages without a readable table).
+    """
+    pages = list(pages)
+    if any(not isinstance(page, str) for page in pages) and not available():
+        raise RuntimeError("Local OCR needs Tesseract: pip install pytesseract and install the tesseract binary.")
+    cells, no_table = read_pages(pages, fields, workers, lang)
+    uncertain = [i for i, cell in enumerate(cells) if cell.conf < min_confidence]
+    tracing.count("ocr.cells", len(cells))
+    tracing.count("ocr.uncertain", len(uncertain))
+    # Text pages have no pixels to crop; their uncertain cells stay as read
+    croppable = [i for i in uncertain if not isinstance(pages[cells[i].page], str)]
+    if croppable and client is not None:
+        values = verify_cells(client, [cells[i] for i in croppable], pages, cache)
+        for n, i in enumerate(croppable):
+            if n in values:
+                cells[i] = cells[i]._replace(value=values[n] * label_multiplier(cells[i].label),
+                                             conf=TEXT_CONFIDENCE)
+    for cell in cells:
+        if cell.conf < min_confidence:
+            log.warning(f"Low confidence ({cell.conf:.0f}) for {cell.field} {cell.year} on page {cell.page + 1}: {cell.value}")
+    log.info(f"OCR read {len(cells)} value(s); {len(croppable) if client else 0} confirmed by the model")
+    return cells_to_records(cells), no_table
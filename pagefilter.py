@@ -0,0 +1,106 @@
+import re
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+KEYWORDS = [
+    "revenue", "sales", "turnover", "cost of goods sold", "cogs", "cost of sales", "gross profit",
+    "operating expenses", "expenses", "other income", "depreciation", "amortisation", "amortization",
+    "interest", "tax", "net profit", "ebitda", "wages", "salaries", "superannuation",
+    "profit and loss", "profit & loss", "income statement", "balance sheet", "owner", "adjustments",
+]
+YEAR_RE = re.compile(r'\b(?:FY\s?)?((?:19|20)\d{2})\b')
+NUMBER_RE = re.compile(r'\(?-?\$?\d[\d,]*(?:\.\d+)?\)?')
+BLANK_INK = 0.005
+# Scanned pages are judged at this width (about A4 at the 36 DPI thumbnail)
+SCAN_WIDTH = 300
+INK_LEVEL = 160
+# A row with at least this share of ink belongs to a line of text
+LINE_INK = 0.01
+# Column gaps: runs at least this share of the width wide that nearly no line (< GUTTER_LINES) has ink in
+GUTTER_WIDTH = 0.02
+GUTTER_LINES = 0.1
+
+def score_text(text):
+    """
+    Scores a page from its text: financial keywords, year headers and how
+    many numbers it carries. Returns (score in 0..1, reason).
+    """
+    lower = text.lower()
+    keywords = [k for k in KEYWORDS if k in lower]
+    years = set(YEAR_RE.findall(text))
+    numbers = len(NUMBER_RE.findall(text)) - len(years)
+    score = (0.5 * min(1.0, len(keywords) / 6)
+             + 0.2 * min(1.0, len(years) / 2)
+             + 0.3 * min(1.0, max(0, numbers) / 40))
+    return score, f"{len(keywords)} keyword(s), {len(years)} year(s), {max(0, numbers)} number(s)"
+
+def text_lines(ink):
+    """
+    (start, end) row ranges of the lines of text in a boolean ink array.
+    """
+    lines = []
+    start = None
+    for y, inked in enumerate(list(ink.mean(axis=1) >= LINE_INK) + [False]):
+        if inked and start is None:
+            start = y
+        elif not inked and start is not None:
+            lines.append((start, y))
+            start = None
+    return lines
+
+def column_gaps(ink, lines):
+    """
+    Number of vertical gutters running through the lines of text, as between
+    the label and year columns of a statement. Prose has none.
+    """
+    share = np.array([ink[start:end].any(axis=0) for start, end in lines]).mean(axis=0)
+    used = np.nonzero(share >= GUTTER_LINES)[0]
+    if not len(used):
+        return 0
+    gaps = 0
+    run = 0
+    for x in range(used[0], used[-1] + 1):
+        if share[x] < GUTTER_LINES:
+            run += 1
+            continue
+        if run >= GUTTER_WIDTH * ink.shape[1]:
+            gaps += 1
+        run = 0
+    return gaps
+
+def score_image(img):
+    """
+    Scores a page without text from its layout: blank pages score 0; pages
+    with many lines of text split into columns (tables of figures) score
+    highest, then full pages of prose, then sparse pages such as covers.
+    Returns (score in 0..1, reason).
+    """
+    with Image.open(BytesIO(img)) as im:
+        gray = im.convert('L')
+    gray = gray.resize((SCAN_WIDTH, max(1, round(gray.height * SCAN_WIDTH / gray.width))), Image.BILINEAR)
+    ink = np.asarray(gray) < INK_LEVEL
+    if ink.mean() < BLANK_INK:
+        return 0.0, "blank page"
+    lines = text_lines(ink)
+    gaps = column_gaps(ink, lines) if lines else 0
+    density = min(1.0, len(lines) / 20)
+    score = 0.1 + 0.3 * density + 0.6 * density * min(1.0, gaps / 3)
+    return score, f"no text layer, {len(lines)} line(s), {gaps} column gap(s)"
+
+def select_pages(scores, max_pages=None, min_score=0.0):
+    """
+    Given [(score, reason)] per page, returns (kept indices in page order,
+    dropped as [(index, score, reason)]).
+    """
+    candidates = [i for i, (score, _) in enumerate(scores) if score >= min_score]
+    dropped = [(i, score, f"{reason}; score {score:.2f} < {min_score:.2f}")
+               for i, (score, reason) in enumerate(scores) if score < min_score]
+    if max_pages is not None and len(candidates) > max_pages:
+        ranked = sorted(candidates, key=lambda i: scores[i][0], reverse=True)
+        for i in ranked[max_pages:]:
+            score, reason = scores[i]
+            dropped.append((i, score, f"{reason}; score {score:.2f} not in top {max_pages}"))
+        candidates = sorted(ranked[:max_pages])
+    return candidates, sorted(dropped)
@@ -0,0 +1,96 @@
+import json
+
+from pagefilter import YEAR_RE
+
+# The year record, defined once. Each field: name (the JSON key), label (the
+# template row it fills), recurring for lines expected every year at a similar
+# size and, for totals, the parts it is derived from locally.
+FIELDS = [
+    {"name": "Revenue", "recurring": True},
+    {"name": "Cost of Goods Sold (COGS)", "recurring": True},
+    {"name": "Less Operating Expenses", "recurring": True},
+    {"name": "Other Income"},
+    {"name": "Taxes"},
+    {"name": "Plus Depreciation & Amortization", "recurring": True},
+    {"name": "Plus Interest", "recurring": True},
+    {"name": "Plus Taxes"},
+    {"name": "Plus Owner Salary+Super etc"},
+    {"name": "Plus Owner Benefits"},
+    {"name": "Manager Salary"},
+    {"name": "Investor Salary"},
+    {"name": "One off Revenue Adjustments"},
+    {"name": "One off Expenses Adjustments"},
+    {"name": "Other Adjustments 1"},
+    {"name": "Other Adjustments 2"},
+    {"name": "Total add backs", "derived_from": [
+        "Plus Depreciation & Amortization", "Plus Interest", "Plus Taxes",
+        "Plus Owner Salary+Super etc", "Plus Owner Benefits",
+    ]},
+    {"name": "Total SDE Adjustments", "derived_from": ["Manager Salary", "Investor Salary"]},
+    {"name": "Total Adjustments", "derived_from": [
+        "One off Revenue Adjustments", "One off Expenses Adjustments", "Other Adjustments 1", "Other Adjustments 2",
+    ]},
+]
+
+FIELD_NAMES = [f["name"] for f in FIELDS]
+# Totals computed locally from their components instead of asked of the model
+DERIVED_FIELDS = {f["name"]: f["derived_from"] for f in FIELDS if "derived_from" in f}
+# Lines checked for year-over-year outliers; one-offs and salaries legitimately swing
+RECURRING_FIELDS = [f["name"] for f in FIELDS if f.get("recurring")]
+# What the model is asked for
+EXTRACTED_FIELDS = [name for name in FIELD_NAMES if name not in DERIVED_FIELDS]
+# Field -> template row label
+TEMPLATE_LABELS = {f["name"]: f.get("label", f["name"]) for f in FIELDS}
+
+# Plausible fiscal years for detect_years
+MIN_YEAR = 1990
+MAX_YEAR = 2100
+
+def detect_years(pages):
+    """
+    Years used as column headers in the pages: those on lines naming two or
+    more years. Only text pages can be read locally, so if any page is an
+    image (which may hold other years) or no header is found, returns None
+    and the prompt asks for every year shown. Otherwise a sorted list.
+    """
+    years = set()
+    for page in pages:
+        if not isinstance(page, str):
+            return None
+        for line in page.splitlines():
+            found = {int(y) for y in YEAR_RE.findall(line) if MIN_YEAR <= int(y) <= MAX_YEAR}
+            if len(found) >= 2:
+                years |= found
+    return sorted(years) or None
+
+def build_prompt(years=None, fields=None):
+    """
+    The extraction instructions: the field list once, and the years wanted
+    (every year shown when years is None).
+    """
+    fields = fields or EXTRACTED_FIELDS
+    which = "each of the years " + ", ".join(map(str, years)) if years else "each year shown"
+    return (f"Read the financial data below and return one record for {which}.\n"
+            f'Each record has "year" (integer) and these numeric fields, using the names exactly: '
+            + json.dumps(fields) + ".\n"
+            "Copy the numbers as written; use 0 for a missing number. "
+            'Return only JSON: {"records": [...]}, no extra text.')
+
+def response_format(fields=None):
+    """
+    Structured-output request matching build_prompt: an object whose "records"
+    array holds one strict record per year.
+    """
+    fields = fields or EXTRACTED_FIELDS
+    record = {
+        "type": "object",
+        "properties": {"year": {"type": "integer"}, **{name: {"type": "number"} for name in fields}},
+        "required": ["year"] + list(fields),
+        "additionalProperties": False,
+    }
+    return {"type": "json_schema", "json_schema": {"name": "year_records", "strict": True, "schema": {
+        "type": "object",
+        "properties": {"records": {"type": "array", "items": record}},
+        "required": ["records"],
+        "additionalProperties": False,
+    }}}
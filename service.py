@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlencode
+
+import tracing
+
+log = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Set to the service URL (e.g. http://127.0.0.1:8765) to make the GUI and CLIs submit to it
+SERVICE_ENV_VAR = "GONOGO_SERVICE"
+# Bearer token the GUI and CLIs send, for a service started with --tokens
+TOKEN_ENV_VAR = "GONOGO_TOKEN"
+JOB_FIELDS = ("tenant", "api_key", "files", "prompt", "template", "output", "spec", "engine", "deal", "refresh")
+# Finished jobs kept for status queries
+MAX_FINISHED = 1000
+POLL_INTERVAL = 0.5
+
+class Job:
+    def __init__(self, request):
+        self.id = uuid.uuid4().hex[:12]
+        self.tenant = str(request.get("tenant") or "default")
+        self.request = request
+        self.status = "queued"
+        self.progress = []
+        self.records = None
+        self.output = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def report(self, message):
+        self.progress.append(message)
+
+    def to_dict(self, records=False):
+        out = {"id": self.id, "tenant": self.tenant, "status": self.status, "progress": list(self.progress),
+               "output": self.output, "error": self.error, "submitted": self.submitted,
+               "started": self.started, "finished": self.finished}
+        if records:
+            out["records"] = self.records
+        return out
+
+class Scheduler:
+    """
+    Runs jobs on a shared worker pool, oldest first, while keeping each tenant
+    to at most tenant_limit jobs running at once so one analyst's batch cannot
+    starve everyone else. Extractors (with their warm rate-limited clients)
+    and the extraction cache live as long as the service. Every file a job
+    reads or writes must lie under root (default: the current directory).
+    """
+    def __init__(self, workers=4, tenant_limit=2, cache=None, extractor_options=None, store_path=None, root=None):
+        self.tenant_limit = tenant_limit
+        self.root = os.path.realpath(root or os.getcwd())
+        self.store_path = store_path
+        self.cache = cache
+        self.extractor_options = dict(extractor_options or {})
+        self.jobs = {}
+        self._queue = deque()
+        self._running = {}
+        self._finished = deque()
+        self._extractors = {}
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._slots = workers
+        threading.Thread(target=self._dispatch, name='dispatch', daemon=True).start()
+
+    def submit(self, request):
+        from extract import ENGINES
+        if not isinstance(request, dict):
+            raise ValueError("A job must be a JSON object.")
+        files = request.get("files")
+        if not files or not isinstance(files, list) or not all(isinstance(f, str) for f in files):
+            raise ValueError("A job needs a list of one or more file paths.")
+        engine = request.get("engine") or "model"
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of {ENGINES}, not {engine!r}.")
+        # The service never lends its own OPENAI_API_KEY to a job
+        if engine != "offline" and not request.get("api_key"):
+            raise ValueError(f"A job with engine {engine!r} needs an api_key.")
+        job = Job({k: request[k] for k in JOB_FIELDS if k in request})
+        job.request["files"] = [self.confine(f) for f in files]
+        for key in ("template", "output") + (("spec",) if isinstance(request.get("spec"), str) else ()):
+            if request.get(key) is not None:
+                job.request[key] = self.confine(request[key])
+        missing = [f for f in job.request["files"] if not os.path.exists(f)]
+        if missing:
+            raise ValueError(f"Files not found on the service host: {missing}")
+        if job.request.get("spec") is not None:
+            job.request["spec"] = self.load_spec(job.request["spec"])
+        with self._cond:
+            self.jobs[job.id] = job
+            self._queue.append(job)
+            self._cond.notify_all()
+        tracing.count("service.submitted", tenant=job.tenant)
+        return job
+
+    def confine(self, path):
+        """
+        The real path of a job's file, which must lie under the service root.
+        """
+        if not isinstance(path, str):
+            raise ValueError(f"Expected a file path, got {path!r}.")
+        real = os.path.realpath(os.path.join(self.root, path))
+        if os.path.commonpath([real, self.root]) != self.root:
+            raise ValueError(f"{path} is outside the service root {self.root}.")
+        return real
+
+    @staticmethod
+    def load_spec(spec):
+        """
+        A template spec given as a path (as GPT.py --spec takes) or inline,
+        validated up front so a bad spec is rejected at submission.
+        """
+        from templatespec import load_spec, validate_spec
+        try:
+            if isinstance(spec, str):
+                return load_spec(spec)
+            validate_spec(spec)
+        except OSError as e:
+            raise ValueError(f"Cannot read spec {spec}: {e}")
+        except (TypeError, AttributeError, KeyError) as e:
+            raise ValueError(f"Invalid spec: {e}")
+        return spec
+
+    def list_jobs(self, tenant=None):
+        with self._cond:
+            return [job.to_dict() for job in self.jobs.values() if tenant in (None, job.tenant)]
+
+    def _next(self):
+        for job in self._queue:
+            if self._running.get(job.tenant, 0) < self.tenant_limit:
+                self._queue.remove(job)
+                return job
+        return None
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                job = None
+                while job is None:
+                    if self._slots:
+                        job = self._next()
+                    if job is None:
+                        self._cond.wait()
+                self._slots -= 1
+                self._running[job.tenant] = self._running.get(job.tenant, 0) + 1
+            self._pool.submit(self._run, job)
+
+    def extractor(self, api_key, engine):
+        from extract import Extractor
+        key = (api_key, engine)
+        with self._cond:
+            if key not in self._extractors:
+                self._extractors[key] = Extractor(api_key, cache=self.cache, engine=engine, **self.extractor_options)
+            return self._extractors[key]
+
+    def _run(self, job):
+        request = job.request
+        job.status = "running"
+        job.started = time.time()
+        try:
+            with tracing.span("service.job", tenant=job.tenant, files=len(request["files"])):
+                extractor = self.extractor(request.get("api_key"), request.get("engine") or "model")
+                job.records = extractor.extract(request["files"], request.get("prompt") or '', progress=job.report,
+                                                refresh=bool(request.get("refresh")))
+                if self.store_path:
+                    import store
+                    deal = request.get("deal") or store.deal_name(request["files"])
+                    store.record_extraction(deal, job.records, request["files"][0], self.store_path)
+                if request.get("template"):
+                    from compiler import map_to_excel
+                    job.report("Filling template...")
+                    map_to_excel(job.records, request["template"], request.get("output"), spec=request.get("spec"))
+                    job.output = request.get("output") or request["template"]
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+            log.error(f"[{job.id}] failed: {job.error}")
+        finally:
+            job.finished = time.time()
+            with self._cond:
+                self._slots += 1
+                self._running[job.tenant] -= 1
+                self._finished.append(job.id)
+                while len(self._finished) > MAX_FINISHED:
+                    self.jobs.pop(self._finished.popleft(), None)
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            statuses = [job.status for job in self.jobs.values()]
+            out = {"queued": len(self._queue), "running": dict(self._running),
+                   "done": statuses.count("done"), "failed": statuses.count("failed")}
+        if self.cache is not None:
+            out["cache"] = self.cache.stats()
+        return out
+
+def make_handler(scheduler, tokens=None):
+    """
+    HTTP handler for the scheduler. With tokens ({token: tenant}) every job
+    request must carry "Authorization: Bearer <token>" and runs as, and can
+    only see, that token's tenant. Without tokens the tenant is whatever the
+    request names, so only run it that way where every client is trusted.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            log.debug(fmt % args)
+
+        def _tenant(self, named):
+            if tokens is None:
+                return str(named or "default")
+            scheme, _, token = self.headers.get('Authorization', '').partition(' ')
+            return tokens.get(token) if scheme == 'Bearer' else None
+
+        def _send(self, status, payload):
+            body = json.dumps(payload, default=str).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path, _, query = self.path.partition('?')
+            parts = [p for p in path.split('/') if p]
+            if parts == ['health']:
+                return self._send(200, scheduler.stats())
+            named = parse_qs(query).get('tenant', [None])[0]
+            if parts == ['jobs']:
+                if tokens is None:
+                    return self._send(200, scheduler.list_jobs(named))
+                tenant = self._tenant(named)
+                if tenant is None:
+                    return self._send(401, {"error": "missing or unknown token"})
+                return self._send(200, scheduler.list_jobs(tenant))
+            if len(parts) == 2 and parts[0] == 'jobs':
+                tenant = self._tenant(named)
+                if tenant is None:
+                    return self._send(401, {"error": "missing or unknown token"})
+                job = scheduler.jobs.get(parts[1])
+                # Another tenant's job looks the same as no job at all
+                if job is None or job.tenant != tenant:
+                    return self._send(404, {"error": "unknown job"})
+                return self._send(200, job.to_dict(records=True))
+            self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path.rstrip('/') != '/jobs':
+                return self._send(404, {"error": "not found"})
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if not isinstance(request, dict):
+                    raise ValueError("A job must be a JSON object.")
+                tenant = self._tenant(request.get("tenant"))
+                if tenant is None:
+                    return self._send(401, {"error": "missing or unknown token"})
+                job = scheduler.submit({**request, "tenant": tenant})
+            except ValueError as e:
+                return self._send(400, {"error": str(e)})
+            self._send(202, job.to_dict())
+
+    return Handler
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=4, tenant_limit=2, cache=None, extractor_options=None,
+          store_path=None, root=None, tokens=None):
+    scheduler = Scheduler(workers, tenant_limit, cache, extractor_options, store_path, root)
+    server = ThreadingHTTPServer((host, port), make_handler(scheduler, tokens))
+    log.info(f"Serving on http://{host}:{server.server_address[1]} ({workers} worker(s), {tenant_limit} per tenant, "
+             f"files under {scheduler.root})")
+    if tokens is None:
+        log.warning("No --tokens given: tenants are not authenticated")
+    return server, scheduler
+
+# Client side, used by the GUI and CLIs
+
+def service_url():
+    return os.environ.get(SERVICE_ENV_VAR)
+
+def _call(url, method='GET', payload=None):
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    headers = {'Content-Type': 'application/json'}
+    if os.environ.get(TOKEN_ENV_VAR):
+        headers['Authorization'] = f"Bearer {os.environ[TOKEN_ENV_VAR]}"
+    req = Request(url, data=data, method=method, headers=headers)
+    try:
+        with urlopen(req) as resp:
+            return json.load(resp)
+    except HTTPError as e:
+        raise RuntimeError(json.load(e).get("error", str(e)))
+
+def submit_job(url, **job):
+    """
+    Submits a job; file paths are made absolute since the service resolves
+    them on its own host. Returns the job status dict (with its id).
+    """
+    job["files"] = [os.path.abspath(f) for f in job.get("files", [])]
+    for key in ("template", "output", "spec"):
+        if isinstance(job.get(key), str):
+            job[key] = os.path.abspath(job[key])
+    return _call(url.rstrip('/') + '/jobs', 'POST', job)
+
+def job_status(url, job_id, tenant=None):
+    query = f"?{urlencode({'tenant': tenant})}" if tenant else ''
+    return _call(f"{url.rstrip('/')}/jobs/{job_id}{query}")
+
+def wait_for_job(url, job_id, progress=None, interval=POLL_INTERVAL, tenant=None):
+    """
+    Polls until the job finishes, passing new progress messages to progress.
+    tenant is the one the job was submitted as (not needed with a token).
+    Returns the final status; raises RuntimeError if the job failed.
+    """
+    seen = 0
+    while True:
+        status = job_status(url, job_id, tenant)
+        if progress is not None:
+            for message in status["progress"][seen:]:
+                progress(message)
+            seen = len(status["progress"])
+        if status["status"] == "done":
+            return status
+        if status["status"] == "failed":
+            raise RuntimeError(status["error"])
+        time.sleep(interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-running extraction/fill service shared by the GUI and CLIs")
+    parser.add_argument('--host', default=DEFAULT_HOST, help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to listen on')
+    parser.add_argument('--workers', type=int, default=4, help='Jobs run concurrently')
+    parser.add_argument('--tenant-limit', type=int, default=2, help='Jobs run concurrently per tenant')
+    parser.add_argument('--root', default=os.getcwd(), help='Directory every job file must lie under (default: current directory)')
+    parser.add_argument('--tokens', help='JSON file of {token: tenant}; clients then authenticate with $GONOGO_TOKEN')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the extraction cache')
+    parser.add_argument('--no-store', action='store_true', help='Do not add finished jobs to the historical store')
+    parser.add_argument('--chunk-size', type=int, default=0, help='Pages per request; 0 sends all pages in one request')
+    parser.add_argument('--max-pages', type=int, default=None, help='Send only the N most relevant pages')
+    parser.add_argument('--trace', help='Write a trace (.jsonl events, or .json Chrome trace)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show debug output')
+    args = parser.parse_args()
+    tracing.setup(args.trace, args.verbose)
+
+    from cache import ExtractionCache
+    from store import DEFAULT_STORE_PATH
+    tokens = None
+    if args.tokens:
+        with open(args.tokens) as f:
+            tokens = json.load(f)
+    cache = None if args.no_cache else ExtractionCache()
+    server, _ = serve(args.host, args.port, args.workers, args.tenant_limit, cache,
+                      {"chunk_size": args.chunk_size, "max_pages": args.max_pages},
+                      None if args.no_store else DEFAULT_STORE_PATH, args.root, tokens)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import logging
+import hashlib
+import argparse
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from compiler import category_mapping, file_digest
+import tracing
+
+log = logging.getLogger(__name__)
+
+DEFAULT_STORE_PATH = os.path.join(os.path.expanduser("~"), ".gonogo", "store")
+INITIAL_CAPACITY = 1024
+# Named metrics as weights over the schema fields, signs as the template uses them
+METRICS = {
+    "revenue": {"Revenue": 1},
+    "add_backs": {"Total add backs": 1},
+    "net_profit": {"Revenue": 1, "Cost of Goods Sold (COGS)": -1, "Less Operating Expenses": -1,
+                   "Other Income": 1, "Taxes": -1},
+    "sde": {"Revenue": 1, "Cost of Goods Sold (COGS)": -1, "Less Operating Expenses": -1, "Other Income": 1,
+            "Taxes": -1, "Total add backs": 1, "Total SDE Adjustments": -1, "Total Adjustments": 1},
+}
+AGGREGATES = ('median', 'mean', 'sum', 'min', 'max', 'count')
+
+@contextmanager
+def file_lock(path):
+    """
+    Exclusive OS lock on path (created if missing), held for the with block;
+    serializes writers across processes.
+    """
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ~10s; keep waiting
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+class Store:
+    """
+    Append-only columnar store of extracted year records, one row per deal-year.
+    Columns are raw memory-mapped arrays under path: values.f8 (rows x fields,
+    NaN where a record has no value), year.i4, deal.i4 and live.u1; index.json
+    holds the field list, the deal names and the row count. Re-adding a deal
+    retires its earlier rows, so queries see each deal's latest extraction.
+    The index is replaced only after the columns are flushed, so a reader
+    never sees half a write. Writers in any number of processes take an OS
+    lock on store.lock and reload the index under it before appending.
+    """
+    def __init__(self, path=DEFAULT_STORE_PATH, fields=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(path, 'index.json')
+        self._index_mtime = None
+        self.index = {"fields": list(fields or category_mapping), "deals": [], "rows": 0, "capacity": 0}
+        self._columns = {}
+        os.makedirs(path, exist_ok=True)
+        with file_lock(os.path.join(path, 'store.lock')):
+            self.refresh()
+
+    def refresh(self):
+        """
+        Picks up rows other processes appended since the index was last read.
+        """
+        try:
+            mtime = os.stat(self._index_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime is not None and mtime != self._index_mtime:
+            with open(self._index_path) as f:
+                self.index = json.load(f)
+        self._index_mtime = mtime
+        self.fields = self.index["fields"]
+        capacity = max(self.index["capacity"], INITIAL_CAPACITY)
+        if not self._columns or len(self._columns["year"]) != capacity:
+            self._open(capacity)
+
+    def _open(self, capacity):
+        shapes = {"values": ('f8', (capacity, len(self.fields))), "year": ('i4', (capacity,)),
+                  "deal": ('i4', (capacity,)), "live": ('u1', (capacity,))}
+        for name, (dtype, shape) in shapes.items():
+            file = os.path.join(self.path, f"{name}.{dtype}")
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            if not os.path.exists(file) or os.path.getsize(file) < size:
+                old = self.index["capacity"]
+                with open(file, 'ab') as f:
+                    f.truncate(size)
+                if name == "values" and old < capacity:
+                    # New rows start out empty rather than 0
+                    column = np.memmap(file, dtype=dtype, mode='r+', shape=shape)
+                    column[old:] = np.nan
+                    column.flush()
+            self._columns[name] = np.memmap(file, dtype=dtype, mode='r+', shape=shape)
+        self.index["capacity"] = capacity
+
+    def _save_index(self):
+        for column in self._columns.values():
+            column.flush()
+        tmp = os.path.join(self.path, f'index.json.{os.getpid()}.tmp')
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(self.index))
+        os.replace(tmp, self._index_path)
+        self._index_mtime = os.stat(self._index_path).st_mtime_ns
+
+    def append(self, deal, records, source=None):
+        """
+        Stores a deal's year records, replacing any earlier extraction of it.
+        Returns the number of rows written.
+        """
+        return self.extend([(deal, records, source)])
+
+    def extend(self, extractions):
+        """
+        Stores several (deal, records, source) extractions with a single index
+        write, for bulk loads. Returns the number of rows written.
+        """
+        written = 0
+        with self._lock, file_lock(os.path.join(self.path, 'store.lock')), \
+                tracing.span("store.append", deals=len(extractions)) as sp:
+            self.refresh()
+            ids = {d["name"]: i for i, d in enumerate(self.index["deals"])}
+            for deal, records, source in extractions:
+                written += self._append(ids, deal, [r for r in records if r.get("year") is not None], source)
+            self._save_index()
+            sp.set(rows=written)
+        return written
+
+    def _append(self, ids, deal, records, source):
+        start = self.index["rows"]
+        if deal in ids:
+            deal_id = ids[deal]
+            self._columns["live"][:start][self._columns["deal"][:start] == deal_id] = 0
+            self.index["deals"][deal_id].update(source=source, added=time.time())
+        else:
+            deal_id = ids[deal] = len(self.index["deals"])
+            self.index["deals"].append({"name": deal, "source": source, "added": time.time()})
+        if start + len(records) > self.index["capacity"]:
+            self._open(max(self.index["capacity"] * 2, start + len(records)))
+        values = self._columns["values"]
+        for i, record in enumerate(records):
+            row = start + i
+            values[row] = np.nan
+            for j, field in enumerate(self.fields):
+                value = record.get(field)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    values[row, j] = value
+            self._columns["year"][row] = int(float(record["year"]))
+        self._columns["deal"][start:start + len(records)] = deal_id
+        self._columns["live"][start:start + len(records)] = 1
+        self.index["rows"] = start + len(records)
+        return len(records)
+
+    def _live(self):
+        self.refresh()
+        rows = self.index["rows"]
+        return np.flatnonzero(self._columns["live"][:rows])
+
+    def metric(self, name, rows=None):
+        """
+        Values of a field, a METRICS name or a ratio "a/b" of two of those,
+        for the given rows (default: every live row). Missing fields count as 0
+        inside a named metric; a missing field on its own is NaN.
+        """
+        rows = self._live() if rows is None else rows
+        if '/' in name:
+            top, bottom = name.split('/', 1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                ratio = self.metric(top.strip(), rows) / self.metric(bottom.strip(), rows)
+            ratio[~np.isfinite(ratio)] = np.nan
+            return ratio
+        values = self._columns["values"]
+        if name in self.fields:
+            return np.asarray(values[rows, self.fields.index(name)])
+        if name not in METRICS:
+            raise KeyError(f"Unknown metric {name!r}; use a field name, one of {sorted(METRICS)} or a ratio a/b")
+        weights = np.array([METRICS[name].get(field, 0) for field in self.fields], dtype=float)
+        return np.nan_to_num(np.asarray(values[rows])) @ weights
+
+    def aggregate(self, metric, by='year', how='median'):
+        """
+        Aggregates a metric over live rows grouped by 'year' or 'deal'.
+        Returns {group: value}; NaN values are left out.
+        """
+        if how not in AGGREGATES:
+            raise ValueError(f"how must be one of {AGGREGATES}, not {how!r}")
+        with tracing.span("store.aggregate", metric=metric, by=by, how=how) as sp:
+            rows = self._live()
+            values = self.metric(metric, rows)
+            keys = np.asarray(self._columns[by][rows])
+            keep = ~np.isnan(values)
+            values, keys = values[keep], keys[keep]
+            sp.set(rows=len(values))
+            if not len(values):
+                return {}
+            order = np.lexsort((values, keys))
+            values, keys = values[order], keys[order]
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            counts = np.diff(np.r_[starts, len(values)])
+            if how == 'median':
+                result = (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+            elif how == 'count':
+                result = counts
+            else:
+                reduce = {'mean': np.add, 'sum': np.add, 'min': np.minimum, 'max': np.maximum}[how]
+                result = reduce.reduceat(values, starts)
+                if how == 'mean':
+                    result = result / counts
+        groups = keys[starts]
+        if by == 'deal':
+            groups = [self.index["deals"][g]["name"] for g in groups]
+        return {(int(g) if by == 'year' else g): float(v) for g, v in zip(groups, result)}
+
+    def where(self, metric, gt=None, lt=None, year=None):
+        """
+        Live deal-years whose metric is above gt and/or below lt, optionally
+        for one year. Returns [(deal, year, value)] sorted by value, largest first.
+        """
+        with tracing.span("store.where", metric=metric):
+            rows = self._live()
+            if year is not None:
+                rows = rows[self._columns["year"][rows] == year]
+            values = self.metric(metric, rows)
+            keep = ~np.isnan(values)
+            if gt is not None:
+                keep &= values > gt
+            if lt is not None:
+                keep &= values < lt
+            rows, values = rows[keep], values[keep]
+            order = np.argsort(-values)
+        deals = self.index["deals"]
+        return [(deals[self._columns["deal"][rows[i]]]["name"], int(self._columns["year"][rows[i]]), float(values[i]))
+                for i in order]
+
+    def summary(self):
+        rows = self._live()
+        years = np.asarray(self._columns["year"][rows])
+        return {"deals": len(set(self._columns["deal"][rows].tolist())), "deal_years": len(rows),
+                "years": sorted(set(years.tolist())), "path": self.path}
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_store(path=DEFAULT_STORE_PATH):
+    # One Store per path and process, shared by the threads that append to it
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = Store(path)
+        return _stores[path]
+
+def deal_name(files):
+    """
+    Store key for an upload that has no deal name: the first file's name plus
+    a digest of every file's content. Unrelated uploads that share a file
+    name ("Financials.pdf") stay apart; extracting the same files again
+    replaces the earlier rows.
+    """
+    h = hashlib.sha256()
+    for path in sorted(files):
+        h.update(file_digest(path).encode())
+    stem = os.path.splitext(os.path.basename(files[0]))[0] if files else 'deal'
+    return f"{stem}-{h.hexdigest()[:10]}"
+
+def record_extraction(deal, records, source=None, path=DEFAULT_STORE_PATH):
+    """
+    Appends a completed extraction to the store. A store that cannot be
+    written is logged and skipped; it never fails the extraction itself.
+    """
+    try:
+        get_store(path).append(deal, records, source)
+    except Exception as e:
+        log.warning(f"Could not add {deal} to the store at {path}: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the store of extracted deal financials")
+    parser.add_argument('--store', default=DEFAULT_STORE_PATH, help='Store directory')
+    parser.add_argument('--trace', help='Write a trace (.jsonl events, or .json Chrome trace)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show debug output')
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add', help='Add extracted records (JSON files) as deals')
+    add.add_argument('data', nargs='+', help='JSON files of year records, as written by extract.py')
+    add.add_argument('--deal', help='Deal name for a single file (default: file name plus content digest)')
+    agg = sub.add_parser('aggregate', help='Aggregate a metric by year or deal, e.g. sde/revenue')
+    agg.add_argument('metric', help=f'Field name, one of {sorted(METRICS)}, or a ratio a/b')
+    agg.add_argument('--by', default='year', choices=('year', 'deal'))
+    agg.add_argument('--how', default='median', choices=AGGREGATES)
+    where = sub.add_parser('where', help='List deal-years whose metric is above/below a threshold')
+    where.add_argument('metric', help=f'Field name, one of {sorted(METRICS)}, or a ratio a/b')
+    where.add_argument('--gt', type=float, help='Keep values above this')
+    where.add_argument('--lt', type=float, help='Keep values below this')
+    where.add_argument('--year', type=int, help='Only this year')
+    sub.add_parser('summary', help='Show what the store holds')
+    args = parser.parse_args()
+    tracing.setup(args.trace, args.verbose)
+
+    store = Store(args.store)
+    try:
+        if args.command == 'add':
+            if args.deal and len(args.data) > 1:
+                parser.error('--deal names a single file')
+            extractions = []
+            for path in args.data:
+                with open(path) as f:
+                    extractions.append((args.deal or deal_name([path]), json.load(f), os.path.abspath(path)))
+            print(f"Added {store.extend(extractions)} year(s) of {len(extractions)} deal(s)")
+        elif args.command == 'aggregate':
+            for group, value in store.aggregate(args.metric, args.by, args.how).items():
+                print(f"{group}\t{value:,.4g}")
+        elif args.command == 'where':
+            for deal, year, value in store.where(args.metric, args.gt, args.lt, args.year):
+                print(f"{deal}\t{year}\t{value:,.4g}")
+        else:
+            print(json.dumps(store.summary(), indent=2))
+    except (KeyError, ValueError) as e:
+        print(str(e))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
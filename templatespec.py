@@ -0,0 +1,201 @@
+import json
+import hashlib
+import logging
+from collections import namedtuple
+
+from compiler import category_mapping, is_macro_workbook, load_workbook, normalize_records, template_cached
+from mapper import normalize_label
+import tracing
+
+log = logging.getLogger(__name__)
+
+ORIENTATIONS = ('across', 'down')
+
+# {entity: {(year, field): ((sheet, row, col), ...)}}, plus the sheets it touches
+WritePlan = namedtuple('WritePlan', ['entities', 'sheets'])
+
+def load_spec(path):
+    """
+    Reads a template spec (JSON). Each entry of "sheets" describes one sheet:
+      sheet        sheet title (null for the active sheet)
+      entity       whose records go on this sheet (omit for single-entity runs)
+      orientation  "across" (years along a row, labels down a column) or "down"
+      anchor       text of the header cell where the year row and label column meet
+      year_row / label_col (across) or year_col / label_row (down)
+                   explicit positions; columns may be letters; these override the anchor
+      fields       record fields written to this sheet (default: every mapped field)
+      aliases      {field: [other labels used for it on this sheet]}
+    """
+    with open(path) as f:
+        spec = json.load(f)
+    validate_spec(spec)
+    return spec
+
+def validate_spec(spec):
+    sheets = spec.get("sheets") if isinstance(spec, dict) else None
+    if not sheets:
+        raise ValueError("Template spec needs a non-empty \"sheets\" list.")
+    for i, sheet in enumerate(sheets):
+        orientation = sheet.get("orientation", "across")
+        if orientation not in ORIENTATIONS:
+            raise ValueError(f"Sheet {i}: orientation must be one of {ORIENTATIONS}, not {orientation!r}.")
+        positions = ("year_row", "label_col") if orientation == "across" else ("year_col", "label_row")
+        if not sheet.get("anchor") and not all(sheet.get(p) for p in positions):
+            raise ValueError(f"Sheet {i}: give an anchor or both {positions[0]} and {positions[1]}.")
+        unknown = [f for f in sheet.get("fields", []) + list(sheet.get("aliases", {})) if f not in category_mapping]
+        if unknown:
+            raise ValueError(f"Sheet {i}: unknown field(s) {unknown}.")
+
+def _index(value):
+    if isinstance(value, str):
+        from openpyxl.utils import column_index_from_string
+        return column_index_from_string(value.strip().upper())
+    return int(value)
+
+def _year_keys(val):
+    keys = [str(val).strip()]
+    try:
+        keys.append(str(int(float(val))))
+    except (TypeError, ValueError):
+        pass
+    return keys
+
+def _sheet_plan(ws, sheet):
+    """
+    Scans one sheet once and returns {(year, field): (row, col)} for it.
+    """
+    across = sheet.get("orientation", "across") == "across"
+    anchor = normalize_label(sheet["anchor"]) if sheet.get("anchor") else None
+    values = {}
+    formulas = set()
+    anchor_cell = None
+    for row_idx, row in enumerate(ws.iter_rows(values_only=True), start=1):
+        for col_idx, val in enumerate(row, start=1):
+            if val is None:
+                continue
+            if isinstance(val, str) and val.startswith('='):
+                formulas.add((row_idx, col_idx))
+            elif anchor_cell is None and anchor and isinstance(val, str) and normalize_label(val) == anchor:
+                anchor_cell = (row_idx, col_idx)
+            values[(row_idx, col_idx)] = val
+    positions = ("year_row", "label_col") if across else ("year_col", "label_row")
+    if anchor_cell is None and not all(sheet.get(p) for p in positions):
+        raise ValueError(f"Anchor {sheet['anchor']!r} not found on sheet {ws.title!r}.")
+    if across:
+        year_line = _index(sheet["year_row"]) if sheet.get("year_row") else anchor_cell[0]
+        label_line = _index(sheet["label_col"]) if sheet.get("label_col") else anchor_cell[1]
+    else:
+        year_line = _index(sheet["year_col"]) if sheet.get("year_col") else anchor_cell[1]
+        label_line = _index(sheet["label_row"]) if sheet.get("label_row") else anchor_cell[0]
+
+    fields = sheet.get("fields") or list(category_mapping)
+    labels = {}
+    for field in fields:
+        for label in [field, category_mapping[field]] + sheet.get("aliases", {}).get(field, []):
+            labels.setdefault(normalize_label(label), field)
+
+    years = {}
+    rows = {}
+    for (row_idx, col_idx), val in values.items():
+        # For "down" sheets swap axes so the same matching serves both orientations
+        line, pos = (row_idx, col_idx) if across else (col_idx, row_idx)
+        other_line, other_pos = (col_idx, row_idx) if across else (row_idx, col_idx)
+        if line == year_line and pos != label_line:
+            for key in _year_keys(val):
+                years.setdefault(key, pos)
+        if other_line == label_line and isinstance(val, str):
+            field = labels.get(normalize_label(val))
+            if field and field not in rows:
+                rows[field] = other_pos
+
+    plan = {}
+    for field, line_pos in rows.items():
+        for yr, pos in years.items():
+            cell = (line_pos, pos) if across else (pos, line_pos)
+            if cell in formulas:
+                continue
+            plan[(yr, field)] = cell
+    missing = [f for f in fields if f not in rows]
+    if missing:
+        log.debug(f"Sheet {ws.title!r}: no row for {missing}")
+    return plan
+
+def compile_plan(wb, spec):
+    """
+    Compiles spec against the workbook into a flat WritePlan. Every sheet is
+    scanned exactly once; applying the plan is then plain dictionary lookups.
+    """
+    entities = {}
+    sheets = []
+    for sheet in spec["sheets"]:
+        ws = wb[sheet["sheet"]] if sheet.get("sheet") else wb.active
+        sheets.append(ws.title)
+        target = entities.setdefault(sheet.get("entity"), {})
+        for key, (row, col) in _sheet_plan(ws, sheet).items():
+            target[key] = target.get(key, ()) + ((ws.title, row, col),)
+    return WritePlan(entities, tuple(dict.fromkeys(sheets)))
+
+def template_plan(excel_path, wb, spec):
+    """
+    Returns the compiled plan for this template and spec, cached per template
+    version like compiler.template_layout.
+    """
+    key = ("plan", hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest())
+    return template_cached(excel_path, key, lambda: compile_plan(wb, spec))
+
+def entity_records(json_data):
+    """
+    Normalizes input to {entity: records}. A plain record list (or single
+    record) belongs to the unnamed entity None; a dict of lists names entities.
+    """
+    if isinstance(json_data, dict) and "year" not in json_data:
+        return {name: normalize_records(records) for name, records in json_data.items()}
+    return {None: normalize_records(json_data)}
+
+def apply_plan(wb, plan, entities):
+    """
+    Writes every entity's records in one pass. Follows fill_worksheet's rules:
+    None is skipped and 0 never overwrites a value already in the template.
+    Returns {(sheet, row, col): previous value} for the cells written.
+    """
+    previous = {}
+    for entity, cells in plan.entities.items():
+        records = entities.get(entity)
+        if records is None and entity is None and len(entities) == 1:
+            # Sheets without an entity take the only entity given
+            records = next(iter(entities.values()))
+        if records is None:
+            log.warning(f"No records for entity {entity!r}; its sheets are left as they are.")
+            continue
+        for entry in records:
+            yr = str(entry.get("year")).strip()
+            for field, value in entry.items():
+                if field == "year" or value is None:
+                    continue
+                for sheet, row, col in cells.get((yr, field), ()):
+                    cell = wb[sheet].cell(row=row, column=col)
+                    if value == 0 and cell.value not in (None, ""):
+                        continue
+                    previous.setdefault((sheet, row, col), cell.value)
+                    cell.value = value
+    return previous
+
+def fill_workbook(json_data, excel_path, spec, output_path=None):
+    """
+    Fills a multi-sheet template described by spec with one load and one save.
+    json_data is a record list or {entity: records}.
+    """
+    entities = entity_records(json_data)
+    save_path = output_path if output_path else excel_path
+    with tracing.span("excel.load", path=excel_path):
+        wb = load_workbook(excel_path, keep_vba=is_macro_workbook(save_path))
+    with tracing.span("excel.index", path=excel_path) as sp:
+        plan = template_plan(excel_path, wb, spec)
+        sp.set(sheets=len(plan.sheets))
+    with tracing.span("excel.write") as sp:
+        written = apply_plan(wb, plan, entities)
+        sp.set(cells=len(written))
+    with tracing.span("excel.save", path=save_path):
+        wb.save(save_path)
+    log.info(f"Saved {len(written)} cell(s) on {len(plan.sheets)} sheet(s) to {save_path}")
+    return written
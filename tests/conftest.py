@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import apiclient
+import bench
+
+@pytest.fixture
+def mock_openai(monkeypatch):
+    """
+    Starts a bench.MockOpenAI answering with the given response and points
+    the OpenAI client at it. Clients are not shared between tests, since
+    apiclient keeps one per API key.
+    """
+    servers = []
+    monkeypatch.setattr(apiclient, '_clients', {})
+
+    def start(response, latency=0.0):
+        mock = bench.MockOpenAI(response, latency).__enter__()
+        servers.append(mock)
+        monkeypatch.setenv('OPENAI_BASE_URL', mock.base_url)
+        return mock
+
+    yield start
+    for mock in servers:
+        mock.__exit__(None, None, None)
+
+@pytest.fixture
+def template(tmp_path):
+    """
+    A template shaped like the real one with 2022 and 2023 columns.
+    """
+    return bench.make_template(str(tmp_path / 'template.xlsx'), [2022, 2023])
@@ -0,0 +1,41 @@
+import json
+import os
+
+import openpyxl
+
+import batch
+
+def deal_file(template, path, revenue):
+    wb = openpyxl.load_workbook(template)
+    wb.active["C4"] = revenue
+    wb.save(path)
+    return str(path)
+
+def test_state_keeps_records_out_of_the_state_file(tmp_path, template):
+    state_path = str(tmp_path / 'state.json')
+    jobs = [{"deal": f"Deal/{i}", "files": [deal_file(template, tmp_path / f"in{i}.xlsx", 100 * i)],
+             "template": template, "output": str(tmp_path / 'out' / f"{i}.xlsx")} for i in (1, 2)]
+    report = batch.run_batch(jobs, None, state_path=state_path, engine='offline')
+    assert report["done"] == 2
+
+    with open(state_path) as f:
+        entries = json.load(f)
+    assert all("records" not in entry for entry in entries.values())
+    paths = [entries[job["deal"]]["records_path"] for job in jobs]
+    assert len(set(paths)) == 2 and all(os.path.dirname(p) == str(tmp_path / 'state.records') for p in paths)
+    assert batch.JobState(state_path).load_records("Deal/2")[0]["Revenue"] == 200
+
+def test_extracted_deals_resume_from_their_records_file(tmp_path, template):
+    state_path = str(tmp_path / 'state.json')
+    state = batch.JobState(state_path)
+    state.save_records("Deal", [{"year": 2022, "Revenue": 321}])
+    output = str(tmp_path / 'out.xlsx')
+    # The input does not exist: an extracted deal must not be read again
+    jobs = [{"deal": "Deal", "files": [str(tmp_path / 'gone.pdf')], "template": template, "output": output}]
+    assert batch.run_batch(jobs, None, state_path=state_path, engine='offline')["done"] == 1
+    assert openpyxl.load_workbook(output).active["C4"].value == 321
+
+def test_old_state_files_with_inline_records_still_resume(tmp_path):
+    state_path = tmp_path / 'state.json'
+    state_path.write_text(json.dumps({"Deal": {"status": "extracted", "records": [{"year": 2022}]}}))
+    assert batch.JobState(str(state_path)).load_records("Deal") == [{"year": 2022}]
@@ -0,0 +1,81 @@
+import time
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import extract
+from cache import ExtractionCache, cache_key, page_digest
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ExtractionCache(str(tmp_path / 'cache.sqlite'), max_bytes=30)
+    yield cache
+    cache.close()
+
+def page():
+    buf = BytesIO()
+    Image.new('L', (200, 300), 255).save(buf, format='PNG')
+    return buf.getvalue()
+
+def test_key_depends_on_everything_that_changes_the_answer():
+    pages = [page_digest(b'one'), page_digest('two')]
+    key = cache_key(pages, 'prompt', 'model', 0)
+    assert key == cache_key(list(pages), 'prompt', 'model', 0)
+    assert key != cache_key(pages[::-1], 'prompt', 'model', 0)
+    assert key != cache_key(pages, 'prompt!', 'model', 0)
+    assert key != cache_key(pages, 'prompt', 'model', 0.5)
+    assert page_digest('two') == page_digest(b'two')
+
+def test_least_recently_used_is_evicted(cache):
+    cache.put('a', 'x' * 10)
+    time.sleep(0.01)
+    cache.put('b', 'x' * 10)
+    time.sleep(0.01)
+    assert cache.get('a') == 'x' * 10
+    time.sleep(0.01)
+    cache.put('c', 'x' * 15)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'x' * 10
+    assert cache.get('c') == 'x' * 15
+    assert cache.stats() == {"hits": 3, "misses": 1}
+
+def test_stored_bytes_stay_within_bounds(cache):
+    for i in range(20):
+        cache.put(str(i), 'é' * 4)
+    total = cache._db.execute("SELECT SUM(size) FROM entries").fetchone()[0]
+    assert total <= cache.max_bytes
+    assert cache.get('19') == 'é' * 4
+
+def test_answers_are_reused(cache, mock_openai):
+    cache.max_bytes = 1 << 20
+    mock = mock_openai([{"year": 2023, "Revenue": 1}])
+    first = extract.vision_extract('sk-test', [page()], '', cache=cache)
+    assert extract.vision_extract('sk-test', [page()], '', cache=cache) == first
+    assert mock.requests == 1
+    extract.vision_extract('sk-test', [page()], '', cache=cache, refresh=True)
+    assert mock.requests == 2
+
+@pytest.mark.parametrize("answer", ["I'm sorry, I can't help with that.", '[{"year": 2023, "Revenue": 1},'])
+def test_unusable_answers_are_not_cached(cache, mock_openai, answer):
+    cache.max_bytes = 1 << 20
+    mock = mock_openai(answer)
+    for _ in range(2):
+        extract.vision_extract('sk-test', [page()], '', cache=cache)
+    assert mock.requests == 2
+
+def test_unusable_cached_answer_is_asked_again(cache, mock_openai):
+    cache.max_bytes = 1 << 20
+    mock = mock_openai([{"year": 2023, "Revenue": 1}])
+    extract.vision_extract('sk-test', [page()], '', cache=cache)
+    key, = [row[0] for row in cache._db.execute("SELECT key FROM entries")]
+    cache.put(key, "I'm sorry, I can't help with that.")
+    assert '"Revenue": 1' in extract.vision_extract('sk-test', [page()], '', cache=cache)
+    assert mock.requests == 2
+
+def test_usable_output():
+    assert extract.usable_output('[{"year": 2023, "Revenue": 1}]')
+    assert extract.usable_output('[]')
+    assert not extract.usable_output('[{"year": 2023, "Revenue": 1}, {"year": 20')
+    assert not extract.usable_output('[{"Revenue": 1}]')
+    assert not extract.usable_output("Sorry, I can't read these pages.")
@@ -0,0 +1,41 @@
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont
+
+import extract
+from dedup import PageDeduper, text_hash
+
+def page(figure, fmt='PNG', quality=90):
+    img = Image.new('L', (850, 1100), 255)
+    d = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=24)
+    for i in range(12):
+        d.text((80, 150 + i * 60), f"Expense line {i}", fill=0, font=font)
+        d.text((600, 150 + i * 60), f"{figure + i * 1000:,}", fill=0, font=font)
+    buf = BytesIO()
+    img.save(buf, format=fmt, quality=quality)
+    return buf.getvalue()
+
+def test_text_pages_match_on_content_not_header():
+    assert text_hash("[Text of a.pdf, page 1]\nRevenue  1,200") == text_hash("[Text of b.pdf, page 7]\nrevenue 1,200\n")
+    assert text_hash("[Text of a.pdf, page 1]\nRevenue 1,200") != text_hash("[Text of a.pdf, page 1]\nRevenue 1,300")
+
+def test_repeated_pages_are_dropped_and_traced_to_the_original():
+    deduper = PageDeduper()
+    pages = [page(41234), "[Text of a.pdf, page 2]\nNotes", page(41234, 'JPEG', 75), page(41284),
+             "[Text of b.pdf, page 1]\nNOTES", page(41234)]
+    labels = ["a1", "a2", "b-scan", "changed", "b1", "copy"]
+    kept = list(deduper.filter(pages, labels))
+    # A recompressed copy matches; a page whose figures differ by one digit does not
+    assert kept == [pages[0], pages[1], pages[3]]
+    assert deduper.duplicates == [("b-scan", "a1"), ("b1", "a2"), ("copy", "a1")]
+    assert deduper.sources == [["a1", "b-scan", "copy"], ["a2", "b1"], ["changed"]]
+    assert deduper.bytes_saved == len(pages[2]) + len(pages[4]) + len(pages[5])
+
+def test_extractor_dedups_its_pages():
+    extractor = extract.Extractor(None, engine='offline')
+    specs = [('text', "[Text of a.pdf, page 1]\nRevenue 1,200"), ('text', "[Text of b.pdf, page 3]\nRevenue 1,200")]
+    deduper = PageDeduper()
+    assert list(extractor.iter_pages(specs, deduper)) == [specs[0][1]]
+    assert deduper.duplicates == [("Text of b.pdf, page 3", "Text of a.pdf, page 1")]
+    assert list(extractor.iter_pages(specs)) == [payload for _, payload in specs]
@@ -0,0 +1,63 @@
+import derive
+import extract
+from schema import FIELD_NAMES
+
+ADD_BACKS = {"Plus Depreciation & Amortization": 3, "Plus Interest": 6}
+
+def years(field, values):
+    return [{"year": 2019 + i, field: v} for i, v in enumerate(values)]
+
+def test_totals_are_derived_from_their_parts():
+    records, issues = derive.check_records([{"year": 2023, **ADD_BACKS, "Manager Salary": 5}], FIELD_NAMES)
+    assert (records[0]["Total add backs"], records[0]["Total SDE Adjustments"], records[0]["Total Adjustments"]) == (9, 5, 0)
+    assert issues == []
+
+def test_reported_total_that_disagrees_is_an_issue():
+    _, issues = derive.check_records([{"year": 2023, **ADD_BACKS, "Total add backs": 50},
+                                      {"year": 2024, **ADD_BACKS, "Total add backs": 9.5}], FIELD_NAMES)
+    assert issues == [{"year": 2023, "field": "Total add backs", "kind": "identity",
+                       "detail": "reported 50, parts sum to 9"}]
+    assert derive.describe(issues[0]) == "2023 Total add backs: identity (reported 50, parts sum to 9)"
+
+def test_records_without_a_year_pass_through():
+    records, _ = derive.check_records([{"year": "n/a", "Revenue": 1}, {"year": "2023", **ADD_BACKS}], FIELD_NAMES)
+    assert records[0] == {"year": "n/a", "Revenue": 1}
+    assert records[1]["Total add backs"] == 9
+
+def test_outlier_in_a_recurring_line():
+    _, issues = derive.check_records(years("Revenue", [45000, 47000, 5600, 52000]), FIELD_NAMES)
+    assert [(i["year"], i["field"], i["kind"]) for i in issues] == [(2021, "Revenue", "outlier")]
+
+def test_no_outliers_for_one_offs_or_few_years():
+    assert derive.check_records(years("One off Expenses Adjustments", [0, 2000, 45000, 0]), FIELD_NAMES)[1] == []
+    assert derive.check_records(years("Plus Interest", [0, 2000, 45000, 0]), FIELD_NAMES)[1] == []
+    assert derive.check_records(years("Revenue", [45000, 2000]), FIELD_NAMES)[1] == []
+
+def test_inconsistent_source_totals_are_reported_not_requeried(mock_openai, monkeypatch):
+    monkeypatch.setattr(extract, 'MAX_RECHECKS', 2)
+    mock = mock_openai({"records": [{"year": 2023, "Revenue": 1000}]})
+    issues = []
+    records = extract.extract_records('sk-test', ["[Text of a.pdf, page 1]\nRevenue 2023 1,000"], '',
+                                      records=[{"year": 2023, **ADD_BACKS, "Total add backs": 50}],
+                                      on_issue=issues.append)
+    assert mock.requests == 1
+    assert records[0]["Revenue"] == 1000
+    assert [(i["field"], i["kind"]) for i in issues] == [("Total add backs", "identity")]
+
+def test_model_values_that_fail_a_check_are_requeried(mock_openai):
+    mock = mock_openai({"records": years("Revenue", [45000, 47000, 5600, 52000])})
+    issues = []
+    extract.extract_records('sk-test', ["[Text of a.pdf, page 1]\nRevenue 45,000 47,000 56,000 52,000"], '',
+                            on_issue=issues.append)
+    # The mock gives the same answer again, so the issue is still reported
+    assert mock.requests == 2
+    assert [(i["year"], i["field"]) for i in issues] == [(2021, "Revenue")]
+
+def test_model_issues_only_counts_model_values():
+    records = [{"year": 2023, **ADD_BACKS, "Total add backs": 50}]
+    model = [{"year": "2023", "Plus Interest": 7, "Revenue": 100}]
+    identity = {"year": 2023, "field": "Total add backs", "kind": "identity", "detail": ""}
+    outlier = {"year": 2023, "field": "Revenue", "kind": "outlier", "detail": ""}
+    # Interest came from the records, which take precedence
+    assert extract.model_issues([identity, outlier], records, model) == [outlier]
+    assert extract.model_issues([identity], [{"year": 2023, "Total add backs": 50}], model) == [identity]
@@ -0,0 +1,58 @@
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+import extract
+from extract import merge_year_records
+
+MODEL_RECORDS = [
+    {"year": 2022, "Revenue": 1000, "Plus Depreciation & Amortization": 30, "Plus Interest": 10},
+    {"year": 2023, "Revenue": 1200, "Plus Depreciation & Amortization": 35, "Plus Interest": 12},
+]
+
+def pages(n):
+    images = []
+    for i in range(n):
+        img = Image.new('L', (400, 500), 255)
+        ImageDraw.Draw(img).text((20, 20 + 40 * i), f"Page {i + 1}", fill=0)
+        buf = BytesIO()
+        img.save(buf, format='PNG')
+        images.append(buf.getvalue())
+    return images
+
+def test_merge_first_non_zero_wins():
+    records, conflicts = merge_year_records([
+        [{"year": 2023, "Revenue": 0, "Taxes": None}],
+        [{"year": "2023", "Revenue": 120, "Taxes": 5}, {"year": 2022.0, "Revenue": 100}],
+        {"year": 2023, "Revenue": 120},
+    ])
+    assert records == [{"year": 2022.0, "Revenue": 100}, {"year": 2023, "Revenue": 120, "Taxes": 5}]
+    assert conflicts == []
+
+def test_merge_reports_conflicts():
+    records, conflicts = merge_year_records([
+        [{"year": 2023, "Revenue": 120}],
+        [{"year": 2023, "Revenue": 0}],
+        [{"year": 2023, "Revenue": 125}, {"Revenue": 1}, "noise"],
+    ])
+    assert records == [{"year": 2023, "Revenue": 120}]
+    assert conflicts == [{"year": "2023", "field": "Revenue", "kept": 120, "dropped": 125, "chunk": 2}]
+
+def test_chunked_extraction_against_mock(mock_openai):
+    mock = mock_openai({"records": MODEL_RECORDS})
+    records = extract.vision_extract_chunked('sk-test', pages(5), '', chunk_size=2, concurrency=2)
+    assert mock.requests == 3
+    assert records == MODEL_RECORDS
+
+def test_extract_records_derives_totals(mock_openai):
+    mock = mock_openai({"records": MODEL_RECORDS})
+    records = extract.extract_records('sk-test', pages(2), '')
+    assert mock.requests == 1
+    assert [r["Total add backs"] for r in records] == [40, 47]
+    assert all(r["Taxes"] == 0 for r in records)
+
+def test_spreadsheet_records_take_precedence(mock_openai):
+    mock_openai(MODEL_RECORDS)
+    records = extract.extract_records('sk-test', pages(2), '', records=[{"year": 2023, "Revenue": 1250}],
+                                      chunk_size=1)
+    assert [r["Revenue"] for r in records] == [1000, 1250]
@@ -0,0 +1,58 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+import imageopt
+
+def page(angle=0.0, size=(1654, 2339)):
+    img = Image.new('L', size, 255)
+    d = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=28)
+    for i in range(25):
+        d.text((200, 400 + i * 55), f"Expense line {i}    {1000 + i * 37:,}    {2000 + i * 41:,}", fill=0, font=font)
+    return img.rotate(angle, resample=Image.BICUBIC, fillcolor=255) if angle else img
+
+def encoded(img, fmt='PNG'):
+    buf = BytesIO()
+    img.save(buf, format=fmt)
+    return buf.getvalue()
+
+def test_model_size_and_tokens():
+    assert imageopt.model_size(1654, 2339) == (768, 1086)
+    assert imageopt.model_size(400, 300) == (400, 300)
+    assert imageopt.estimate_tokens(1654, 2339) == 85 + 170 * 2 * 3
+    assert imageopt.estimate_tokens(1654, 2339, 'low') == 85
+
+def test_trim_margins_keeps_the_content_and_padding():
+    img = Image.new('L', (1000, 1000), 255)
+    ImageDraw.Draw(img).rectangle((300, 400, 500, 450), fill=0)
+    assert imageopt.trim_margins(img, pad=10).size == (221, 71)
+    assert imageopt.trim_margins(Image.new('L', (50, 50), 255)).size == (50, 50)
+
+@pytest.mark.parametrize("angle", [-2.0, 1.5])
+def test_skew_is_undone(angle):
+    assert abs(imageopt.estimate_skew(page(angle)) + angle) <= 0.25
+    assert imageopt.estimate_skew(page()) == 0.0
+
+def test_optimize_page_shrinks_bytes_and_tokens():
+    data = encoded(page(1.0).convert('RGB'))
+    out, stats = imageopt.optimize_page(data, fmt='jpeg', quality=70)
+    with Image.open(BytesIO(out)) as img:
+        assert (img.format, img.mode) == ('JPEG', 'L')
+        assert max(img.size) <= imageopt.MAX_SIDE and min(img.size) <= imageopt.SHORT_SIDE
+    assert stats["bytes_before"] == len(data) and stats["bytes_after"] == len(out) < len(data)
+    assert stats["tokens_after"] < stats["tokens_before"]
+    _, low = imageopt.optimize_page(data, detail='low', fmt='WEBP')
+    assert low["tokens_after"] == imageopt.BASE_TOKENS
+
+def test_payload_stats_totals():
+    stats = imageopt.PayloadStats()
+    for _ in range(2):
+        stats.add({"bytes_before": 2_000_000, "bytes_after": 500_000, "tokens_before": 1105, "tokens_after": 765})
+    assert stats.summary() == "2 page(s): 4.00 MB -> 1.00 MB, ~2210 -> ~1530 image tokens"
+
+def test_compare_records():
+    golden = [{"year": 2022, "Revenue": 100, "Taxes": 5}, {"year": 2023, "Revenue": 120}]
+    records = [{"year": "2022", "Revenue": 100, "Taxes": 6}]
+    assert imageopt.compare_records(records, golden) == (3, [("2022", "Taxes", 5, 6), ("2023", "Revenue", 120, None)])
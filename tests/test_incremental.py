@@ -0,0 +1,88 @@
+import json
+import os
+
+import openpyxl
+import pytest
+
+from compiler import fill_manifest_path, map_to_excel
+
+ENGINES = ['openpyxl', 'patch']
+
+def records(revenue=100, cogs=40):
+    return [{"year": 2022, "Revenue": revenue, "Cost of Goods Sold (COGS)": cogs},
+            {"year": 2023, "Revenue": 120, "Cost of Goods Sold (COGS)": 50}]
+
+def cells(path, *refs):
+    ws = openpyxl.load_workbook(path).active
+    return [ws[ref].value for ref in refs]
+
+def manifest(path):
+    with open(fill_manifest_path(path)) as f:
+        return json.load(f)
+
+def set_cells(path, **values):
+    wb = openpyxl.load_workbook(path)
+    for ref, value in values.items():
+        wb.active[ref] = value
+    wb.save(path)
+
+@pytest.fixture
+def output(tmp_path):
+    return str(tmp_path / 'deal.xlsx')
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_unchanged_data_skips_the_save(template, output, engine):
+    map_to_excel(records(), template, output, incremental=True, engine=engine)
+    assert cells(output, 'C4', 'D4', 'C5') == [100, 120, 40]
+    mtime = os.stat(output).st_mtime_ns
+    map_to_excel(records(), template, output, incremental=True, engine=engine)
+    assert os.stat(output).st_mtime_ns == mtime
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_only_changed_values_are_written(template, output, engine, caplog):
+    map_to_excel(records(), template, output, incremental=True, engine=engine)
+    caplog.set_level('INFO', logger='compiler')
+    map_to_excel(records(revenue=110), template, output, incremental=True, engine=engine)
+    assert cells(output, 'C4', 'D4', 'C5') == [110, 120, 40]
+    assert [r.getMessage() for r in caplog.records if ':' in r.getMessage()] == ["2022 Revenue: 100 -> 110"]
+    assert manifest(output)["cells"]["2022"]["Revenue"] == 110
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_skipped_zero_is_not_recorded_as_written(template, output, engine):
+    set_cells(template, C4=7)
+    map_to_excel(records(revenue=0), template, output, incremental=True, engine=engine)
+    assert cells(output, 'C4') == [7]
+    saved = manifest(output)
+    assert saved["requested"]["2022"]["Revenue"] == 0
+    assert "Revenue" not in saved["cells"]["2022"]
+    # A real value later still reaches the cell
+    map_to_excel(records(revenue=5), template, output, incremental=True, engine=engine)
+    assert cells(output, 'C4') == [5]
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_zero_over_a_written_value_keeps_it(template, output, engine, caplog):
+    map_to_excel(records(), template, output, incremental=True, engine=engine)
+    caplog.set_level('INFO', logger='compiler')
+    map_to_excel(records(revenue=0), template, output, incremental=True, engine=engine)
+    assert cells(output, 'C4') == [100]
+    assert any("2022 Revenue: 0 not written" in r.getMessage() for r in caplog.records)
+    saved = manifest(output)
+    assert (saved["requested"]["2022"]["Revenue"], saved["cells"]["2022"]["Revenue"]) == (0, 100)
+    # Asking for 0 again is no change
+    mtime = os.stat(output).st_mtime_ns
+    map_to_excel(records(revenue=0), template, output, incremental=True, engine=engine)
+    assert os.stat(output).st_mtime_ns == mtime
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_template_change_forces_a_full_fill(template, output, engine):
+    map_to_excel(records(), template, output, incremental=True, engine=engine)
+    set_cells(template, B1="Revised deal")
+    map_to_excel(records(), template, output, incremental=True, engine=engine)
+    assert cells(output, 'B1', 'C4') == ["Revised deal", 100]
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_edited_output_is_not_trusted(template, output, engine):
+    map_to_excel(records(), template, output, incremental=True, engine=engine)
+    set_cells(output, C5=999)
+    map_to_excel(records(), template, output, incremental=True, engine=engine)
+    assert cells(output, 'C5') == [40]
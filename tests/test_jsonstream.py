@@ -0,0 +1,50 @@
+import json
+
+from jsonstream import RecordStreamParser
+
+RECORDS = [{"year": 2022, "Revenue": 100, "Notes": "a {brace} and \"quote\""}, {"year": 2023, "Revenue": 120}]
+
+def feed_in_pieces(parser, text, size=7):
+    out = []
+    for i in range(0, len(text), size):
+        out.extend(parser.feed(text[i:i + size]))
+    return out
+
+def test_records_split_across_chunks():
+    parser = RecordStreamParser()
+    assert feed_in_pieces(parser, json.dumps(RECORDS)) == RECORDS
+    assert not parser.truncated
+    assert parser.errors == []
+
+def test_fences_commentary_and_trailing_commas():
+    text = 'Here you go:\n```json\n[{"year": 2022, "Revenue": 100,},\n {"year": 2023, "Revenue": 120},]\n```\nDone.'
+    parser = RecordStreamParser()
+    assert parser.feed(text) == [{"year": 2022, "Revenue": 100}, {"year": 2023, "Revenue": 120}]
+
+def test_truncated_output_keeps_complete_records():
+    text = json.dumps(RECORDS)
+    parser = RecordStreamParser()
+    records = feed_in_pieces(parser, text[:text.index('"year": 2023') + 12])
+    assert records == RECORDS[:1]
+    assert parser.truncated
+
+def test_nested_records():
+    parser = RecordStreamParser(nested=True)
+    assert feed_in_pieces(parser, json.dumps({"records": RECORDS})) == RECORDS
+    assert not parser.truncated
+
+def test_nested_truncated():
+    text = json.dumps({"records": RECORDS})
+    parser = RecordStreamParser(nested=True)
+    assert parser.feed(text[:-20]) == RECORDS[:1]
+    assert parser.truncated
+
+def test_top_level_parser_returns_the_wrapper_whole():
+    # Without nested=True the {"records": [...]} wrapper is the record
+    parser = RecordStreamParser()
+    assert parser.feed(json.dumps({"records": RECORDS})) == [{"records": RECORDS}]
+
+def test_undecodable_object_is_reported():
+    parser = RecordStreamParser()
+    assert parser.feed('[{"year": 2022, "Revenue": 1 2}, {"year": 2023}]') == [{"year": 2023}]
+    assert parser.errors == ['{"year": 2022, "Revenue": 1 2}']
@@ -0,0 +1,67 @@
+import pytest
+
+from mapper import FieldMapper
+from schema import DERIVED_FIELDS, FIELD_NAMES
+
+@pytest.fixture
+def mapper():
+    return FieldMapper(FIELD_NAMES)
+
+def mapped(mapper, entry):
+    records, unresolved = mapper.map_records([dict(entry, year=2023)])
+    return records[0], unresolved
+
+@pytest.mark.parametrize("label, target, how", [
+    ("Revenue", "Revenue", "exact"),
+    ("Turnover", "Revenue", "synonym"),
+    ("Depreciation & Amortisation", "Plus Depreciation & Amortization", "synonym"),
+    ("Interest", "Plus Interest", "synonym"),
+    ("Operating expenses", "Less Operating Expenses", "synonym"),
+    ("Cost of good sold", "Cost of Goods Sold (COGS)", "fuzzy"),
+    ("Rent", None, "unresolved"),
+])
+def test_resolve(mapper, label, target, how):
+    assert mapper.resolve(label) == (target, how)
+
+@pytest.mark.parametrize("label", ["Total income", "Expenses", "Total expenses"])
+def test_ambiguous_totals_are_not_synonyms(mapper, label):
+    # These usually include other lines (e.g. COGS), so the model decides
+    assert mapper.resolve(label) == (None, "unresolved")
+
+def test_line_and_subtotal_are_not_summed(mapper):
+    record, unresolved = mapped(mapper, {"Sales": 100, "Total sales": 100})
+    assert record["Revenue"] == 100
+    assert unresolved == []
+
+def test_total_preferred_at_same_level(mapper):
+    record, _ = mapped(mapper, {"Sales": 60, "Total sales": 100})
+    assert record["Revenue"] == 100
+
+def test_better_match_level_wins(mapper):
+    record, unresolved = mapped(mapper, {"Turnover": 90, "Revenue": 100})
+    assert record["Revenue"] == 100
+    assert unresolved == []
+
+def test_same_level_tie_is_reported(mapper):
+    record, unresolved = mapped(mapper, {"Sales": 60, "Turnover": 40})
+    assert record["Revenue"] == 60
+    assert unresolved == ["Sales", "Turnover"]
+
+def test_learned_decisions(mapper):
+    mapper.learn({"Total expenses": "Less Operating Expenses", "Rent": None})
+    record, unresolved = mapped(mapper, {"Total expenses": 50, "Rent": 10})
+    assert record["Less Operating Expenses"] == 50
+    assert unresolved == []
+    assert mapper.resolve("Rent") == (None, "ignored")
+
+def test_numbers_and_units(mapper):
+    record, _ = mapped(mapper, {"Revenue ($000)": "1,200", "Interest": "(3)"})
+    assert record["Revenue"] == 1200000
+    assert record["Plus Interest"] == -3
+    record, _ = mapped(mapper, {"Revenue": "$1.5", "units": "millions"})
+    assert record["Revenue"] == 1500000
+
+def test_missing_fields_default_to_zero_except_totals(mapper):
+    record, _ = mapped(mapper, {"Revenue": 100})
+    assert record["Taxes"] == 0
+    assert not set(DERIVED_FIELDS) & set(record)
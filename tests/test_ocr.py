@@ -0,0 +1,80 @@
+from io import BytesIO
+
+from PIL import Image
+
+import apiclient
+import extract
+import ocr
+from mapper import FieldMapper
+from ocr import Cell, Word
+from schema import FIELD_NAMES
+
+STATEMENT = """[Text of a.pdf, page 2]
+Profit and Loss
+                      2022        2023
+Revenue             45,000      52,000
+Taxes                1,200
+Plus Interest     300   400   500
+Directors' notes follow"""
+
+def words(*rows):
+    # (text, left) pairs per row, 40 px high rows, 60 px wide words
+    return [Word(text, conf, left, 40 * y, 60, 30) for y, row in enumerate(rows) for text, left, conf in row]
+
+def test_text_pages_fill_the_rightmost_years():
+    cells, found = ocr.parse_table(ocr.text_words(STATEMENT), FieldMapper(FIELD_NAMES), aligned=False)
+    assert found
+    got = {(c.year, c.field): (c.value, c.conf) for c in cells}
+    assert got[("2022", "Revenue")] == (45000, 100) and got[("2023", "Revenue")] == (52000, 100)
+    # One number is taken as the latest year
+    assert got[("2023", "Taxes")] == (1200, 100) and ("2022", "Taxes") not in got
+    # More numbers than years: the last ones are kept but marked uncertain
+    assert got[("2022", "Plus Interest")] == (400, ocr.MIN_CONFIDENCE - 1)
+    assert got[("2023", "Plus Interest")] == (500, ocr.MIN_CONFIDENCE - 1)
+
+def test_scanned_numbers_go_to_the_nearest_year_column():
+    page = words([("FY2022", 400, 95), ("FY2023", 600, 95)],
+                 [("Revenue", 50, 96), ("$", 380, 90), ("45,000", 405, 91), ("52,000", 598, 60)],
+                 [("Taxes", 50, 96), ("(1,200)", 200, 95)],
+                 [("Revenu", 50, 96), ("7", 400, 99)])
+    cells, found = ocr.parse_table(page, FieldMapper(FIELD_NAMES), page=3)
+    assert [(c.year, c.field, c.value, c.conf) for c in cells] == [
+        ("2022", "Revenue", 45000, 91), ("2023", "Revenue", 52000, 60),
+        # Well clear of every year column: placed, but not trusted
+        ("2022", "Taxes", -1200, ocr.MIN_CONFIDENCE - 1),
+        # A label matched only fuzzily caps the confidence
+        ("2022", "Revenue", 7, ocr.FUZZY_CONFIDENCE)]
+    assert {c.page for c in cells} == {3}
+
+def test_no_header_means_no_table():
+    assert ocr.parse_table(ocr.text_words("[Text of a.pdf, page 1]\nRevenue  100"), FieldMapper(FIELD_NAMES)) == ([], False)
+
+def test_most_confident_reading_wins():
+    cells = [Cell("2023", "Revenue", 100, 70, 0, None, "Revenue"), Cell("2023", "Revenue", 110, 90, 1, None, "Sales"),
+             Cell("2023", "Revenue", 120, 90, 2, None, "Revenue"), Cell("2022", "Taxes", 5, 50, 0, None, "Tax")]
+    assert ocr.cells_to_records(cells) == [{"year": 2022, "Taxes": 5}, {"year": 2023, "Revenue": 110}]
+
+def test_offline_extract_reports_pages_without_tables():
+    records, no_table = ocr.extract_pages([STATEMENT, "[Text of a.pdf, page 3]\nNotes only"], FIELD_NAMES)
+    assert [r["Revenue"] for r in records] == [45000, 52000]
+    assert no_table == [1]
+
+def test_uncertain_cells_are_read_again_by_the_model(mock_openai, monkeypatch):
+    buf = BytesIO()
+    Image.new('L', (400, 200), 255).save(buf, format='PNG')
+    page = buf.getvalue()
+    cells = [Cell("2023", "Revenue", 45, 50, 0, (10, 10, 200, 40), "Revenue ($'000)"),
+             Cell("2023", "Taxes", 3, 95, 0, (10, 50, 200, 80), "Taxes")]
+    monkeypatch.setattr(ocr, 'available', lambda: True)
+    monkeypatch.setattr(ocr, 'read_pages', lambda pages, fields, workers, lang: (list(cells), []))
+    mock = mock_openai('[{"id": 0, "value": "46"}]')
+    records, _ = ocr.extract_pages([page], FIELD_NAMES, client=apiclient.get_client('sk-test'))
+    # The model's reading replaces the uncertain cell, scaled by its label's units
+    assert records == [{"year": 2023, "Revenue": 46000, "Taxes": 3}]
+    assert mock.requests == 1
+
+def test_spreadsheet_records_take_precedence_over_ocr():
+    records, conflicts = extract.merge_year_records([[{"year": 2023, "Revenue": 100, "Taxes": 0}],
+                                                     [{"year": "2023", "Revenue": 90, "Taxes": 4}]])
+    assert records == [{"year": 2023, "Revenue": 100, "Taxes": 4}]
+    assert conflicts == [{"year": "2023", "field": "Revenue", "kept": 100, "dropped": 90, "chunk": 1}]
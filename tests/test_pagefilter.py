@@ -0,0 +1,91 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+import extract
+import pagefilter
+
+WIDTH, HEIGHT = 1654, 2339
+WORDS = ("the company has prepared these accounts in accordance with accounting standards and the "
+         "directors believe that the entity is a going concern").split()
+
+def scan(draw_page):
+    img = Image.new('L', (WIDTH, HEIGHT), 255)
+    draw_page(ImageDraw.Draw(img), ImageFont.load_default(size=28))
+    buf = BytesIO()
+    img.rotate(0.5, fillcolor=255).save(buf, format='JPEG', quality=70)
+    return buf.getvalue()
+
+def statement(seed=0):
+    rng = random.Random(seed)
+
+    def draw_page(d, font):
+        d.text((150, 260), "2022        2023        2024", fill=0, font=font)
+        for i in range(30):
+            y = 340 + i * 50
+            d.text((150, y), f"Expense line {i}", fill=0, font=font)
+            for j in range(3):
+                d.text((900 + j * 230, y), f"{rng.randint(1000, 999999):,}", fill=0, font=font)
+    return scan(draw_page)
+
+def prose(seed=0):
+    rng = random.Random(seed)
+
+    def draw_page(d, font):
+        for y in range(260, 2100, 45):
+            x = 150
+            while x < 1450:
+                word = rng.choice(WORDS)
+                d.text((x, y), word, fill=0, font=font)
+                x += d.textlength(word, font=font) + 12
+    return scan(draw_page)
+
+def cover():
+    return scan(lambda d, font: d.text((300, 800), "ACME PTY LTD  Annual Report", fill=0,
+                                       font=ImageFont.load_default(size=90)))
+
+def blank():
+    return scan(lambda d, font: None)
+
+def test_scanned_pages_are_ranked_by_layout():
+    scores = {name: pagefilter.score_image(page())[0]
+              for name, page in [("statement", statement), ("prose", prose), ("cover", cover), ("blank", blank)]}
+    assert scores["statement"] > scores["prose"] > scores["cover"] > scores["blank"] == 0.0
+
+def test_top_k_keeps_financial_scans_wherever_they_are():
+    pages = [cover(), prose(1), prose(2), prose(3), prose(4), statement(1), statement(2)]
+    kept, dropped = pagefilter.select_pages([pagefilter.score_image(p) for p in pages], max_pages=3)
+    # The two statements, and the first of the equally scored prose pages
+    assert kept == [1, 5, 6]
+    assert [i for i, _, _ in dropped] == [0, 2, 3, 4]
+
+def test_select_pages_threshold_and_order():
+    scores = [(0.9, "a"), (0.1, "b"), (0.5, "c"), (0.7, "d")]
+    kept, dropped = pagefilter.select_pages(scores, max_pages=2, min_score=0.2)
+    assert kept == [0, 3]
+    assert [(i, reason.split(';')[1].strip()) for i, _, reason in dropped] == [
+        (1, "score 0.10 < 0.20"), (2, "score 0.50 not in top 2")]
+
+def test_score_text():
+    statement_text = "Profit and Loss  2022 2023\nSales 1,200 1,350\nCost of sales (400) (420)\nWages 300 310"
+    assert pagefilter.score_text(statement_text)[0] > pagefilter.score_text("Dear shareholders, welcome.")[0]
+
+@pytest.mark.parametrize("pool", [None, "threads"])
+def test_filter_specs_scores_scans_in_the_pool(monkeypatch, pool):
+    rendered = {1: cover(), 2: prose(), 3: statement()}
+    calls = []
+
+    def render_page(path, page_no, dpi=None, grayscale=False, **options):
+        calls.append((page_no, dpi))
+        return rendered[page_no]
+    monkeypatch.setattr(extract, 'render_page', render_page)
+    specs = [('render', ('scan.pdf', n)) for n in (1, 2, 3)]
+    specs.insert(1, ('text', "[Text of a.pdf, page 1]\nNotes"))
+    with ThreadPoolExecutor(2) as executor:
+        kept, dropped = extract.filter_specs(specs, max_pages=2, pool=executor if pool else None)
+    assert kept == [specs[2], specs[3]]
+    assert [label for label, _, _ in dropped] == ["scan.pdf, page 1", "Text of a.pdf, page 1"]
+    assert sorted(calls) == [(1, extract.THUMBNAIL_DPI), (2, extract.THUMBNAIL_DPI), (3, extract.THUMBNAIL_DPI)]
@@ -0,0 +1,113 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import apiclient
+from apiclient import RateLimiter
+
+class Clock:
+    """
+    Stands in for the time module: waiting on the limiter advances it instantly.
+    """
+    def __init__(self):
+        self.now = 1000.0
+        self.waits = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(apiclient, 'time', SimpleNamespace(monotonic=clock.monotonic, sleep=clock.sleep))
+    return clock
+
+def limiter(clock, rpm, tpm):
+    limiter = RateLimiter(rpm, tpm)
+    cond = threading.Condition()
+
+    def wait(seconds):
+        clock.waits.append(seconds)
+        clock.sleep(seconds)
+    cond.wait = wait
+    limiter._cond = cond
+    return limiter
+
+def test_requests_per_minute(clock):
+    lim = limiter(clock, rpm=60, tpm=10**6)
+    for _ in range(60):
+        lim.acquire(1)
+    assert clock.waits == []
+    lim.acquire(1)
+    assert sum(clock.waits) == pytest.approx(1.0)
+
+def test_tokens_per_minute(clock):
+    lim = limiter(clock, rpm=1000, tpm=600)
+    lim.acquire(600)
+    lim.acquire(300)
+    assert sum(clock.waits) == pytest.approx(30.0, abs=0.1)
+
+def test_request_larger_than_the_bucket_waits_for_a_full_bucket(clock):
+    lim = limiter(clock, rpm=1000, tpm=600)
+    lim.acquire(100)
+    lim.acquire(10**6)
+    assert sum(clock.waits) == pytest.approx(10.0, abs=0.1)
+
+def test_rate_limit_halves_the_rate_and_success_recovers_it(clock):
+    lim = limiter(clock, rpm=60, tpm=600)
+    lim.acquire(500)
+    lim.on_rate_limited(500)
+    assert lim.scale == 0.5
+    # The rejected request's tokens are back, but the next request waits at half rate
+    lim.acquire(500)
+    assert sum(clock.waits) == pytest.approx(2.0, abs=0.05)
+    for _ in range(20):
+        lim.on_success()
+    assert lim.scale == 1.0
+
+def test_wait_past_the_deadline_raises(clock):
+    lim = limiter(clock, rpm=1, tpm=10**6)
+    lim.acquire(1)
+    with pytest.raises(TimeoutError):
+        lim.acquire(1, deadline=clock.now + 5)
+
+def test_token_estimates():
+    assert apiclient.estimate_page_tokens("x" * 400) == 101
+    assert apiclient.estimate_page_tokens(b"not an image") == 85 + 170 * 6
+    messages = [{"role": "system", "content": "x" * 40},
+                {"role": "user", "content": [{"type": "text", "text": "x" * 8}, {"type": "image_url"}]}]
+    assert apiclient.estimate_message_tokens(messages) == 11 + 3 + 85 + 170 * 4
+
+def test_chat_backs_off_and_retries_rate_limits(clock):
+    import openai
+    client = apiclient.ModelClient('sk-test', rpm=60, tpm=10**6, max_retries=2)
+    client.limiter = limiter(clock, 60, 10**6)
+    calls = []
+
+    def create(**request):
+        calls.append(clock.now)
+        if len(calls) < 3:
+            error = openai.RateLimitError.__new__(openai.RateLimitError)
+            error.response = SimpleNamespace(headers={'retry-after': '5'})
+            raise error
+        return "ok"
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    assert client.chat(messages=[{"role": "user", "content": "hi"}], model="m") == "ok"
+    assert len(calls) == 3
+    assert calls[1] - calls[0] >= 5 and calls[2] - calls[1] >= 5
+    assert client.limiter.scale == pytest.approx(0.25 * 1.05)
+
+def test_chat_gives_up_after_max_retries(clock):
+    import openai
+    client = apiclient.ModelClient('sk-test', max_retries=1)
+    client.limiter = limiter(clock, 60, 10**6)
+
+    def create(**request):
+        raise openai.APITimeoutError(request=None)
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    with pytest.raises(openai.APITimeoutError):
+        client.chat(messages=[], model="m")
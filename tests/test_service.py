@@ -0,0 +1,100 @@
+import json
+import threading
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import openpyxl
+import pytest
+
+import service
+
+@pytest.fixture
+def deal(template):
+    wb = openpyxl.load_workbook(template)
+    wb.active["C4"], wb.active["D4"] = 100, 120
+    wb.save(template)
+    return template
+
+@pytest.fixture
+def scheduler(tmp_path):
+    return service.Scheduler(workers=2, tenant_limit=1, root=str(tmp_path))
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    def start(tokens=None):
+        srv, scheduler = service.serve(port=0, workers=2, root=str(tmp_path), tokens=tokens)
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        servers.append(srv)
+        return f"http://127.0.0.1:{srv.server_address[1]}"
+    servers = []
+    monkeypatch.delenv(service.TOKEN_ENV_VAR, raising=False)
+    yield start
+    for srv in servers:
+        srv.shutdown()
+        srv.server_close()
+
+def call(url, method='GET', body=None, token=None):
+    headers = {'Authorization': f"Bearer {token}"} if token else {}
+    req = Request(url, data=body, method=method, headers=headers)
+    try:
+        with urlopen(req) as resp:
+            return resp.status, json.load(resp)
+    except HTTPError as e:
+        return e.code, json.load(e)
+
+def test_tenants_take_turns(scheduler):
+    jobs = [service.Job({"tenant": t}) for t in ("a", "a", "b")]
+    with scheduler._cond:
+        scheduler._queue.extend(jobs)
+        scheduler._running["a"] = 1
+        # a is at its limit, so b's job jumps the queue
+        assert scheduler._next() is jobs[2]
+        assert scheduler._next() is None
+        scheduler._running["a"] = 0
+        assert scheduler._next() is jobs[0]
+        scheduler._queue.clear()
+
+@pytest.mark.parametrize("request_, error", [
+    (["not", "a", "job"], "JSON object"),
+    ({"files": []}, "one or more file paths"),
+    ({"files": "a.pdf"}, "one or more file paths"),
+    ({"files": ["x.pdf"], "engine": "magic"}, "engine must be"),
+    ({"files": ["x.pdf"]}, "needs an api_key"),
+    ({"files": ["x.pdf"], "engine": "ocr"}, "needs an api_key"),
+    ({"files": ["/etc/passwd"], "engine": "offline"}, "outside the service root"),
+    ({"files": ["../x.pdf"], "engine": "offline"}, "outside the service root"),
+    ({"files": ["x.pdf"], "engine": "offline", "output": "/tmp/elsewhere.xlsx"}, "outside the service root"),
+    ({"files": ["x.pdf"], "engine": "offline", "spec": "/etc/spec.json"}, "outside the service root"),
+    ({"files": ["missing.pdf"], "engine": "offline"}, "not found"),
+])
+def test_bad_jobs_are_rejected(scheduler, tmp_path, request_, error):
+    (tmp_path / "x.pdf").write_bytes(b"%PDF")
+    with pytest.raises(ValueError, match=error):
+        scheduler.submit(request_)
+    assert scheduler.jobs == {}
+
+def test_job_runs_and_is_private_to_its_tenant(server, deal):
+    url = server()
+    status, job = call(f"{url}/jobs", 'POST', json.dumps({"files": [deal], "engine": "offline", "tenant": "ann"}).encode())
+    assert status == 202 and job["tenant"] == "ann"
+    status = service.wait_for_job(url, job["id"], interval=0.01, tenant="ann")
+    assert [r["Revenue"] for r in status["records"]] == [100, 120]
+    assert call(f"{url}/jobs/{job['id']}")[0] == 404
+    assert call(f"{url}/jobs/{job['id']}?tenant=bob")[0] == 404
+
+@pytest.mark.parametrize("body", [b"[1, 2]", b'"job"', b"{not json"])
+def test_bad_bodies_are_400(server, body):
+    assert call(f"{server()}/jobs", 'POST', body)[0] == 400
+
+def test_tokens_decide_the_tenant(server, deal, monkeypatch):
+    url = server(tokens={"t-ann": "ann", "t-bob": "bob"})
+    body = json.dumps({"files": [deal], "engine": "offline", "tenant": "bob"}).encode()
+    assert call(f"{url}/jobs", 'POST', body)[0] == 401
+    assert call(f"{url}/jobs", 'POST', body, token="wrong")[0] == 401
+    status, job = call(f"{url}/jobs", 'POST', body, token="t-ann")
+    assert job["tenant"] == "ann"
+    assert call(f"{url}/jobs/{job['id']}?tenant=ann")[0] == 401
+    assert call(f"{url}/jobs/{job['id']}", token="t-bob")[0] == 404
+    assert call(f"{url}/jobs", token="t-bob") == (200, [])
+    monkeypatch.setenv(service.TOKEN_ENV_VAR, "t-ann")
+    assert service.wait_for_job(url, job["id"], interval=0.01)["status"] == "done"
@@ -0,0 +1,42 @@
+import os
+
+import openpyxl
+import pytest
+
+import compiler
+from compiler import map_to_excel_bulk, map_to_excel_sheets, sheet_title
+
+def test_sheet_titles_are_valid_and_unique_within_31_characters():
+    taken = {'p&l'}
+    long = "Acme Holdings International Pty Ltd"
+    titles = [sheet_title(name, taken) for name in [long, long, long.upper(), "a/b:c", "P&L", ""]]
+    assert titles == [long[:31], long[:27] + " (2)", long.upper()[:27] + " (3)", "a_b_c", "P&L (2)", "Sheet"]
+    assert all(len(t) <= 31 for t in titles)
+
+def test_every_deal_gets_a_filled_sheet(template, tmp_path):
+    wb = openpyxl.load_workbook(template)
+    wb.create_sheet("Summary")["A1"] = "='P&L'!C4"
+    wb.save(template)
+    out = str(tmp_path / 'deals.xlsx')
+    name = "Acme Holdings International Pty Ltd"
+    map_to_excel_sheets([(name, [{"year": 2022, "Revenue": 100}]),
+                         (name, [{"year": 2023, "Revenue": 200}])], template, out)
+    wb = openpyxl.load_workbook(out)
+    # The template stays so the summary formula still points at a sheet
+    assert wb.sheetnames == ["P&L", "Summary", name[:31], name[:27] + " (2)"]
+    assert wb["Summary"]["A1"].value == "='P&L'!C4"
+    assert wb.active.title == name[:31]
+    assert (wb[name[:31]]["C4"].value, wb[name[:31]]["D4"].value) == (100, None)
+    assert wb[name[:27] + " (2)"]["D4"].value == 200
+    assert wb["P&L"]["C4"].value is None
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_bulk_restores_the_template_between_deals(template, tmp_path, workers):
+    compiler._template_cache.clear()
+    deals = [("a", [{"year": 2022, "Revenue": 100, "Cost of Goods Sold (COGS)": 40}]), ("b", [{"year": 2023, "Revenue": 200}])]
+    outputs = map_to_excel_bulk(deals, template, str(tmp_path / 'out'), workers=workers)
+    assert [os.path.basename(p) for p in outputs] == ["a.xlsx", "b.xlsx"]
+    a, b = (openpyxl.load_workbook(p).active for p in outputs)
+    assert (a["C4"].value, a["C5"].value, a["D4"].value) == (100, 40, None)
+    assert (b["C4"].value, b["C5"].value, b["D4"].value) == (None, None, 200)
+    assert b["B1"].value == "Synthetic deal"
@@ -0,0 +1,71 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import store
+from store import Store
+
+def deal(revenue, years=(2022, 2023), **fields):
+    return [{"year": yr, "Revenue": revenue + i, **fields} for i, yr in enumerate(years)]
+
+def add_deals(path, prefix, count):
+    # Runs in a separate process, with its own Store on the same directory
+    s = Store(path)
+    for i in range(count):
+        s.append(f"{prefix}-{i}", deal(100 * i))
+    return count
+
+def test_append_and_query(tmp_path):
+    s = Store(str(tmp_path))
+    assert s.append("a", deal(100, Taxes=10) + [{"Revenue": 5}]) == 2
+    s.extend([("b", deal(300), "b.pdf"), ("c", deal(200, years=(2023,)), None)])
+    assert s.aggregate("Revenue") == {2022: 200.0, 2023: 200.0}
+    assert s.aggregate("Revenue", by="deal", how="sum") == {"a": 201.0, "b": 601.0, "c": 200.0}
+    assert s.aggregate("Taxes", how="count") == {2022: 1.0, 2023: 1.0}
+    assert s.where("Revenue", gt=150, year=2023) == [("b", 2023, 301.0), ("c", 2023, 200.0)]
+    assert s.metric("Taxes/Revenue", [0])[0] == pytest.approx(0.1)
+    assert math.isnan(s.metric("Taxes", [2])[0])
+    assert s.summary()["deal_years"] == 5
+    with pytest.raises(KeyError):
+        s.metric("EBITDA")
+
+def test_adding_a_deal_again_replaces_it(tmp_path):
+    s = Store(str(tmp_path))
+    s.append("a", deal(100))
+    s.append("a", deal(500, years=(2024,)))
+    assert s.aggregate("Revenue", by="deal") == {"a": 500.0}
+    assert s.summary()["years"] == [2024]
+
+def test_columns_grow_past_their_capacity(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, 'INITIAL_CAPACITY', 4)
+    s = Store(str(tmp_path))
+    for i in range(5):
+        s.append(str(i), deal(i))
+    assert s.index["capacity"] >= 10
+    assert s.aggregate("Revenue", how="count") == {2022: 5.0, 2023: 5.0}
+    # A fresh reader maps the grown files
+    assert Store(str(tmp_path)).aggregate("Revenue", by="deal", how="max")["4"] == 5.0
+
+def test_appends_from_other_processes_are_seen_and_not_lost(tmp_path):
+    path = str(tmp_path)
+    reader = Store(path)
+    with ProcessPoolExecutor(4) as pool:
+        assert sum(pool.map(add_deals, [path] * 4, "wxyz", [25] * 4)) == 100
+    summary = reader.summary()
+    assert (summary["deals"], summary["deal_years"]) == (100, 200)
+    assert len(reader.index["deals"]) == 100
+
+def test_unwritable_store_does_not_fail_the_extraction(tmp_path, caplog):
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    store.record_extraction("a", deal(1), path=str(blocker / 'store'))
+    assert "Could not add a to the store" in caplog.text
+
+def test_deal_names_tell_same_named_files_apart(tmp_path):
+    (tmp_path / 'x').mkdir()
+    one, two = tmp_path / 'Financials.pdf', tmp_path / 'x' / 'Financials.pdf'
+    one.write_bytes(b'one')
+    two.write_bytes(b'two')
+    assert store.deal_name([str(one)]).startswith("Financials-")
+    assert store.deal_name([str(one)]) != store.deal_name([str(two)])
@@ -0,0 +1,87 @@
+import openpyxl
+import pytest
+
+import compiler
+import templatespec
+from templatespec import compile_plan, fill_workbook, validate_spec
+
+@pytest.fixture
+def workbook(tmp_path):
+    """
+    "P&L": years across row 3 from an "Item" anchor, with a formula total.
+    "Peers": years down column A, labels along row 1 (one of them an alias).
+    """
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "P&L"
+    ws["B3"], ws["C3"], ws["D3"] = "Item", 2022, "2023"
+    ws["B4"], ws["B5"], ws["B6"] = "Revenue", "Taxes", "Other Income"
+    ws["C6"], ws["D6"] = "=C4-C5", 7
+    peers = wb.create_sheet("Peers")
+    peers["B1"], peers["C1"] = "Sales", "Taxes"
+    peers["A2"], peers["A3"] = 2022, 2023
+    path = str(tmp_path / 'multi.xlsx')
+    wb.save(path)
+    compiler._template_cache.clear()
+    return path
+
+SPEC = {"sheets": [
+    {"sheet": "P&L", "entity": "target", "anchor": "item"},
+    {"sheet": "Peers", "entity": "peer", "orientation": "down", "year_col": "A", "label_row": 1,
+     "fields": ["Revenue", "Taxes"], "aliases": {"Revenue": ["Sales"]}},
+]}
+
+@pytest.mark.parametrize("spec, error", [
+    ({}, "non-empty"),
+    ({"sheets": [{"anchor": "x", "orientation": "diagonal"}]}, "orientation"),
+    ({"sheets": [{"year_row": 3}]}, "give an anchor"),
+    ({"sheets": [{"orientation": "down", "year_row": 3, "label_col": 2}]}, "give an anchor"),
+    ({"sheets": [{"anchor": "x", "fields": ["Revenue", "Profit"]}]}, r"unknown field\(s\) \['Profit'\]"),
+])
+def test_invalid_specs(spec, error):
+    with pytest.raises(ValueError, match=error):
+        validate_spec(spec)
+
+def test_plan_maps_both_orientations(workbook):
+    plan = compile_plan(openpyxl.load_workbook(workbook), SPEC)
+    assert plan.sheets == ("P&L", "Peers")
+    target = plan.entities["target"]
+    assert target[("2022", "Revenue")] == (("P&L", 4, 3),)
+    assert target[("2023", "Other Income")] == (("P&L", 6, 4),)
+    # Formula cells are never in the plan
+    assert ("2022", "Other Income") not in target
+    assert plan.entities["peer"] == {("2022", "Revenue"): (("Peers", 2, 2),), ("2023", "Revenue"): (("Peers", 3, 2),),
+                                     ("2022", "Taxes"): (("Peers", 2, 3),), ("2023", "Taxes"): (("Peers", 3, 3),)}
+
+def test_missing_anchor(workbook):
+    with pytest.raises(ValueError, match="not found on sheet 'P&L'"):
+        compile_plan(openpyxl.load_workbook(workbook), {"sheets": [{"anchor": "Line item"}]})
+
+def test_fill_writes_every_entity_in_one_pass(workbook, tmp_path):
+    out = str(tmp_path / 'out.xlsx')
+    data = {"target": [{"year": 2022, "Revenue": 100, "Other Income": 0}, {"year": "2023", "Other Income": 0, "Taxes": 9}],
+            "peer": [{"year": 2023, "Revenue": 55}]}
+    written = fill_workbook(data, workbook, SPEC, out)
+    assert written == {("P&L", 4, 3): None, ("P&L", 5, 4): None, ("Peers", 3, 2): None}
+    wb = openpyxl.load_workbook(out)
+    # 0 leaves the existing 7 alone; the formula is untouched
+    assert [wb["P&L"][ref].value for ref in ("C4", "D5", "C6", "D6")] == [100, 9, "=C4-C5", 7]
+    assert wb["Peers"]["B3"].value == 55
+
+def test_unnamed_sheets_take_the_only_entity(workbook, tmp_path, caplog):
+    spec = {"sheets": [{"sheet": "P&L", "anchor": "Item"}, {"sheet": "Peers", **SPEC["sheets"][1]}]}
+    out = str(tmp_path / 'out.xlsx')
+    fill_workbook([{"year": 2022, "Revenue": 100}], workbook, spec, out)
+    wb = openpyxl.load_workbook(out)
+    assert (wb["P&L"]["C4"].value, wb["Peers"]["B2"].value) == (100, None)
+    assert "No records for entity 'peer'" in caplog.text
+
+def test_plan_is_compiled_once_per_template_version(workbook, monkeypatch):
+    calls = []
+    compile_once = templatespec.compile_plan
+    monkeypatch.setattr(templatespec, 'compile_plan', lambda wb, spec: calls.append(1) or compile_once(wb, spec))
+    wb = openpyxl.load_workbook(workbook)
+    first = templatespec.template_plan(workbook, wb, SPEC)
+    assert templatespec.template_plan(workbook, wb, SPEC) is first
+    templatespec.template_plan(workbook, wb, {"sheets": SPEC["sheets"][:1]})
+    assert len(calls) == 2
@@ -0,0 +1,97 @@
+import zipfile
+
+import openpyxl
+import pytest
+
+import xlsxpatch
+from xlsxpatch import patch_sheet_xml
+
+NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+
+SHEET = (b'<worksheet><sheetData>'
+         b'<row r="2"><c r="B2" s="3"><v>1</v></c><c r="D2"><f>SUM(B2:C2)</f><v>1</v></c></row>'
+         b'<row r="5" spans="1:4"><c r="B5" t="inlineStr"><is><t>Revenue</t></is></c></row>'
+         b'</sheetData><pageMargins/></worksheet>')
+
+def test_existing_cell_is_replaced_keeping_its_style():
+    xml, written = patch_sheet_xml(SHEET, {(2, 2): 7})
+    assert b'<c r="B2" s="3"><v>7</v></c>' in xml
+    assert written == {(2, 2): b'<c r="B2" s="3"><v>1</v></c>'}
+    assert xlsxpatch.cell_value(written[(2, 2)]) == '1'
+
+def test_missing_cells_are_inserted_in_column_order():
+    xml, written = patch_sheet_xml(SHEET, {(5, 1): 'A', (5, 3): 2.5, (5, 5): 9})
+    row = xml[xml.index(b'<row r="5"'):xml.index(b'</row>', xml.index(b'<row r="5"'))]
+    refs = [xlsxpatch._attrs(c)['r'] for c in xlsxpatch.CELL_RE.findall(row)]
+    assert refs == ['A5', 'B5', 'C5', 'E5']
+    assert b'spans="1:4"' in row
+    assert written == {(5, 1): None, (5, 3): None, (5, 5): None}
+
+def test_missing_rows_are_inserted_in_order():
+    xml, _ = patch_sheet_xml(SHEET, {(1, 2): 1, (3, 2): 3, (9, 2): 9})
+    rows = [int(xlsxpatch._attrs(r)['r']) for r in xlsxpatch.ROW_RE.findall(xml)]
+    assert rows == [1, 2, 3, 5, 9]
+    assert xml.endswith(b'</sheetData><pageMargins/></worksheet>')
+
+def test_formulas_none_and_zero_over_values_are_left_alone():
+    xml, written = patch_sheet_xml(SHEET, {(2, 4): 5, (2, 2): 0, (5, 2): None})
+    assert xml == SHEET
+    assert written == {}
+
+def test_zero_fills_an_empty_cell():
+    _, written = patch_sheet_xml(SHEET, {(2, 3): 0})
+    assert written == {(2, 3): None}
+
+def test_empty_sheet_data():
+    xml, _ = patch_sheet_xml(b'<worksheet><sheetData/></worksheet>', {(1, 1): 1})
+    assert xml == b'<worksheet><sheetData><row r="1"><c r="A1"><v>1</v></c></row></sheetData></worksheet>'
+
+def test_no_sheet_data():
+    with pytest.raises(ValueError):
+        patch_sheet_xml(b'<worksheet/>', {(1, 1): 1})
+
+def test_patch_workbook_round_trip(template, tmp_path):
+    out = str(tmp_path / 'out.xlsx')
+    xlsxpatch.patch_workbook(template, out, {(4, 3): 100, (4, 4): 'n/a'})
+    ws = openpyxl.load_workbook(out).active
+    assert (ws['C4'].value, ws['D4'].value) == (100, 'n/a')
+    assert ws['B4'].value == openpyxl.load_workbook(template).active['B4'].value
+
+def test_cell_value_resolves_shared_and_rich_strings():
+    strings = ['Revenue', 'n/a']
+    assert xlsxpatch.cell_value(b'<c r="C4" t="s"><v>1</v></c>', strings) == 'n/a'
+    assert xlsxpatch.cell_value(b'<c r="C4" t="s"><v>7</v></c>', strings) is None
+    assert xlsxpatch.cell_value(b'<c r="C4" t="inlineStr"><is><r><t>a &amp; </t></r><r><t>b</t></r></is></c>') == 'a & b'
+    assert xlsxpatch.cell_value(b'<c r="C4"/>') is None
+
+def with_shared_strings(path, strings, cell):
+    """
+    Rewrites the workbook at path with a shared string table (openpyxl writes
+    inline strings) and makes cell of the active sheet point at its second entry.
+    """
+    table = ''.join(f'<si><t>{s}</t></si>' for s in strings)
+    with zipfile.ZipFile(path) as zin:
+        members = {info.filename: zin.read(info.filename) for info in zin.infolist()}
+    members['xl/sharedStrings.xml'] = f'<sst xmlns="{NS}" count="{len(strings)}">{table}</sst>'.encode()
+    members['xl/_rels/workbook.xml.rels'] = members['xl/_rels/workbook.xml.rels'].replace(
+        b'</Relationships>', b'<Relationship Id="rId9" Target="sharedStrings.xml" Type="http://schemas.'
+        b'openxmlformats.org/officeDocument/2006/relationships/sharedStrings"/></Relationships>')
+    members['[Content_Types].xml'] = members['[Content_Types].xml'].replace(
+        b'</Types>', b'<Override PartName="/xl/sharedStrings.xml" ContentType="application/'
+        b'vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/></Types>')
+    sheet, _ = patch_sheet_xml(members['xl/worksheets/sheet1.xml'], {cell: 0.5})
+    members['xl/worksheets/sheet1.xml'] = sheet.replace(b'<v>0.5</v></c>', b'<v>1</v></c>').replace(
+        f'<c r="{xlsxpatch.column_letter(cell[1])}{cell[0]}"'.encode(),
+        f'<c r="{xlsxpatch.column_letter(cell[1])}{cell[0]}" t="s"'.encode())
+    with zipfile.ZipFile(path, 'w') as zout:
+        for name, data in members.items():
+            zout.writestr(name, data)
+
+def test_previous_shared_string_is_read_from_the_table(template, tmp_path):
+    with_shared_strings(template, ['Revenue', 'n/a'], (4, 3))
+    assert openpyxl.load_workbook(template).active['C4'].value == 'n/a'
+    out = str(tmp_path / 'out.xlsx')
+    written = xlsxpatch.patch_workbook(template, out, {(4, 3): 100})
+    assert xlsxpatch.shared_strings(out) == ['Revenue', 'n/a']
+    assert xlsxpatch.cell_value(written[(4, 3)], xlsxpatch.shared_strings(out)) == 'n/a'
+    assert openpyxl.load_workbook(out).active['C4'].value == 100
@@ -0,0 +1,105 @@
+import re
+import subprocess
+
+MIN_TEXT_CHARS = 200
+YEAR_RE = re.compile(r'^(?:FY\s?)?((?:19|20)\d{2})$', re.IGNORECASE)
+
+def pdf_page_texts(pdf_path):
+    """
+    Returns the text layer of every page using poppler's pdftotext (the same
+    poppler install pdf2image relies on). Returns [] if pdftotext is unavailable.
+    """
+    try:
+        out = subprocess.run(
+            ['pdftotext', '-layout', '-enc', 'UTF-8', pdf_path, '-'],
+            check=True, capture_output=True
+        ).stdout.decode('utf-8', errors='replace')
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    pages = out.split('\f')
+    # pdftotext terminates the last page with a form feed too
+    if pages and not pages[-1].strip():
+        pages.pop()
+    return pages
+
+def has_text_layer(text):
+    # Scanned pages give no text, or a few stray characters from headers/stamps
+    alnum = sum(ch.isalnum() for ch in text)
+    return alnum >= MIN_TEXT_CHARS and any(ch.isdigit() for ch in text)
+
+def compact_text(text):
+    lines = []
+    for line in text.splitlines():
+        line = re.sub(r' {3,}', '  ', line.rstrip())
+        if line.strip():
+            lines.append(line)
+    return '\n'.join(lines)
+
+def format_page_text(source, page_no, text):
+    return f"[Text of {source}, page {page_no}]\n{compact_text(text)}"
+
+def _year(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and 1900 <= value <= 2100 and int(value) == value:
+        return int(value)
+    if isinstance(value, str):
+        m = YEAR_RE.match(value.strip())
+        if m:
+            return int(m.group(1))
+    return None
+
+def _label(value):
+    return re.sub(r'\s+', ' ', str(value)).strip().lower()
+
+def _rows(path):
+    # Imported here so PDF-only runs never load openpyxl
+    import openpyxl
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            yield ws.title, [row for row in ws.iter_rows(values_only=True) if any(v is not None for v in row)]
+    finally:
+        wb.close()
+
+def spreadsheet_text(path):
+    """
+    Renders every sheet as compact tab-separated text for the model.
+    """
+    parts = []
+    for title, rows in _rows(path):
+        lines = ['\t'.join('' if v is None else str(v) for v in row).rstrip('\t') for row in rows]
+        parts.append(f"[Sheet {title}]\n" + '\n'.join(lines))
+    return '\n\n'.join(parts)
+
+def spreadsheet_records(path, fields, min_fields=3):
+    """
+    Maps a spreadsheet straight onto the schema without a model call when it is
+    laid out like the template: a header row of years and a label column whose
+    labels match schema field names. Returns None if no sheet matches.
+    """
+    wanted = {_label(f): f for f in fields}
+    for _, rows in _rows(path):
+        for header_idx, header in enumerate(rows):
+            year_cols = {i: _year(v) for i, v in enumerate(header) if _year(v) is not None}
+            if not year_cols:
+                continue
+            records = {yr: {"year": yr} for yr in year_cols.values()}
+            matched = 0
+            for row in rows[header_idx + 1:]:
+                field = None
+                for i, v in enumerate(row):
+                    if i in year_cols:
+                        break
+                    if isinstance(v, str) and _label(v) in wanted:
+                        field = wanted[_label(v)]
+                if field is None:
+                    continue
+                matched += 1
+                for i, yr in year_cols.items():
+                    v = row[i] if i < len(row) else None
+                    records[yr][field] = v if isinstance(v, (int, float)) and not isinstance(v, bool) else 0
+            if matched >= min_fields:
+                for rec in records.values():
+                    for f in fields:
+                        rec.setdefault(f, 0)
+                return [records[yr] for yr in sorted(records)]
+    return None
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+
+ENV_VAR = "GONOGO_TRACE"
+LOG_LEVEL_ENV_VAR = "GONOGO_LOG_LEVEL"
+
+_tracer = None
+
+class _NoopSpan:
+    """
+    Returned by span() while tracing is off: a shared object whose methods do
+    nothing, so instrumented code pays one global lookup and a call.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+_NOOP = _NoopSpan()
+
+class Span:
+    __slots__ = ('tracer', 'name', 'attrs', 'start')
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.emit_span(self.name, self.start, time.perf_counter() - self.start, self.attrs)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+class Tracer:
+    """
+    Writes spans and counters either as JSON lines (one event per line, as they
+    finish) or, for paths ending in .json, as a Chrome trace (chrome://tracing,
+    Perfetto) written when the process exits.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.chrome = path.endswith('.json')
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._events = []
+        if self.chrome:
+            atexit.register(self.flush)
+        else:
+            self._file = open(path, 'a', buffering=1)
+
+    def _write(self, event):
+        with self._lock:
+            if self.chrome:
+                self._events.append(event)
+            else:
+                self._file.write(json.dumps(event, default=str) + '\n')
+
+    def emit_span(self, name, start, duration, attrs):
+        tid = threading.get_ident()
+        if self.chrome:
+            self._write({"name": name, "ph": "X", "ts": (start - self.origin) * 1e6, "dur": duration * 1e6,
+                         "pid": self.pid, "tid": tid, "args": attrs})
+        else:
+            self._write({"type": "span", "name": name, "start": round(start - self.origin, 6),
+                         "duration": round(duration, 6), "pid": self.pid, "thread": tid, **attrs})
+
+    def emit_count(self, name, value, attrs):
+        now = time.perf_counter() - self.origin
+        if self.chrome:
+            self._write({"name": name, "ph": "C", "ts": now * 1e6, "pid": self.pid, "args": {name: value}})
+        else:
+            self._write({"type": "count", "name": name, "value": value, "time": round(now, 6),
+                         "pid": self.pid, **attrs})
+
+    def flush(self):
+        with self._lock:
+            if self.chrome:
+                with open(self.path, 'w') as f:
+                    json.dump({"traceEvents": self._events}, f)
+            else:
+                self._file.flush()
+
+def enable(path):
+    global _tracer
+    _tracer = Tracer(path)
+    return _tracer
+
+def enabled():
+    return _tracer is not None
+
+def span(name, **attrs):
+    """
+    Times a block: `with span("excel.save", path=p) as s: ...; s.set(cells=n)`.
+    """
+    if _tracer is None:
+        return _NOOP
+    return Span(_tracer, name, attrs)
+
+def count(name, value=1, **attrs):
+    if _tracer is not None:
+        _tracer.emit_count(name, value, attrs)
+
+def setup(trace_path=None, verbose=False):
+    """
+    Configures logging and tracing for a CLI entry point. Tracing is enabled by
+    trace_path or the GONOGO_TRACE environment variable.
+    """
+    level = logging.DEBUG if verbose else os.environ.get(LOG_LEVEL_ENV_VAR, 'INFO').upper()
+    logging.basicConfig(level=level, format='%(message)s')
+    if not verbose:
+        # The HTTP client logs every request at INFO (httpx2 in newer openai releases)
+        for name in ('httpx', 'httpx2'):
+            logging.getLogger(name).setLevel(logging.WARNING)
+    trace_path = trace_path or os.environ.get(ENV_VAR)
+    if trace_path and _tracer is None:
+        enable(trace_path)
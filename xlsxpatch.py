@@ -0,0 +1,210 @@
+import os
+import re
+import zipfile
+import posixpath
+from xml.sax.saxutils import escape, unescape
+
+import tracing
+
+ROW_RE = re.compile(rb'<row\b[^>]*?(?:/>|>.*?</row>)', re.DOTALL)
+CELL_RE = re.compile(rb'<c\b[^>]*?(?:/>|>.*?</c>)', re.DOTALL)
+ATTR_RE = re.compile(rb'\b([\w:]+)="([^"]*)"')
+SHEET_DATA_RE = re.compile(rb'<sheetData\s*/>|<sheetData\b[^>]*>(.*?)</sheetData>', re.DOTALL)
+REF_RE = re.compile(r'^([A-Z]+)(\d+)$')
+SI_RE = re.compile(rb'<si\b[^>]*?(?:/>|>.*?</si>)', re.DOTALL)
+TEXT_RE = re.compile(rb'<t\b[^>]*?(?:/>|>(.*?)</t>)', re.DOTALL)
+PHONETIC_RE = re.compile(rb'<rPh\b.*?</rPh>', re.DOTALL)
+# Elements that must follow calcPr in workbook.xml, per the schema order
+AFTER_CALC_PR = (b'<oleSize', b'<customWorkbookViews', b'<pivotCaches', b'<smartTagPr', b'<smartTagTypes',
+                 b'<webPublishing', b'<fileRecoveryPr', b'<webPublishObjects', b'<extLst', b'</workbook>')
+
+def column_letter(col):
+    letters = ''
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def column_index(letters):
+    index = 0
+    for ch in letters:
+        index = index * 26 + ord(ch) - 64
+    return index
+
+def _attrs(tag):
+    return {k.decode(): v.decode() for k, v in ATTR_RE.findall(tag[:tag.index(b'>') + 1])}
+
+def _part(zf, rel_match):
+    # Zip member of the first workbook relationship whose attributes satisfy rel_match
+    rels = zf.read('xl/_rels/workbook.xml.rels')
+    for rel in re.findall(rb'<Relationship\b[^>]*/?>', rels):
+        attrs = _attrs(rel)
+        if rel_match(attrs):
+            target = attrs['Target']
+            return target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+    return None
+
+def sheet_part(zf, title=None):
+    """
+    Zip member holding the worksheet called title, or the active sheet.
+    """
+    workbook = zf.read('xl/workbook.xml')
+    sheets = re.findall(rb'<sheet\b[^>]*/?>', workbook)
+    if title is None:
+        m = re.search(rb'<workbookView\b[^>]*\bactiveTab="(\d+)"', workbook)
+        sheet = sheets[int(m.group(1)) if m else 0]
+    else:
+        matches = [s for s in sheets if unescape(_attrs(s).get('name', ''), {'&quot;': '"'}) == title]
+        if not matches:
+            raise KeyError(f"No sheet named {title!r}")
+        sheet = matches[0]
+    rid = next(v for k, v in _attrs(sheet).items() if k.endswith(':id'))
+    part = _part(zf, lambda attrs: attrs.get('Id') == rid)
+    if part is None:
+        raise KeyError(f"No relationship {rid} in workbook.xml.rels")
+    return part
+
+def _text(xml):
+    # Concatenated <t> runs of a rich or plain string, without phonetic hints
+    return ''.join(unescape((t or b'').decode('utf-8')) for t in TEXT_RE.findall(PHONETIC_RE.sub(b'', xml)))
+
+def shared_strings(path):
+    """
+    The shared string table of the workbook at path, which t="s" cells index into.
+    """
+    with zipfile.ZipFile(path) as zf:
+        part = _part(zf, lambda attrs: attrs.get('Type', '').endswith('/sharedStrings'))
+        if part is None or part not in zf.namelist():
+            return []
+        return [_text(si) for si in SI_RE.findall(zf.read(part))]
+
+def _cell_xml(ref, value, style):
+    s = f' s="{style}"' if style else ''
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{s} t="b"><v>{int(value)}</v></c>'.encode()
+    if isinstance(value, (int, float)):
+        return f'<c r="{ref}"{s}><v>{value!r}</v></c>'.encode()
+    return f'<c r="{ref}"{s} t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'.encode()
+
+def cell_value(cell, strings=()):
+    """
+    Text of a <c> element's stored value (or inline string), None if empty.
+    Shared-string cells (t="s") are looked up in strings (see shared_strings).
+    """
+    if cell is None:
+        return None
+    if b'<is>' in cell:
+        return _text(cell)
+    m = re.search(rb'<v>(.*?)</v>', cell, re.DOTALL)
+    if m is None:
+        return None
+    value = unescape(m.group(1).decode('utf-8'))
+    if _attrs(cell).get('t') == 's':
+        index = int(value)
+        return strings[index] if index < len(strings) else None
+    return value
+
+def _has_value(cell):
+    return b'<v>' in cell or b'<v ' in cell or b'<is>' in cell
+
+def _patch_row(row_xml, row_no, values, written):
+    """
+    Rewrites the addressed cells of one <row>, inserting missing ones in column order.
+    """
+    head_end = row_xml.index(b'>') + 1
+    if row_xml[head_end - 2:head_end] == b'/>':
+        head, body, tail = row_xml[:head_end - 2] + b'>', b'', b'</row>'
+    else:
+        head, body, tail = row_xml[:head_end], row_xml[head_end:-len(b'</row>')], b'</row>'
+    pending = dict(values)
+    out = []
+    for cell in CELL_RE.findall(body):
+        attrs = _attrs(cell)
+        col = column_index(REF_RE.match(attrs['r']).group(1)) if 'r' in attrs else None
+        # Cells that come before this one and do not exist yet
+        for c in sorted(k for k in pending if col is not None and k < col):
+            out.append(_cell_xml(f"{column_letter(c)}{row_no}", pending.pop(c), None))
+            written[(row_no, c)] = None
+        if col in pending:
+            value = pending.pop(col)
+            # Formula cells are left to the workbook; 0 never overwrites a value already there
+            if b'<f' in cell or (value == 0 and _has_value(cell)):
+                out.append(cell)
+                continue
+            out.append(_cell_xml(attrs['r'], value, attrs.get('s')))
+            written[(row_no, col)] = cell
+        else:
+            out.append(cell)
+    for c in sorted(pending):
+        out.append(_cell_xml(f"{column_letter(c)}{row_no}", pending[c], None))
+        written[(row_no, c)] = None
+    return head + b''.join(out) + tail
+
+def patch_sheet_xml(xml, cells):
+    """
+    Applies {(row, col): value} to a worksheet's XML, touching only the
+    addressed rows. Returns (new xml, {(row, col): original <c> bytes or None}).
+    """
+    by_row = {}
+    for (row, col), value in cells.items():
+        if value is not None:
+            by_row.setdefault(row, {})[col] = value
+    m = SHEET_DATA_RE.search(xml)
+    if m is None:
+        raise ValueError("Worksheet has no <sheetData>")
+    data = m.group(1) or b''
+    written = {}
+    out = []
+    pos = 0
+    for row_m in ROW_RE.finditer(data):
+        row_xml = row_m.group(0)
+        row_no = int(_attrs(row_xml)['r'])
+        # Rows that do not exist yet and come before this one
+        for r in sorted(k for k in by_row if k < row_no):
+            out.append(_patch_row(f'<row r="{r}"/>'.encode(), r, by_row.pop(r), written))
+        out.append(data[pos:row_m.start()])
+        out.append(_patch_row(row_xml, row_no, by_row.pop(row_no), written) if row_no in by_row else row_xml)
+        pos = row_m.end()
+    out.append(data[pos:])
+    for r in sorted(by_row):
+        out.append(_patch_row(f'<row r="{r}"/>'.encode(), r, by_row[r], written))
+    sheet_data = b'<sheetData>' + b''.join(out) + b'</sheetData>'
+    return xml[:m.start()] + sheet_data + xml[m.end():], written
+
+def set_full_calc_on_load(workbook_xml):
+    """
+    Marks the workbook for a full recalculation when opened, since cached
+    formula results no longer match the patched inputs.
+    """
+    m = re.search(rb'<calcPr\b[^>]*?/?>', workbook_xml)
+    if m:
+        tag = m.group(0)
+        if b'fullCalcOnLoad=' in tag:
+            tag = re.sub(rb'fullCalcOnLoad="[^"]*"', b'fullCalcOnLoad="1"', tag)
+        else:
+            tag = tag[:-2].rstrip() + b' fullCalcOnLoad="1"/>' if tag.endswith(b'/>') else tag[:-1] + b' fullCalcOnLoad="1">'
+        return workbook_xml[:m.start()] + tag + workbook_xml[m.end():]
+    pos = min((i for i in (workbook_xml.find(t) for t in AFTER_CALC_PR) if i >= 0), default=len(workbook_xml))
+    return workbook_xml[:pos] + b'<calcPr fullCalcOnLoad="1"/>' + workbook_xml[pos:]
+
+def patch_workbook(src, dst, cells, sheet=None):
+    """
+    Writes {(row, col): value} into one sheet of the xlsx/xlsm at src, saving
+    to dst (which may be src). Only the sheet's XML and workbook.xml are
+    rewritten; every other member (styles, drawings, charts, VBA, validations)
+    is copied unchanged. Returns {(row, col): original <c> bytes or None}.
+    """
+    tmp = dst + '.tmp'
+    with tracing.span("excel.patch", path=dst, cells=len(cells)):
+        with zipfile.ZipFile(src) as zin:
+            part = sheet_part(zin, sheet)
+            with zipfile.ZipFile(tmp, 'w') as zout:
+                for info in zin.infolist():
+                    data = zin.read(info.filename)
+                    if info.filename == part:
+                        data, written = patch_sheet_xml(data, cells)
+                    elif info.filename == 'xl/workbook.xml':
+                        data = set_full_calc_on_load(data)
+                    zout.writestr(info, data, compress_type=info.compress_type)
+        os.replace(tmp, dst)
+    return written